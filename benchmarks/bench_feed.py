@@ -0,0 +1,73 @@
+"""
+Compares the pull and push feed modes.
+
+Run with:
+$ python -m benchmarks.bench_feed
+"""
+import os
+import random
+import tempfile
+import timeit
+
+os.environ.setdefault('SERVER_SECRET', 'benchmark')
+
+from server.database import handler, interface  # noqa: E402
+from server.database.handler import db  # noqa: E402
+from server.database.models import FRIENDSHIP_ACCEPTED, Recipe, User, friendship  # noqa: E402
+from server.main import app  # noqa: E402
+
+USERS = 2000
+FRIENDS_PER_USER = 200
+RECIPES_PER_USER = 20
+PAGE_SIZE = 20
+RUNS = 200
+
+
+def populate() -> None:
+    db.session.bulk_insert_mappings(User, [
+        {'id': i, 'name': f"user{i}", 'search_name': f"user{i}", 'email': f"user{i}@example.com", 'pw_hash': ""}
+        for i in range(1, USERS + 1)
+    ])
+
+    pairs = set()
+    for user_id in range(1, USERS + 1):
+        for friend_id in random.sample(range(1, USERS + 1), FRIENDS_PER_USER // 2):
+            if friend_id != user_id:
+                pairs.add((min(user_id, friend_id), max(user_id, friend_id)))
+    db.session.execute(friendship.insert(), [
+        {'user1_id': a, 'user2_id': b, 'status': FRIENDSHIP_ACCEPTED, 'requester_id': a} for a, b in pairs
+    ])
+
+    db.session.bulk_insert_mappings(Recipe, [
+        {'name': f"recipe{i}", 'user_id': random.randint(1, USERS)} for i in range(USERS * RECIPES_PER_USER)
+    ])
+    db.session.commit()
+
+
+def bench(mode: str) -> float:
+    app.config['FEED_MODE'] = mode
+    user_ids = [random.randint(1, USERS) for _ in range(RUNS)]
+
+    def run():
+        for user_id in user_ids:
+            interface.feed_recipes(user_id, '', limit=PAGE_SIZE)
+            db.session.expunge_all()
+
+    return timeit.timeit(run, number=1) / RUNS
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'bench.db')
+
+        with app.app_context():
+            handler.init_db(app)
+            populate()
+            interface.rebuild_timelines()
+
+            for mode in ['pull', 'push']:
+                print(f"{mode}: {bench(mode) * 1000:.2f} ms per feed page")
+
+
+if __name__ == '__main__':
+    main()
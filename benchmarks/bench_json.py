@@ -0,0 +1,68 @@
+"""
+Compares encoding and decoding of typical API payloads with Flask's json module and json_codec.
+
+Run with:
+$ python -m benchmarks.bench_json
+"""
+import os
+import timeit
+
+os.environ.setdefault('SERVER_SECRET', 'benchmark')
+
+from flask import json as flask_json  # noqa: E402
+
+from server import json_codec  # noqa: E402
+from server.main import app  # noqa: E402
+
+RUNS = 2000
+
+
+def payloads() -> dict:
+    img_url = "https://example.com/recipes/images/1?v=0123456789abcdef&size=card"
+
+    return {
+        '/recipes/latest': {
+            'result': [{'id': i, 'name': f"recipe {i}", 'user': f"user {i}", 'img_url': img_url} for i in range(100)],
+            'next_cursor': "MTIzNA",
+        },
+        '/friends/list-friends': {
+            'result': [{'id': i, 'name': f"friend {i}"} for i in range(200)],
+        },
+        '/users/search': {
+            'result': [{'id': i, 'name': f"user {i}"} for i in range(50)],
+        },
+        '/recipes/get': {
+            'id': 1, 'name': "recipe", 'user': "user", 'likes': 10, 'img_url': img_url,
+            'ingredients': [{'name': f"ingredient {i}", 'unit': "dl", 'quantity': 1.5} for i in range(50)],
+            'instructions': [f"Instruction number {i}, " * 5 for i in range(20)],
+        },
+    }
+
+
+def flask_dumps(value) -> bytes:
+    # What jsonify does with the default config
+    return (flask_json.dumps(value, indent=None, separators=(',', ':')) + '\n').encode()
+
+
+def bench(function, value) -> float:
+    return RUNS / timeit.timeit(lambda: function(value), number=RUNS)
+
+
+def main() -> None:
+    print(f"json_codec uses {'orjson' if json_codec.orjson else 'the json module'}")
+
+    with app.app_context():
+        for name, value in payloads().items():
+            data = flask_dumps(value)
+
+            before = bench(flask_dumps, value)
+            after = bench(lambda v: json_codec.dumps(v, sort_keys=True), value)
+            print(f"{name} encode ({len(data)} bytes): {before:.0f}/s -> {after:.0f}/s ({after / before:.1f}x)")
+
+            before = bench(flask_json.loads, data)
+            after = bench(json_codec.loads, data)
+            print(f"{name} decode: {before:.0f}/s -> {after:.0f}/s ({after / before:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Bloom filter for fast set membership checks.
+"""
+import hashlib
+import math
+from typing import Dict
+
+
+class BloomFilter:
+    """
+    A set that can give false positives but never false negatives.
+    :param capacity: Number of items the filter is sized for.
+    :param false_positive_rate: Wanted false positive rate when the filter holds capacity items.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float = 0.01):
+        capacity = max(capacity, 1)
+
+        self.capacity = capacity
+        self.bit_count = max(int(math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.bit_count / capacity * math.log(2))), 1)
+        self.count = 0
+
+        self._bits = bytearray((self.bit_count + 7) // 8)
+
+    def add(self, item: str) -> None:
+        """
+        Adds an item to the filter.
+        """
+        for index in self._indexes(item):
+            self._bits[index >> 3] |= 1 << (index & 7)
+
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[index >> 3] & (1 << (index & 7)) for index in self._indexes(item))
+
+    def false_positive_rate(self) -> float:
+        """
+        Returns the estimated false positive rate for the items in the filter.
+        """
+        return (1 - math.exp(-self.hash_count * self.count / self.bit_count)) ** self.hash_count
+
+    def stats(self) -> Dict:
+        """
+        Returns the size and estimated false positive rate of the filter.
+        """
+        return {
+            'count': self.count,
+            'capacity': self.capacity,
+            'memory_bytes': len(self._bits),
+            'hash_count': self.hash_count,
+            'false_positive_rate': self.false_positive_rate(),
+        }
+
+    def _indexes(self, item: str):
+        """
+        Returns the bit indexes of an item, using double hashing.
+        """
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        return ((h1 + i * h2) % self.bit_count for i in range(self.hash_count))
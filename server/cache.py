@@ -0,0 +1,273 @@
+"""
+In-process and shared caches, and backends for sharing cache invalidations between workers.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+MISSING = object()
+
+
+class LRUCache:
+    """
+    A thread-safe cache that keeps at most max_size entries and evicts the least recently used
+    entry when it is full. Entries can expire after a time to live (in seconds).
+    :param size_of: Returns the size of a value, e.g. len for bytes. If given, max_size is the
+                    max total size of all values instead of the max number of entries.
+    """
+    shared = False
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None, clock: Callable[[], float] = time.monotonic,
+                 size_of: Optional[Callable[[Any], int]] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.size_of = size_of
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.generation = 0  # Increased whenever keys are deleted, see set
+
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._total_size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """
+        Returns the value for a key, or default if the key is not cached or has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                value, expires_at, _ = entry
+
+                if expires_at is None or expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                self._remove(key)
+
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = MISSING, generation: Optional[int] = None) -> None:
+        """
+        Caches a value for a key.
+        :param ttl: Time to live for this entry. Defaults to the ttl of the cache, None never expires.
+        :param generation: The generation of the cache before the value was loaded. If keys have been deleted
+                           since then, the value might have been loaded before it was invalidated, so it is not cached.
+        """
+        if ttl is MISSING:
+            ttl = self.ttl
+
+        expires_at = self.clock() + ttl if ttl is not None else None
+        size = self.size_of(value) if self.size_of else 1
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self._remove(key)
+            self._entries[key] = (value, expires_at, size)
+            self._total_size += size
+
+            while self._total_size > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        """
+        Removes a key from the cache, if it is cached.
+        """
+        with self._lock:
+            self._remove(key)
+            self.generation += 1
+
+    def clear(self) -> None:
+        """
+        Removes all entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._total_size = 0
+            self.generation += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns hit, miss and eviction counts.
+        """
+        stats = {
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+        if self.size_of:
+            stats['total_size'] = self._total_size
+
+        return stats
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            self._total_size -= entry[2]
+
+
+class RedisCache:
+    """
+    A cache in Redis that is shared by all workers. Values must be bytes.
+    Redis evicts entries by its own maxmemory policy, so evictions are not counted.
+    :param client: A redis.Redis client, or an object with the same interface.
+    :param prefix: Prefix of the Redis keys of this cache.
+    """
+    shared = True
+
+    def __init__(self, client, prefix: str, ttl: Optional[float] = None):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, default: Any = MISSING) -> Any:
+        value = self.client.get(self.prefix + key)
+
+        if value is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = MISSING) -> None:
+        if ttl is MISSING:
+            ttl = self.ttl
+
+        self.client.set(self.prefix + key, value, px=int(ttl * 1000) if ttl is not None else None)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class InvalidationBackend:
+    """
+    Base class for backends that send invalidated cache keys to all subscribers of a channel.
+    """
+
+    def publish(self, channel: str, key: str) -> None:
+        """
+        Sends an invalidated key to all subscribers of a channel.
+        """
+        raise NotImplementedError
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        """
+        Calls callback with every key that is published to a channel.
+        """
+        raise NotImplementedError
+
+
+class LocalInvalidationBackend(InvalidationBackend):
+    """
+    Sends invalidations to subscribers in the same process.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[Callable[[str], None]]] = {}
+
+    def publish(self, channel: str, key: str) -> None:
+        for callback in self._subscribers.get(channel, []):
+            callback(key)
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        self._subscribers.setdefault(channel, []).append(callback)
+
+
+class RedisInvalidationBackend(InvalidationBackend):
+    """
+    Sends invalidations to all workers through Redis pub/sub.
+    :param client: A redis.Redis client, or an object with the same interface.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._local = LocalInvalidationBackend()
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self._thread = None
+
+    def publish(self, channel: str, key: str) -> None:
+        self.client.publish(channel, key)
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        self._local.subscribe(channel, callback)
+        self._pubsub.subscribe(**{channel: self._on_message})
+
+        if self._thread is None:
+            self._thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def _on_message(self, message: Dict) -> None:
+        channel, key = message['channel'], message['data']
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        if isinstance(key, bytes):
+            key = key.decode()
+
+        self._local.publish(channel, key)
+
+
+def create_cache(name: str, max_size: int, ttl: Optional[float] = None,
+                 size_of: Optional[Callable[[Any], int]] = None):
+    """
+    Returns a cache that is shared by all workers if CACHE_REDIS_URL is set, otherwise an LRUCache.
+    Shared caches can only store bytes.
+    :param name: Name of the cache, used as prefix of the keys in Redis.
+    """
+    if 'CACHE_REDIS_URL' in os.environ:
+        return RedisCache(_redis_client(), name + ':', ttl)
+
+    return LRUCache(max_size, ttl, size_of=size_of)
+
+
+def _redis_client():
+    global _redis
+
+    if _redis is None:
+        import redis
+
+        _redis = redis.Redis.from_url(os.environ['CACHE_REDIS_URL'])
+
+    return _redis
+
+
+def _create_invalidation_backend() -> InvalidationBackend:
+    if 'CACHE_REDIS_URL' in os.environ:
+        return RedisInvalidationBackend(_redis_client())
+
+    return LocalInvalidationBackend()
+
+
+_redis = None
+invalidation = _create_invalidation_backend()
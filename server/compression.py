@@ -0,0 +1,82 @@
+"""
+Compression of responses, negotiated with the Accept-Encoding header.
+
+Responses are compressed with brotli when the client supports it and the brotli
+package is installed, otherwise with gzip. A view can set g.compression_key to a
+key that changes whenever its response body changes. The compressed body is
+then cached under that key, so it is only compressed once.
+"""
+import gzip
+import os
+from typing import Optional
+
+from flask import Response, g, request
+
+from server import cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller responses are sent uncompressed, since compression would barely make them smaller.
+MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/plain', 'text/html'}
+
+_compressed_bodies = cache.LRUCache(max_size=1000)
+
+
+def choose_encoding() -> Optional[str]:
+    """
+    Returns the best encoding that the client of the current request accepts, or None.
+    """
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    return request.accept_encodings.best_match(encodings)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """
+    Compresses data with an encoding from choose_encoding.
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_response(response: Response) -> Response:
+    """
+    Compresses the body of a response, if it is large enough and the client accepts a supported encoding.
+    Meant to be registered with app.after_request.
+    """
+    # Removed from g first, since g is shared with later requests if an app context was pushed before the request
+    key = g.pop('compression_key', None)
+
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed \
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers:
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    encoding = choose_encoding()
+    if encoding is None or response.content_length is None or response.content_length < MIN_SIZE:
+        return response
+
+    body = _compressed_bodies.get((key, encoding), None) if key is not None else None
+
+    if body is None:
+        body = compress(response.get_data(), encoding)
+
+        if key is not None:
+            _compressed_bodies.set((key, encoding), body)
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+
+    return response
+
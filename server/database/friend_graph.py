@@ -0,0 +1,157 @@
+"""
+In-memory social graph front end for friend suggestions.
+
+Suggestions need the friends of all friends of a user, which would be one large
+join per request. The graph is loaded from the friendships table once per worker
+and then kept up to date with the friendships that are added and removed.
+"""
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from server.database.handler import db, run_in_background
+from server.database.models import FRIENDSHIP_ACCEPTED, friendship
+from server.social_graph import SocialGraph
+
+
+class FriendGraph:
+    """
+    SocialGraph with all friendships in the database.
+    The graph is loaded when it is first used, and reloaded when it is older than max_age seconds,
+    so that friendships changed by other workers are seen even if no invalidation reaches this worker.
+    Only one thread loads the graph at a time. Reloads run in a background thread, and the old graph
+    is used until the new one is ready.
+    """
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+
+        self.loads = 0
+
+        self._graph: Optional[SocialGraph] = None
+        self._loaded_at = 0.0
+        self._changed_while_loading: Optional[List[Tuple[bool, int, int]]] = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()  # Held by the thread that loads the graph
+
+    def get(self) -> SocialGraph:
+        """
+        Returns the graph, loading it first if needed.
+        """
+        graph = self._graph
+
+        if graph is None:
+            graph = self._load_first()
+        elif time.monotonic() - self._loaded_at > self.max_age:
+            self._reload_in_background()
+
+        return graph
+
+    def apply(self, change: str) -> None:
+        """
+        Applies a change from format_change to the graph.
+        """
+        added, user1_id, user2_id = parse_change(change)
+
+        with self._lock:
+            if self._graph is not None:
+                _apply(self._graph, added, user1_id, user2_id)
+            if self._changed_while_loading is not None:
+                self._changed_while_loading.append((added, user1_id, user2_id))
+
+    def load(self) -> None:
+        """
+        Loads a new graph from the friendships table. Waits for a load in another thread to finish first.
+        """
+        with self._load_lock:
+            self._load()
+
+    def _load_first(self) -> SocialGraph:
+        """
+        Loads the graph in this thread, unless another thread loaded it while waiting.
+        """
+        with self._load_lock:
+            if self._graph is None:
+                self._load()
+
+            return self._graph
+
+    def _reload_in_background(self) -> None:
+        """
+        Starts a reload in a background thread, unless the graph already is being loaded.
+        """
+        if not self._load_lock.acquire(blocking=False):
+            return
+
+        def reload():
+            try:
+                self._load()
+            finally:
+                self._load_lock.release()
+
+        try:
+            run_in_background(reload)
+        except Exception:
+            self._load_lock.release()
+            raise
+
+    def _load(self) -> None:
+        """
+        Loads a new graph from the friendships table. The caller must hold the load lock.
+        """
+        with self._lock:
+            self._changed_while_loading = []
+
+        try:
+            pairs = db.session.query(friendship.c.user1_id, friendship.c.user2_id) \
+                .filter(friendship.c.status == FRIENDSHIP_ACCEPTED).yield_per(10000)
+            graph = SocialGraph(pairs)
+
+            with self._lock:
+                # Friendships changed while the graph was loaded might not have been in the query result
+                for added, user1_id, user2_id in self._changed_while_loading:
+                    _apply(graph, added, user1_id, user2_id)
+
+                self._graph = graph
+                self._loaded_at = time.monotonic()
+                self.loads += 1
+        finally:
+            with self._lock:
+                self._changed_while_loading = None
+
+    def clear(self) -> None:
+        """
+        Removes the graph, so it is loaded on the next use.
+        """
+        with self._lock:
+            self._graph = None
+
+    def stats(self) -> Dict:
+        """
+        Returns the size of the graph and how often it has been loaded.
+        """
+        graph = self._graph
+        stats = graph.stats() if graph else {}
+        stats['loads'] = self.loads
+
+        return stats
+
+
+def format_change(added: bool, user1_id: int, user2_id: int) -> str:
+    """
+    Returns a friendship change as a string that can be published to other workers.
+    """
+    return f"{'+' if added else '-'}{user1_id}:{user2_id}"
+
+
+def parse_change(change: str) -> Tuple[bool, int, int]:
+    user1_id, user2_id = change[1:].split(':')
+
+    return change[0] == '+', int(user1_id), int(user2_id)
+
+
+def _apply(graph: SocialGraph, added: bool, user1_id: int, user2_id: int) -> None:
+    if added:
+        graph.add(user1_id, user2_id)
+    else:
+        graph.remove(user1_id, user2_id)
@@ -1,6 +1,8 @@
 import os
+import threading
+from typing import Callable
 
-from flask import Flask
+from flask import Flask, current_app
 from flask_sqlalchemy import SQLAlchemy
 
 
@@ -21,6 +23,28 @@ def init_db(app: Flask) -> None:
     db.create_all(app=app)
 
 
+def run_in_background(function: Callable[[], None]) -> threading.Thread:
+    """
+    Runs a function in a new thread, with its own app context and database session.
+    Must be called in an app context.
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                function()
+            except Exception:
+                app.logger.exception("Background task %s failed", function)
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    return thread
+
+
 def get_db_uri() -> str:
     """
     Returns the database uri
@@ -0,0 +1,152 @@
+"""
+Content-addressed storage for recipe images.
+
+Images are stored as raw bytes, keyed by the SHA-256 hash of their content,
+so an image that is uploaded several times is only stored once.
+Recipes only keep the key of their image.
+"""
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+from typing import Optional
+
+from server.database.handler import db
+from server.database.models import Image
+
+
+class ImageStore:
+    """
+    Base class for image stores.
+    """
+
+    def save(self, data: bytes) -> str:
+        """
+        Saves an image if it is not already stored.
+        :return: The key of the image.
+        """
+        key = image_key(data)
+        self.put(key, data)
+
+        return key
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Saves data with a given key if the key is not already stored.
+        """
+        if not self.exists(key):
+            self._write(key, data)
+
+    def exists(self, key: str) -> bool:
+        """
+        Returns True if an image with a given key is stored.
+        """
+        raise NotImplementedError
+
+    def load(self, key: str) -> Optional[bytes]:
+        """
+        Returns the image with a given key if it exists.
+        """
+        raise NotImplementedError
+
+    def path(self, key: str) -> Optional[str]:
+        """
+        Returns the path to the file with a given image if the store keeps images on disk.
+        Images with a path can be sent without being loaded into memory.
+        """
+        return None
+
+    def _write(self, key: str, data: bytes) -> None:
+        raise NotImplementedError
+
+
+class DatabaseImageStore(ImageStore):
+    """
+    Stores images in the images table.
+    New images are added to the current session and saved when it is committed.
+    """
+
+    def exists(self, key: str) -> bool:
+        return db.session.query(Image.key).filter_by(key=key).first() is not None
+
+    def load(self, key: str) -> Optional[bytes]:
+        row = db.session.query(Image.data).filter_by(key=key).first()
+
+        return row.data if row else None
+
+    def _write(self, key: str, data: bytes) -> None:
+        db.session.add(Image(key=key, data=data))
+
+
+class FileSystemImageStore(ImageStore):
+    """
+    Stores images as files in a local directory.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+
+    def path(self, key: str) -> str:
+        """
+        Returns the path of the file for a given key.
+        """
+        if not re.fullmatch("[0-9a-f]{64}(_[a-z]+)?", key):
+            raise ValueError(f"Invalid image key: {key}")
+
+        return os.path.join(self.directory, key[:2], key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path(key))
+
+    def load(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self.path(key), 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key: str, data: bytes) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so that a partially written image is never visible.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+
+def image_key(data: bytes) -> str:
+    """
+    Returns the key for a given image.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def decode_data_uri(uri: str) -> Optional[bytes]:
+    """
+    Decodes a base64 data uri.
+    :return: The decoded data or None if the uri is not a valid base64 data uri.
+    """
+    header, _, data = uri.partition(',')
+
+    if not (header.startswith('data:') and header.endswith(';base64')):
+        return None
+
+    try:
+        return base64.b64decode(data, validate=True)
+    except binascii.Error:
+        return None
+
+
+def _create_store() -> ImageStore:
+    if os.environ.get('IMAGE_STORE') == 'filesystem':
+        default_dir = os.path.join(os.path.dirname(__file__), 'images')
+        return FileSystemImageStore(os.environ.get('IMAGE_DIR', default_dir))
+
+    return DatabaseImageStore()
+
+
+store = _create_store()
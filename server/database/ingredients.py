@@ -0,0 +1,52 @@
+"""
+Structured ingredients of recipes.
+
+Recipes store their ingredients in a JSON column. Each ingredient is also stored
+as a row in the recipe_ingredients table, so that recipes can be found by their
+ingredients without parsing every recipe.
+"""
+from typing import Any, Dict, List
+
+from server.database.search import normalize_name
+
+
+def normalize_ingredient(name: str) -> str:
+    """
+    Returns an ingredient name in the form that it is stored and queried in.
+    """
+    return ' '.join(normalize_name(name).split())
+
+
+def parse_ingredients(items: Any) -> List[Dict]:
+    """
+    Parses the ingredients of a recipe into ingredient rows.
+    Ingredients are either objects with a name, unit and quantity, or plain names.
+    Ingredients that can not be parsed are skipped.
+    :param items: The decoded ingredients of a recipe, normally a list.
+    :return: List with the name, unit and quantity of each ingredient.
+    """
+    if not isinstance(items, list):
+        return []
+
+    rows = []
+    for item in items:
+        if isinstance(item, str):
+            item = {'name': item}
+        if not isinstance(item, dict) or not isinstance(item.get('name'), str):
+            continue
+
+        name = normalize_ingredient(item['name'])
+        if not name:
+            continue
+
+        unit = item.get('unit')
+        quantity = item.get('quantity')
+
+        rows.append({
+            'name': name,
+            'unit': unit if isinstance(unit, str) else None,
+            'quantity': float(quantity) if isinstance(quantity, (int, float)) and not isinstance(quantity, bool)
+            else None,
+        })
+
+    return rows
@@ -1,36 +1,138 @@
 """
 Functions for interacting with the database.
 """
-from datetime import datetime, timezone
-from typing import Optional, List
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, List, Set, Tuple
 
-from sqlalchemy import and_, func
+from flask import current_app
+from sqlalchemy import Float, Table, Text, and_, case, cast, exists, func, literal, or_, select, sql, union_all
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import defer, joinedload, load_only
 
+from server import cache
+from server.database import image_store, ingredients, search
+from server.database.friend_graph import FriendGraph, format_change
 from server.database.handler import db
-from server.database.models import User, Recipe, TokenBlocklist
+from server.database.token_filter import RevokedTokenFilter
+from server.database.models import FRIENDSHIP_ACCEPTED, FRIENDSHIP_PENDING, PublicUser, User, Recipe, \
+    RecipeIngredient, TokenBlocklist, friendship, liked_recipes_table, timeline
+
+REVOKED_TOKENS_CHANNEL = 'revoked-tokens'
+# Max time in seconds before a token revoked in another worker is seen as revoked,
+# if invalidations are not shared between the workers.
+REVOKED_TOKENS_TTL = 60
+
+_revoked_tokens = cache.LRUCache(max_size=10000, ttl=REVOKED_TOKENS_TTL)
+_revoked_filter = RevokedTokenFilter(max_age=REVOKED_TOKENS_TTL)
+cache.invalidation.subscribe(REVOKED_TOKENS_CHANNEL, _revoked_tokens.delete)
+cache.invalidation.subscribe(REVOKED_TOKENS_CHANNEL, _revoked_filter.add)
+
+# Time in seconds that the public data of a user is cached, 0 turns the cache off.
+# Users can't change their name, so a short time is only needed to forget deleted users.
+IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', 30))
+
+_identities = cache.LRUCache(max_size=10000, ttl=IDENTITY_CACHE_TTL)
+
+FRIENDSHIPS_CHANNEL = 'friendships'
+# Max time in seconds before a friendship changed in another worker is seen in the friend graph,
+# if invalidations are not shared between the workers.
+FRIEND_GRAPH_TTL = 300
+
+_friend_graph = FriendGraph(max_age=FRIEND_GRAPH_TTL)
+cache.invalidation.subscribe(FRIENDSHIPS_CHANNEL, _friend_graph.apply)
+
+RECIPES_CHANNEL = 'recipes'
+# Max time in seconds that a cached recipe payload is used, in case an invalidation was missed.
+RECIPE_PAYLOADS_TTL = 300
+RECIPE_PAYLOADS_MAX_BYTES = int(os.environ.get('RECIPE_CACHE_BYTES', 32 * 1024 * 1024))
+
+_recipe_payloads = cache.create_cache('recipe-payloads', RECIPE_PAYLOADS_MAX_BYTES, RECIPE_PAYLOADS_TTL, size_of=len)
+if not _recipe_payloads.shared:
+    cache.invalidation.subscribe(RECIPES_CHANNEL, _recipe_payloads.delete)
 
 
 # ============================================================================
 # TOKENS
 # ============================================================================
 
-def revoke_token(jti: str) -> None:
+def revoke_token(jti: str, expires_at: Optional[datetime] = None) -> None:
     """
     Revokes a given token.
+    :param expires_at: When the token expires. After that it does not need to be in the blocklist.
     """
-    b = TokenBlocklist(jti=jti, revoked_at=datetime.now(timezone.utc))
+    b = TokenBlocklist(jti=jti, revoked_at=datetime.now(timezone.utc), expires_at=expires_at)
 
     db.session.add(b)
     db.session.commit()
 
+    cache.invalidation.publish(REVOKED_TOKENS_CHANNEL, jti)
+    _revoked_filter.add(jti)
+    # Deleted first, so that a lookup that started before the commit does not cache the token as not revoked
+    _revoked_tokens.delete(jti)
+    _revoked_tokens.set(jti, True, ttl=None)
+
 
 def is_revoked(jti: str) -> bool:
     """
     Returns True if a given token is revoked.
+    Results are cached, since this is checked on every authenticated request.
+    """
+    generation = _revoked_tokens.generation
+    revoked = _revoked_tokens.get(jti)
+
+    if revoked is cache.MISSING:
+        # The bloom filter rules out most tokens, which are not revoked, without a query
+        revoked = False
+
+        if _revoked_filter.might_contain(jti):
+            revoked = db.session.query(TokenBlocklist.query.filter_by(jti=jti).exists()).scalar()
+
+            if not revoked:
+                _revoked_filter.record_false_positive()
+
+        # A revoked token stays revoked, so only tokens that are not revoked need to expire.
+        # Tokens that are not revoked are only cached if no token was revoked while this one was looked up.
+        _revoked_tokens.set(jti, revoked, ttl=None if revoked else REVOKED_TOKENS_TTL,
+                            generation=None if revoked else generation)
+
+    return revoked
+
+
+def prune_blocklist(max_token_age: timedelta, batch_size: int = 1000) -> int:
+    """
+    Removes expired tokens from the token blocklist, in batches.
+    :param max_token_age: Lifetime of tokens, used for tokens revoked without an expiry time.
+    :return: Number of removed tokens.
     """
-    b = TokenBlocklist.query.filter_by(jti=jti).first()
+    now = datetime.now(timezone.utc)
+    expired = or_(
+        TokenBlocklist.expires_at < now,
+        and_(TokenBlocklist.expires_at.is_(None), TokenBlocklist.revoked_at < now - max_token_age)
+    )
+
+    removed = 0
+    while True:
+        ids = [token_id for token_id, in db.session.query(TokenBlocklist.id).filter(expired).limit(batch_size)]
+
+        if not ids:
+            break
+
+        TokenBlocklist.query.filter(TokenBlocklist.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        removed += len(ids)
+
+    return removed
+
 
-    return b is not None
+def revoked_tokens_stats() -> Dict:
+    """
+    Returns statistics for the revoked token cache and bloom filter.
+    """
+    return {
+        'cache': _revoked_tokens.stats(),
+        'filter': _revoked_filter.stats(),
+    }
 
 
 # ============================================================================
@@ -42,7 +144,7 @@ def create_user(user_name: str, user_email: str, pw_hash: str) -> User:
     Creates a new user and adds it to the database.
     :return: The new user.
     """
-    user = User(name=user_name, email=user_email, pw_hash=pw_hash)
+    user = User(name=user_name, search_name=search.normalize_name(user_name), email=user_email, pw_hash=pw_hash)
 
     db.session.add(user)
     db.session.commit()
@@ -60,6 +162,25 @@ def get_user_by_id(user_id: int) -> Optional[User]:
     return user
 
 
+def get_public_user(user_id: int) -> Optional[PublicUser]:
+    """
+    Returns the public data of the user with a given id if it exists, without loading the rest of the user.
+    Cached for IDENTITY_CACHE_TTL seconds in this worker.
+    :return: PublicUser object or none.
+    """
+    user = _identities.get(user_id) if IDENTITY_CACHE_TTL > 0 else cache.MISSING
+
+    if user is cache.MISSING:
+        users = User.__table__
+        row = db.session.execute(select([users.c.id, users.c.name]).where(users.c.id == user_id)).first()
+        user = PublicUser(row.id, row.name) if row else None
+
+        if user is not None and IDENTITY_CACHE_TTL > 0:
+            _identities.set(user_id, user)
+
+    return user
+
+
 def get_user_by_email(user_email: str) -> Optional[User]:
     """
     Returns the user with a given email if it exists.
@@ -70,110 +191,415 @@ def get_user_by_email(user_email: str) -> Optional[User]:
     return user
 
 
-def search_users(match: str) -> List[User]:
+def search_users(match: str, limit: Optional[int] = None, exclude_user_id: Optional[int] = None) -> List[User]:
     """
-    Returns all users that has ´match´ as a substring in the username.
+    Returns the users that has ´match´ as a substring in the username, ignoring case.
+    An exact match comes first, then names that start with match, then the other matches.
+    Within each group users are sorted by name.
+    :param limit: Max number of users to return.
+    :param exclude_user_id: Id of a user that should not be returned.
     :return: List with User objects.
     """
-    users = User.query.filter(func.lower(
-        User.name).contains(match.lower())).all()
+    match = search.normalize_name(match)
+    is_prefix = search.prefix_filter(db.engine.dialect.name, User.search_name, match)
+
+    query = User.query
+    if exclude_user_id is not None:
+        query = query.filter(User.id != exclude_user_id)
+
+    # The exact match is the first name with match as prefix
+    users = query.filter(is_prefix).order_by(User.search_name, User.id).limit(limit).all()
+
+    if limit is None or len(users) < limit:
+        remaining = None if limit is None else limit - len(users)
+        users += query.filter(User.search_name.contains(match, autoescape=True), ~is_prefix) \
+            .order_by(User.search_name, User.id).limit(remaining).all()
 
     return users
 
 
+def index_user_search_names(batch_size: int = 1000) -> int:
+    """
+    Sets the search name of all users from their names.
+    :return: Number of indexed users.
+    """
+    user_ids = [user_id for user_id, in db.session.query(User.id).order_by(User.id).all()]
+
+    for start in range(0, len(user_ids), batch_size):
+        batch = db.session.query(User.id, User.name).filter(User.id.in_(user_ids[start:start + batch_size])).all()
+
+        for user_id, name in batch:
+            User.query.filter_by(id=user_id).update({User.search_name: search.normalize_name(name)},
+                                                    synchronize_session=False)
+
+        db.session.commit()
+
+    return len(user_ids)
+
+
 # ============================================================================
 # FRIENDS
 # ============================================================================
 
-def create_friend_request(sender: User, receiver: User) -> None:
+def create_friend_request(sender: User, receiver: User) -> bool:
     """
     Creates a new friend request.
+    Does nothing if the users are already friends or there already is a request between them.
     :param sender: User who sends the request.
     :param receiver: User who should receve the request.
+    :return: True if the request was created.
     """
-    sender.outgoing_friend_requests.append(receiver)
+    if sender.id == receiver.id:
+        return False
+
+    result = _insert_ignore(friendship, status=FRIENDSHIP_PENDING, requester_id=sender.id,
+                            **_friend_pair(sender.id, receiver.id))
     db.session.commit()
 
+    return result.rowcount == 1
+
 
-def cancel_friend_request(user1: User, user2: User) -> None:
+def cancel_friend_request(user1: User, user2: User) -> bool:
     """
     Cancels friend requests between two users.
+    :return: True if there was a request.
     """
-    if (user2 in user1.outgoing_friend_requests):
-        user1.outgoing_friend_requests.remove(user2)
-        db.session.commit()
-    elif (user1 in user2.outgoing_friend_requests):
-        user2.outgoing_friend_requests.remove(user1)
-        db.session.commit()
+    cancelled = _delete_friend_request(user1.id, user2.id)
+    db.session.commit()
 
+    return cancelled
 
-def accept_friend_request(user1: User, user2: User) -> None:
+
+def accept_friend_request(user1: User, user2: User) -> bool:
     """
     Accepts a friend request between two users.
+    :param user1: User who received the request.
+    :param user2: User who sent the request.
+    :return: True if user2 had sent a request to user1, that now is accepted.
     """
-    cancel_friend_request(user1, user2)
+    accepted = _accept_friend_request(user1.id, user2.id, user2.id)
+    db.session.commit()
 
-    if (user2 not in user1.friends):
-        user1.friends.append(user2)
-        user2.friends.append(user1)
-        db.session.commit()
+    if accepted:
+        _publish_friendship_change(True, user1.id, user2.id)
+
+    return accepted
+
+
+def accept_friend_requests(user_id: int, requester_ids: List[int]) -> List[int]:
+    """
+    Accepts the friend requests that a user has received from some users, in one transaction.
+    :return: Ids of the users whose requests were accepted.
+    """
+    accepted = [requester_id for requester_id in dict.fromkeys(requester_ids)
+                if _accept_friend_request(user_id, requester_id, requester_id)]
+    db.session.commit()
 
+    for requester_id in accepted:
+        _publish_friendship_change(True, user_id, requester_id)
 
-def remove_friendship(user1: User, user2: User) -> None:
+    return accepted
+
+
+def decline_friend_requests(user_id: int, requester_ids: List[int]) -> List[int]:
+    """
+    Declines the friend requests that a user has received from some users, in one transaction.
+    :return: Ids of the users whose requests were declined.
+    """
+    declined = [requester_id for requester_id in dict.fromkeys(requester_ids)
+                if _delete_friend_request(user_id, requester_id, requester_id)]
+    db.session.commit()
+
+    return declined
+
+
+def cancel_friend_requests(user_id: int, receiver_ids: List[int]) -> List[int]:
+    """
+    Cancels the friend requests that a user has sent to some users, in one transaction.
+    :return: Ids of the users whose requests were cancelled.
+    """
+    cancelled = [receiver_id for receiver_id in dict.fromkeys(receiver_ids)
+                 if _delete_friend_request(user_id, receiver_id, user_id)]
+    db.session.commit()
+
+    return cancelled
+
+
+def remove_friendship(user1: User, user2: User) -> bool:
     """
     Removes friendship between two users.
+    :return: True if the users were friends.
     """
-    if (user2 in user1.friends):
-        user1.friends.remove(user2)
-        user2.friends.remove(user1)
-        db.session.commit()
+    result = db.session.execute(friendship.delete().where(
+        _friendship_row(user1.id, user2.id, FRIENDSHIP_ACCEPTED)))
+
+    if result.rowcount == 1:
+        if _is_push_feed():
+            _remove_from_timeline(user1.id, user2.id)
+            _remove_from_timeline(user2.id, user1.id)
+
+    db.session.commit()
+
+    if result.rowcount == 1:
+        _publish_friendship_change(False, user1.id, user2.id)
+
+    return result.rowcount == 1
+
+
+def are_friends(user1_id: int, user2_id: int) -> bool:
+    """
+    Returns True if two users are friends.
+    """
+    query = db.session.query(friendship).filter(_friendship_row(user1_id, user2_id, FRIENDSHIP_ACCEPTED))
+
+    return db.session.query(query.exists()).scalar()
+
+
+def migrate_friendships() -> int:
+    """
+    Converts friendships stored as two rows, one in each direction, to a single row with the lowest id first.
+    :return: Number of removed rows.
+    """
+    reverse = friendship.alias('reverse')
+
+    # Friendships that were only stored with the highest id first
+    db.session.execute(friendship.insert().from_select(
+        ['user1_id', 'user2_id'],
+        select([friendship.c.user2_id, friendship.c.user1_id]).where(and_(
+            friendship.c.user1_id > friendship.c.user2_id,
+            ~exists().where(and_(
+                reverse.c.user1_id == friendship.c.user2_id,
+                reverse.c.user2_id == friendship.c.user1_id
+            ))
+        ))
+    ))
+    result = db.session.execute(friendship.delete().where(friendship.c.user1_id >= friendship.c.user2_id))
+
+    db.session.commit()
+
+    return result.rowcount
+
+
+def migrate_friend_requests() -> int:
+    """
+    Moves friend requests from the old friendship_requests table to the friendships table.
+    The status and requester_id columns must be added to the friendships table first.
+    :return: Number of moved requests.
+    """
+    old_requests = sql.table('friendship_requests', sql.column('requesting_user_id'), sql.column('receiving_user_id'))
+
+    moved = 0
+    for requester_id, receiver_id in db.session.execute(select([
+        old_requests.c.requesting_user_id, old_requests.c.receiving_user_id
+    ])).fetchall():
+        if requester_id != receiver_id:
+            moved += _insert_ignore(friendship, status=FRIENDSHIP_PENDING, requester_id=requester_id,
+                                    **_friend_pair(requester_id, receiver_id)).rowcount
+
+    db.session.commit()
+
+    return moved
+
+
+def mutual_friend_count(user1_id: int, user2_id: int) -> int:
+    """
+    Returns the number of friends that two users have in common. Uses the in-memory friend graph.
+    """
+    return _friend_graph.get().mutual_friend_count(user1_id, user2_id)
+
+
+def friend_suggestions(user_id: int, limit: int) -> List[Tuple[PublicUser, int]]:
+    """
+    Returns friends of the friends of a user, that the user is not friends with and has no friend requests with.
+    Users with the most mutual friends come first. Uses the in-memory friend graph.
+    :return: List with (user, number of mutual friends).
+    """
+    requested = db.session.query(friendship.c.user2_id) \
+        .filter(friendship.c.user1_id == user_id, friendship.c.status == FRIENDSHIP_PENDING) \
+        .union_all(db.session.query(friendship.c.user1_id)
+                   .filter(friendship.c.user2_id == user_id, friendship.c.status == FRIENDSHIP_PENDING))
+    exclude = {other_id for other_id, in requested}
+
+    suggestions = _friend_graph.get().suggestions(user_id, limit, exclude)
+    if not suggestions:
+        return []
+
+    users = User.__table__
+    names = dict(db.session.execute(
+        select([users.c.id, users.c.name]).where(users.c.id.in_([other_id for other_id, _ in suggestions]))
+    ).fetchall())
+
+    # Users that were deleted after the graph was loaded are skipped
+    return [(PublicUser(other_id, names[other_id]), count) for other_id, count in suggestions if other_id in names]
+
+
+def friend_graph_stats() -> Dict:
+    """
+    Returns statistics for the in-memory friend graph.
+    """
+    return _friend_graph.stats()
+
+
+def _publish_friendship_change(added: bool, user1_id: int, user2_id: int) -> None:
+    """
+    Updates the friend graph of this worker and all other workers.
+    """
+    change = format_change(added, user1_id, user2_id)
+
+    cache.invalidation.publish(FRIENDSHIPS_CHANNEL, change)
+    _friend_graph.apply(change)
+
+
+def _friend_pair(user1_id: int, user2_id: int) -> Dict[str, int]:
+    """
+    Returns the columns of the friendships row for two users.
+    """
+    return {'user1_id': min(user1_id, user2_id), 'user2_id': max(user1_id, user2_id)}
+
+
+def _friendship_row(user1_id: int, user2_id: int, status: str, requester_id: Optional[int] = None):
+    """
+    Returns a condition for the friendships row of two users, if it has a status.
+    :param requester_id: If given, the row must also be a request sent by this user.
+    """
+    pair = _friend_pair(user1_id, user2_id)
+    condition = and_(friendship.c.user1_id == pair['user1_id'], friendship.c.user2_id == pair['user2_id'],
+                     friendship.c.status == status)
+
+    if requester_id is not None:
+        condition = and_(condition, friendship.c.requester_id == requester_id)
+
+    return condition
+
+
+def _accept_friend_request(user1_id: int, user2_id: int, requester_id: Optional[int] = None) -> bool:
+    """
+    Atomically changes a pending friend request to a friendship, without committing.
+    :param requester_id: If given, only a request sent by this user is accepted.
+    :return: True if there was a request.
+    """
+    result = db.session.execute(friendship.update()
+                                .where(_friendship_row(user1_id, user2_id, FRIENDSHIP_PENDING, requester_id))
+                                .values(status=FRIENDSHIP_ACCEPTED))
+
+    if result.rowcount == 1:
+        if _is_push_feed():
+            _add_to_timeline(user1_id, user2_id)
+            _add_to_timeline(user2_id, user1_id)
+
+    return result.rowcount == 1
+
+
+def _delete_friend_request(user1_id: int, user2_id: int, requester_id: Optional[int] = None) -> bool:
+    """
+    Atomically removes a pending friend request, without committing.
+    :param requester_id: If given, only a request sent by this user is removed.
+    :return: True if there was a request.
+    """
+    result = db.session.execute(friendship.delete()
+                                .where(_friendship_row(user1_id, user2_id, FRIENDSHIP_PENDING, requester_id)))
+
+    return result.rowcount == 1
+
+
+def list_connections(user_id: int) -> Dict[str, List[PublicUser]]:
+    """
+    Returns the friends of a user and the users it has sent and received friend requests to and from,
+    in a single query that only loads the public data of the users.
+    :return: Dict with the lists 'friends', 'outgoing_requests' and 'incoming_requests', sorted by user id.
+    """
+    users = User.__table__
+    kind = case([
+        (friendship.c.status == FRIENDSHIP_ACCEPTED, 'friends'),
+        (friendship.c.requester_id == user_id, 'outgoing_requests'),
+    ], else_='incoming_requests')
+
+    def connected_users(user_column, other_column):
+        return select([kind.label('kind'), users.c.id, users.c.name]) \
+            .select_from(friendship.join(users, users.c.id == other_column)) \
+            .where(user_column == user_id)
+
+    query = union_all(
+        connected_users(friendship.c.user1_id, friendship.c.user2_id),
+        connected_users(friendship.c.user2_id, friendship.c.user1_id),
+    ).order_by('id')
+
+    connections = {'friends': [], 'outgoing_requests': [], 'incoming_requests': []}
+    for kind, connected_id, name in db.session.execute(query):
+        connections[kind].append(PublicUser(connected_id, name))
+
+    return connections
 
 
 # ============================================================================
 # RECIPES
 # ============================================================================
 
-def create_recipe(user: User, name: str, ingredients: str, instructions: str, image: str) -> Recipe:
+def create_recipe(user: User, name: str, ingredients: Any, instructions: Any, image: Optional[bytes]) -> Recipe:
     """
     Creates a new recipe.
     :param user: User who created the recipe.
     :param name: Recipe name.
-    :param ingredients: Recipe ingredients.
-    :param instructions: Recipe instructions.
+    :param ingredients: Recipe ingredients, any JSON serializable value (normally a list).
+    :param instructions: Recipe instructions, any JSON serializable value (normally a list).
+    :param image: Recipe image as raw jpeg data.
     :return: The new recipe.
     """
+    image_key = image_store.store.save(image) if image else None
+
     recipe = Recipe(name=name, ingredients=ingredients,
-                    instructions=instructions, image=image, user_id=user.id)
+                    instructions=instructions, image=image_key, user_id=user.id)
 
     db.session.add(recipe)
+    db.session.flush()
+
+    _add_recipe_ingredients(recipe.id, ingredients)
+
+    if _is_push_feed():
+        _fan_out_recipe(recipe)
+
     db.session.commit()
 
     return recipe
 
 
-def change_recipe(recipe_id: int, new_name: str, new_ingredients: str, new_instructions: str, new_image: str) -> None:
+def change_recipe(recipe_id: int, new_name: str, new_ingredients: Any, new_instructions: Any,
+                  new_image: Optional[bytes]) -> None:
     """
-    Updates an existing recipe. Empty or None values will is ignored.
+    Updates an existing recipe. An empty name, None ingredients or instructions and no image are ignored,
+    so ingredients and instructions can be cleared with empty lists.
     """
     recipe = get_recipe_by_id(recipe_id)
 
     if not recipe: return
 
     if new_name: recipe.name = new_name
-    if new_ingredients: recipe.ingredients = new_ingredients
-    if new_instructions: recipe.instructions = new_instructions
-    if new_image: recipe.image = new_image
+    if new_ingredients is not None:
+        recipe.ingredients = new_ingredients
+        _set_recipe_ingredients(recipe_id, new_ingredients)
+    if new_instructions is not None: recipe.instructions = new_instructions
+    if new_image: recipe.image = image_store.store.save(new_image)
+
+    recipe.version = Recipe.version + 1
+    recipe.updated_at = datetime.now(timezone.utc)
 
     db.session.commit()
 
+    _invalidate_recipe_payload(recipe_id)
+
 
 def delete_recipe(recipe: Recipe) -> None:
     """
     Deletes a given recipe.
     """
+    db.session.execute(timeline.delete().where(timeline.c.recipe_id == recipe.id))
+    db.session.execute(RecipeIngredient.__table__.delete().where(RecipeIngredient.recipe_id == recipe.id))
+    recipe_id = recipe.id
     db.session.delete(recipe)
     db.session.commit()
 
+    _invalidate_recipe_payload(recipe_id)
+
 
 def get_recipe_by_id(recipe_id: int) -> Optional[Recipe]:
     """
@@ -185,35 +611,481 @@ def get_recipe_by_id(recipe_id: int) -> Optional[Recipe]:
     return recipe
 
 
-def search_recipes(match: str) -> List[Recipe]:
+def get_recipe_with_json(recipe_id: int) -> Optional[Tuple[Recipe, Optional[str], Optional[str]]]:
+    """
+    Returns the recipe with a given id, with its ingredients and instructions as the JSON text they are stored as.
+    The JSON is not decoded, so it can be sent to a client as it is.
+    :return: Tuple with the Recipe object (with its creator loaded, but not its ingredients and instructions),
+             its ingredients and its instructions, or None.
+    """
+    row = db.session.query(Recipe, cast(Recipe.ingredients, Text), cast(Recipe.instructions, Text)).options(
+        defer(Recipe.ingredients),
+        defer(Recipe.instructions),
+        joinedload(Recipe.user, innerjoin=True).load_only('id', 'name')
+    ).filter(Recipe.id == recipe_id).first()
+
+    return tuple(row) if row else None
+
+
+def get_recipe_version(recipe_id: int) -> Optional[Tuple[int, datetime]]:
+    """
+    Returns the version and update time of a recipe, without loading the rest of the recipe.
+    :return: Tuple with the version and update time, or None if the recipe does not exist.
+    """
+    row = db.session.query(Recipe.version, Recipe.updated_at).filter(Recipe.id == recipe_id).first()
+
+    return tuple(row) if row else None
+
+
+def get_recipe_payload(recipe_id: int, build: Callable[[Recipe, Optional[str], Optional[str]], bytes]) \
+        -> Optional[bytes]:
+    """
+    Returns the serialized data of a recipe, from a cache that is invalidated whenever the recipe changes.
+    On a cache miss the payload is built with load_recipe_payload.
+    :return: The payload, or None if the recipe does not exist.
+    """
+    payload = get_cached_recipe_payload(recipe_id)
+
+    if payload is None:
+        payload = load_recipe_payload(recipe_id, build)
+
+    return payload
+
+
+def get_cached_recipe_payload(recipe_id: int) -> Optional[bytes]:
+    """
+    Returns the serialized data of a recipe if it is cached, otherwise None.
+    """
+    return _recipe_payloads.get(str(recipe_id), None)
+
+
+def load_recipe_payload(recipe_id: int, build: Callable[[Recipe, Optional[str], Optional[str]], bytes]) \
+        -> Optional[bytes]:
+    """
+    Builds the serialized data of a recipe and caches it.
+    The recipe is loaded with get_recipe_with_json, and build is called with the result.
+    :param build: Serializes a recipe. The result must only depend on the recipe.
+    :return: The payload, or None if the recipe does not exist.
+    """
+    result = get_recipe_with_json(recipe_id)
+
+    if result is None:
+        return None
+
+    version = result[0].version
+    payload = build(*result)
+
+    # The recipe might have changed, and its payload been invalidated, after it was loaded.
+    # The payload is only cached if it is still current, so an old payload is not cached after the invalidation.
+    current = get_recipe_version(recipe_id)
+    if current is not None and current[0] == version:
+        _recipe_payloads.set(str(recipe_id), payload)
+
+    return payload
+
+
+def recipe_payloads_stats() -> Dict:
+    """
+    Returns statistics for the recipe payload cache.
+    """
+    return _recipe_payloads.stats()
+
+
+def _invalidate_recipe_payload(recipe_id: int) -> None:
+    """
+    Removes the cached payload of a recipe, in all workers.
     """
-    Returns all recipes that has ´match´ as a substring in the recipe name.
+    if _recipe_payloads.shared:
+        _recipe_payloads.delete(str(recipe_id))
+    else:
+        cache.invalidation.publish(RECIPES_CHANNEL, str(recipe_id))
+
+
+def get_recipes_by_ids(recipe_ids: List[int], user_id: Optional[int] = None) -> List[Recipe]:
+    """
+    Returns the recipes with the given ids that exist, with their creators loaded.
+    :param user_id: Only return recipes created by this user and its friends.
     :return: List with Recipe objects.
     """
-    recipes = Recipe.query.filter(func.lower(
-        Recipe.name).contains(match.lower())).all()
+    query = Recipe.query.options(joinedload(Recipe.user, innerjoin=True)).filter(Recipe.id.in_(recipe_ids))
+
+    if user_id is not None:
+        query = query.filter(or_(Recipe.user_id == user_id, Recipe.user_id.in_(_friend_ids(user_id))))
+
+    return query.all()
+
+
+def recipe_exists(recipe_id: int) -> bool:
+    """
+    Returns True if a recipe with a given id exists.
+    """
+    return db.session.query(Recipe.query.filter_by(id=recipe_id).exists()).scalar()
+
+
+def is_recipe_owner(user_id: int, recipe_id: int) -> bool:
+    """
+    Returns True if a recipe with a given id exists and was created by a user.
+    """
+    return db.session.query(Recipe.query.filter_by(id=recipe_id, user_id=user_id).exists()).scalar()
+
+
+def search_recipes(match: str, limit: Optional[int] = None, offset: int = 0,
+                   user_id: Optional[int] = None) -> List[Recipe]:
+    """
+    Returns all recipes that has all words in ´match´ in the recipe name, ingredients or instructions.
+    A word also matches longer words that start with it. The recipes are sorted by relevance.
+    If match has no words, recipes that has ´match´ as a substring in the recipe name are returned.
+    :param limit: Max number of recipes to return.
+    :param offset: Number of recipes to skip.
+    :param user_id: Only return recipes created by this user and its friends.
+    :return: List with Recipe objects, where only the id, name, image and user are loaded.
+    """
+    query = Recipe.query.options(*_summary_options())
+
+    if user_id is not None:
+        query = query.filter(or_(Recipe.user_id == user_id, Recipe.user_id.in_(_friend_ids(user_id))))
+
+    matches = search.matching_recipes(db.engine.dialect.name, match)
+
+    if matches is not None:
+        query = query.join(matches, matches.c.id == Recipe.id).order_by(matches.c.rank.desc(), Recipe.id)
+    else:
+        query = query.filter(func.lower(Recipe.name).contains(match.lower())).order_by(Recipe.id)
+
+    recipes = query.offset(offset).limit(limit).all()
 
     return recipes
 
 
-def latest_recipes(users: List[User], match: str) -> List[Recipe]:
+def latest_recipes(users: List[User], match: str, before_id: Optional[int] = None,
+                   limit: Optional[int] = None) -> List[Recipe]:
     """
     Returns all recipes that is created by one of the given users
-    and has ´match´ as a substring in the recipe name.
+    and matches ´match´ in the same way as in search_recipes.
     The recipes will be sorted by last created (highest id).
+    :param before_id: Only return recipes with a lower id than this.
+    :param limit: Max number of recipes to return.
+    :return: List with Recipe objects.
+    """
+    user_ids = [user.id for user in users]
+    query = Recipe.query.filter(Recipe.user_id.in_(user_ids))
+
+    return _latest_recipes(query, Recipe.id, match, before_id, limit)
+
+
+def feed_recipes(user_id: int, match: str, before_id: Optional[int] = None,
+                 limit: Optional[int] = None) -> List[Recipe]:
+    """
+    Same as latest_recipes for a user and all of its friends, but done in a single query.
+    In push mode the recipes are read from the timeline of the user.
+    Only the id, name, image and user of the recipes are loaded.
+    :return: List with Recipe objects.
+    """
+    query, id_column = _feed_query(user_id)
+
+    return _latest_recipes(query, id_column, match, before_id, limit)
+
+
+def feed_versions(user_id: int, match: str, before_id: Optional[int] = None,
+                  limit: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    Returns the id and version of the recipes that feed_recipes returns, without loading the recipes.
+    Used to check if a page of the feed has changed.
+    :return: List with the id and version of each recipe.
+    """
+    query, id_column = _feed_query(user_id)
+    query = _filter_latest(query.with_entities(Recipe.id, Recipe.version), id_column, match, before_id)
+
+    return [(recipe_id, version) for recipe_id, version in query.limit(limit).all()]
+
+
+def get_recipe_summaries(recipe_ids: List[int]) -> List[Recipe]:
+    """
+    Returns the recipes with the given ids that exist, in the same order as the ids.
+    Only the id, name, image and user of the recipes are loaded.
     :return: List with Recipe objects.
     """
-    recipe_ids = []
-    for user in users:
-        for recipe in user.recipes:
-            recipe_ids.append(recipe.id)
+    if not recipe_ids:
+        return []
+
+    recipes = {recipe.id: recipe for recipe in
+               Recipe.query.options(*_summary_options()).filter(Recipe.id.in_(recipe_ids)).all()}
+
+    return [recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes]
+
+
+def _feed_query(user_id: int):
+    """
+    Returns a query with the recipes in the feed of a user, and the id column to sort and paginate it by.
+    """
+    if _is_push_feed():
+        query = Recipe.query.join(timeline, timeline.c.recipe_id == Recipe.id).filter(
+            timeline.c.owner_id == user_id)
+
+        return query, timeline.c.recipe_id
 
-    recipes = Recipe.query.filter(and_(Recipe.id.in_(recipe_ids), func.lower(
-        Recipe.name).contains(match.lower()))).order_by(Recipe.id.desc()).all()
+    query = Recipe.query.filter(or_(Recipe.user_id == user_id, Recipe.user_id.in_(_friend_ids(user_id))))
+
+    return query, Recipe.id
+
+
+def _friend_ids(user_id: int):
+    """
+    Returns a query with the ids of all friends of a user.
+    """
+    accepted = friendship.c.status == FRIENDSHIP_ACCEPTED
+
+    return db.session.query(friendship.c.user2_id.label('user_id')) \
+        .filter(friendship.c.user1_id == user_id, accepted) \
+        .union_all(db.session.query(friendship.c.user1_id.label('user_id'))
+                   .filter(friendship.c.user2_id == user_id, accepted))
+
+
+def _summary_options():
+    """
+    Returns query options that only load the id, name, image and user name of recipes.
+    """
+    return (
+        load_only('id', 'name', 'image', 'user_id'),
+        joinedload(Recipe.user, innerjoin=True).load_only('id', 'name')
+    )
+
+
+def _match_filter(match: str):
+    """
+    Returns a filter for recipes that match a search string, in the same way as search_recipes.
+    """
+    matches = search.matching_recipes(db.engine.dialect.name, match)
+
+    if matches is not None:
+        return Recipe.id.in_(select([matches.c.id]))
+
+    return func.lower(Recipe.name).contains(match.lower())
+
+
+def _latest_recipes(query, id_column, match: str, before_id: Optional[int], limit: Optional[int]) -> List[Recipe]:
+    query = _filter_latest(query.options(*_summary_options()), id_column, match, before_id)
+
+    recipes = query.limit(limit).all()
 
     return recipes
 
 
+def _filter_latest(query, id_column, match: str, before_id: Optional[int]):
+    """
+    Filters a recipe query by a search string and a pagination cursor, and sorts it by last created.
+    """
+    query = query.filter(_match_filter(match))
+
+    if before_id is not None:
+        query = query.filter(id_column < before_id)
+
+    return query.order_by(id_column.desc())
+
+
+def migrate_recipe_images(batch_size: int = 100) -> int:
+    """
+    Moves images that are stored as data uris in the recipes table to the image store.
+    Images that can not be decoded are removed.
+    :return: Number of migrated recipes.
+    """
+    recipe_ids = [recipe_id for recipe_id, in
+                  db.session.query(Recipe.id).filter(Recipe.image.like('data:%')).all()]
+
+    for start in range(0, len(recipe_ids), batch_size):
+        recipes = Recipe.query.filter(Recipe.id.in_(recipe_ids[start:start + batch_size])).all()
+
+        for recipe in recipes:
+            data = image_store.decode_data_uri(recipe.image)
+            recipe.image = image_store.store.save(data) if data else None
+
+        db.session.commit()
+
+    return len(recipe_ids)
+
+
+# ============================================================================
+# INGREDIENTS
+# ============================================================================
+
+def cookable_recipes(user_id: int, pantry: List[str], limit: Optional[int] = None) \
+        -> List[Tuple[Recipe, int, int]]:
+    """
+    Returns the recipes created by a user and its friends that use the most of the ingredients in a pantry.
+    Recipes are sorted by the share of their ingredients that are in the pantry, then by the number of
+    ingredients in the pantry. Recipes without any ingredient in the pantry are not returned.
+    :param pantry: Names of the available ingredients.
+    :param limit: Max number of recipes to return.
+    :return: List with a Recipe object, the number of its ingredients in the pantry and its total number of
+             ingredients. Only the id, name, image and user of the recipes are loaded.
+    """
+    pantry = {ingredients.normalize_ingredient(name) for name in pantry} - {''}
+
+    if not pantry:
+        return []
+
+    name = RecipeIngredient.name
+    matched = func.count(func.distinct(case([(name.in_(pantry), name)])))
+    total = func.count(func.distinct(name))
+
+    # Only recipes by the user and its friends with an ingredient in the pantry, so that
+    # the ingredients of other recipes are never aggregated
+    visible = db.session.query(Recipe.id) \
+        .filter(or_(Recipe.user_id == user_id, Recipe.user_id.in_(_friend_ids(user_id))))
+    candidates = db.session.query(RecipeIngredient.recipe_id) \
+        .filter(name.in_(pantry), RecipeIngredient.recipe_id.in_(visible))
+
+    coverage = db.session.query(
+        RecipeIngredient.recipe_id.label('recipe_id'),
+        matched.label('matched'),
+        total.label('total')
+    ).filter(RecipeIngredient.recipe_id.in_(candidates)).group_by(RecipeIngredient.recipe_id).subquery()
+
+    query = db.session.query(Recipe, coverage.c.matched, coverage.c.total) \
+        .join(coverage, coverage.c.recipe_id == Recipe.id) \
+        .options(*_summary_options()) \
+        .order_by((cast(coverage.c.matched, Float) / coverage.c.total).desc(),
+                  coverage.c.matched.desc(), Recipe.id.desc())
+
+    return [(recipe, matched, total) for recipe, matched, total in query.limit(limit).all()]
+
+
+def index_recipe_ingredients(batch_size: int = 100) -> int:
+    """
+    Recreates the ingredient rows of all recipes from their ingredients column.
+    :return: Number of indexed recipes.
+    """
+    recipe_ids = [recipe_id for recipe_id, in db.session.query(Recipe.id).order_by(Recipe.id).all()]
+
+    for start in range(0, len(recipe_ids), batch_size):
+        batch = db.session.query(Recipe.id, Recipe.ingredients) \
+            .filter(Recipe.id.in_(recipe_ids[start:start + batch_size])).all()
+
+        for recipe_id, recipe_ingredients in batch:
+            _set_recipe_ingredients(recipe_id, recipe_ingredients)
+
+        db.session.commit()
+
+    return len(recipe_ids)
+
+
+def _set_recipe_ingredients(recipe_id: int, recipe_ingredients: Any) -> None:
+    """
+    Replaces the ingredient rows of a recipe.
+    """
+    db.session.execute(RecipeIngredient.__table__.delete().where(RecipeIngredient.recipe_id == recipe_id))
+    _add_recipe_ingredients(recipe_id, recipe_ingredients)
+
+
+def _add_recipe_ingredients(recipe_id: int, recipe_ingredients: Any) -> None:
+    """
+    Adds the ingredient rows of a recipe that has none.
+    """
+    rows = [dict(row, recipe_id=recipe_id, position=position)
+            for position, row in enumerate(ingredients.parse_ingredients(recipe_ingredients))]
+
+    if rows:
+        db.session.execute(RecipeIngredient.__table__.insert(), rows)
+
+
+# ============================================================================
+# TIMELINES
+# ============================================================================
+
+def rebuild_timelines() -> None:
+    """
+    Recreates the timelines of all users from the recipes and friendships tables.
+    Needed when switching the feed to push mode.
+    """
+    db.session.execute(timeline.delete())
+
+    db.session.execute(timeline.insert().from_select(
+        ['owner_id', 'recipe_id'],
+        select([Recipe.user_id, Recipe.id])
+    ))
+    db.session.execute(timeline.insert().from_select(
+        ['owner_id', 'recipe_id'],
+        select([friendship.c.user1_id, Recipe.id]).where(and_(
+            Recipe.user_id == friendship.c.user2_id, friendship.c.status == FRIENDSHIP_ACCEPTED))
+    ))
+    db.session.execute(timeline.insert().from_select(
+        ['owner_id', 'recipe_id'],
+        select([friendship.c.user2_id, Recipe.id]).where(and_(
+            Recipe.user_id == friendship.c.user1_id, friendship.c.status == FRIENDSHIP_ACCEPTED))
+    ))
+
+    db.session.commit()
+
+
+def _is_push_feed() -> bool:
+    """
+    Returns True if new recipes should be written to the timelines of the creator and its friends.
+    """
+    return current_app.config.get('FEED_MODE') == 'push'
+
+
+def _fan_out_recipe(recipe: Recipe) -> None:
+    """
+    Adds a recipe to the timelines of its creator and the creator's friends.
+    """
+    db.session.execute(timeline.insert().values(owner_id=recipe.user_id, recipe_id=recipe.id))
+    friend_ids = _friend_ids(recipe.user_id).subquery()
+    db.session.execute(timeline.insert().from_select(
+        ['owner_id', 'recipe_id'],
+        select([friend_ids.c.user_id, literal(recipe.id, db.Integer)])
+    ))
+
+
+def _add_to_timeline(owner_id: int, creator_id: int) -> None:
+    """
+    Adds all recipes by a creator to the timeline of a user.
+    """
+    db.session.execute(timeline.insert().from_select(
+        ['owner_id', 'recipe_id'],
+        select([literal(owner_id, db.Integer), Recipe.id]).where(Recipe.user_id == creator_id)
+    ))
+
+
+def _remove_from_timeline(owner_id: int, creator_id: int) -> None:
+    """
+    Removes all recipes by a creator from the timeline of a user.
+    """
+    db.session.execute(timeline.delete().where(and_(
+        timeline.c.owner_id == owner_id,
+        timeline.c.recipe_id.in_(select([Recipe.id]).where(Recipe.user_id == creator_id))
+    )))
+
+
+# ============================================================================
+# IMAGES
+# ============================================================================
+
+def get_image(key: str) -> Optional[bytes]:
+    """
+    Returns the image with a given key if it exists.
+    :return: Raw image data or none.
+    """
+    return image_store.store.load(key)
+
+
+def get_image_path(key: str) -> Optional[str]:
+    """
+    Returns the path to the file with a given image if it is stored on disk.
+    :return: File path or none.
+    """
+    path = image_store.store.path(key)
+
+    return path if path and os.path.isfile(path) else None
+
+
+def get_recipe_image_key(recipe_id: int) -> Optional[str]:
+    """
+    Returns the image key of a recipe without loading the rest of the recipe.
+    :return: Image key or none.
+    """
+    return db.session.query(Recipe.image).filter_by(id=recipe_id).scalar()
+
+
 # ============================================================================
 # LIKES
 # ============================================================================
@@ -222,19 +1094,108 @@ def like_recipe(user: User, recipe: Recipe) -> None:
     """
     Makes a user like a recipe.
     """
-    if recipe in user.liked_recipes:
-        return
+    result = _insert_ignore(liked_recipes_table, user_id=user.id, recipe_id=recipe.id)
+
+    # Only count the like if it did not already exist
+    if result.rowcount == 1:
+        _add_to_like_count(recipe.id, 1)
 
-    user.liked_recipes.append(recipe)
     db.session.commit()
 
+    if result.rowcount == 1:
+        _invalidate_recipe_payload(recipe.id)
+
 
 def stop_like_recipe(user: User, recipe: Recipe) -> None:
     """
     Makes a user stop liking a recipe.
     """
-    if recipe not in user.liked_recipes:
-        return
+    result = db.session.execute(liked_recipes_table.delete().where(and_(
+        liked_recipes_table.c.user_id == user.id,
+        liked_recipes_table.c.recipe_id == recipe.id
+    )))
+
+    if result.rowcount == 1:
+        _add_to_like_count(recipe.id, -1)
 
-    user.liked_recipes.remove(recipe)
     db.session.commit()
+
+    if result.rowcount == 1:
+        _invalidate_recipe_payload(recipe.id)
+
+
+def is_liked(user_id: int, recipe_id: int) -> bool:
+    """
+    Returns True if a user likes a recipe.
+    """
+    query = db.session.query(liked_recipes_table).filter_by(user_id=user_id, recipe_id=recipe_id)
+
+    return db.session.query(query.exists()).scalar()
+
+
+def liked_recipe_ids(user_id: int, recipe_ids: List[int]) -> Set[int]:
+    """
+    Returns the ids of the recipes among the given ones that a user likes.
+    """
+    rows = db.session.query(liked_recipes_table.c.recipe_id).filter(and_(
+        liked_recipes_table.c.user_id == user_id,
+        liked_recipes_table.c.recipe_id.in_(recipe_ids)
+    )).all()
+
+    return {recipe_id for recipe_id, in rows}
+
+
+def reconcile_like_counts() -> None:
+    """
+    Recomputes the like count of all recipes from the liked recipes table.
+    """
+    like_count = select([func.count()]).where(liked_recipes_table.c.recipe_id == Recipe.id).as_scalar()
+
+    Recipe.query.update({Recipe.like_count: like_count}, synchronize_session=False)
+    db.session.commit()
+
+
+def remove_duplicate_likes() -> int:
+    """
+    Keeps a single row for every like that is stored more than once in the liked recipes table.
+    Only needed for databases created before the table had a primary key. Like counts must be reconciled afterwards.
+    :return: Number of removed rows.
+    """
+    duplicates = db.session.execute(
+        select([liked_recipes_table.c.user_id, liked_recipes_table.c.recipe_id, func.count()])
+        .group_by(liked_recipes_table.c.user_id, liked_recipes_table.c.recipe_id)
+        .having(func.count() > 1)
+    ).fetchall()
+
+    for user_id, recipe_id, _ in duplicates:
+        db.session.execute(liked_recipes_table.delete().where(and_(
+            liked_recipes_table.c.user_id == user_id,
+            liked_recipes_table.c.recipe_id == recipe_id
+        )))
+        db.session.execute(liked_recipes_table.insert().values(user_id=user_id, recipe_id=recipe_id))
+
+    db.session.commit()
+
+    return sum(count - 1 for _, _, count in duplicates)
+
+
+def _insert_ignore(table: Table, **values):
+    """
+    Inserts a row into a table, unless it conflicts with an existing row.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        statement = postgresql.insert(table).values(**values).on_conflict_do_nothing()
+    else:
+        statement = table.insert().values(**values).prefix_with('OR IGNORE', dialect='sqlite')
+
+    return db.session.execute(statement)
+
+
+def _add_to_like_count(recipe_id: int, amount: int) -> None:
+    """
+    Atomically changes the like count of a recipe.
+    """
+    Recipe.query.filter_by(id=recipe_id).update(
+        {Recipe.like_count: Recipe.like_count + amount, Recipe.version: Recipe.version + 1,
+         Recipe.updated_at: datetime.now(timezone.utc)},
+        synchronize_session=False)
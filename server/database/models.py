@@ -1,29 +1,76 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects import postgresql
+
 from server.database.handler import db
-from typing import Dict
+from typing import Dict, List
+
+# JSONB on PostgreSQL, JSON text (queried with JSON1) on SQLite
+JSON = db.JSON().with_variant(postgresql.JSONB(), 'postgresql')
 
 
 class TokenBlocklist(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    jti = db.Column(db.String(36), nullable=False)
+    jti = db.Column(db.String(36), nullable=False, unique=True, index=True)
     revoked_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, index=True)  # When the token expires and can be removed
+
+
+class Image(db.Model):
+    __tablename__ = 'images'
+
+    key = db.Column(db.String(80), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+
+class RecipeIngredient(db.Model):
+    """
+    One ingredient of a recipe. Kept in sync with the ingredients column of the recipe,
+    so that recipes can be queried by ingredient.
+    """
+    __tablename__ = 'recipe_ingredients'
+    __table_args__ = (
+        # Used for finding the recipes with an ingredient
+        db.Index('ix_recipe_ingredients_name_recipe_id', 'name', 'recipe_id'),
+    )
+
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)  # Normalized name, see ingredients.normalize_ingredient
+    unit = db.Column(db.String)
+    quantity = db.Column(db.Float)
 
 
 liked_recipes_table = db.Table(
     'liked_recipes_table',
-    db.Column('user_id', db.Integer, db.ForeignKey('users.id')),
-    db.Column('recipe_id', db.Integer, db.ForeignKey('recipes.id'))
+    db.Column('user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
+    db.Column('recipe_id', db.Integer, db.ForeignKey('recipes.id'), primary_key=True),
+    db.Index('ix_liked_recipes_table_recipe_id', 'recipe_id')
 )
 
+FRIENDSHIP_PENDING = 'pending'  # A friend request that has not been accepted
+FRIENDSHIP_ACCEPTED = 'accepted'
+
+# Friendships and friend requests between two users. Each pair of users has at most one row,
+# with the lowest user id in user1_id.
 friendship = db.Table(
     'friendships',
     db.Column('user1_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
-    db.Column('user2_id', db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    db.Column('user2_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
+    db.Column('status', db.String(8), nullable=False),  # FRIENDSHIP_PENDING or FRIENDSHIP_ACCEPTED
+    db.Column('requester_id', db.Integer, db.ForeignKey('users.id')),  # Who sent the friend request
+    db.CheckConstraint('user1_id < user2_id', name='ck_friendships_user_order'),
+    # Used for finding the friends with a lower id than a user
+    db.Index('ix_friendships_user2_id_user1_id', 'user2_id', 'user1_id')
 )
 
-friendship_request = db.Table(
-    'friendship_requests',
-    db.Column('requesting_user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
-    db.Column('receiving_user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True)
+# Precomputed home timelines. Only kept up to date when the feed is in push mode.
+timeline = db.Table(
+    'timeline',
+    db.Column('owner_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
+    db.Column('recipe_id', db.Integer, db.ForeignKey('recipes.id'), primary_key=True),
+    db.Index('ix_timeline_recipe_id', 'recipe_id')
 )
 
 
@@ -32,24 +79,10 @@ class User(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
+    search_name = db.Column(db.String, nullable=False, index=True)  # Normalized name, see search.normalize_name
     email = db.Column(db.String, nullable=False, unique=True)
     pw_hash = db.Column(db.String, nullable=False)
 
-    friends = db.relationship(
-        'User',
-        secondary=friendship,
-        primaryjoin=id == friendship.c.user1_id,
-        secondaryjoin=id == friendship.c.user2_id
-    )
-
-    outgoing_friend_requests = db.relationship(
-        'User',
-        secondary=friendship_request,
-        primaryjoin=id == friendship_request.c.requesting_user_id,
-        secondaryjoin=id == friendship_request.c.receiving_user_id,
-        backref='incoming_friend_requests'
-    )
-
     liked_recipes = db.relationship(
         'Recipe',
         secondary=liked_recipes_table,
@@ -58,6 +91,62 @@ class User(db.Model):
 
     recipes = db.relationship("Recipe")
 
+    @property
+    def friends(self) -> List['User']:
+        """
+        The friends of the user, sorted by id. Queried on every access.
+        """
+        return self._connected_users(friendship.c.status == FRIENDSHIP_ACCEPTED)
+
+    @property
+    def outgoing_friend_requests(self) -> List['User']:
+        """
+        The users that this user has sent friend requests to, sorted by id. Queried on every access.
+        """
+        return self._connected_users(and_(friendship.c.status == FRIENDSHIP_PENDING,
+                                          friendship.c.requester_id == self.id))
+
+    @property
+    def incoming_friend_requests(self) -> List['User']:
+        """
+        The users that have sent friend requests to this user, sorted by id. Queried on every access.
+        """
+        return self._connected_users(and_(friendship.c.status == FRIENDSHIP_PENDING,
+                                          friendship.c.requester_id != self.id))
+
+    def _connected_users(self, condition) -> List['User']:
+        """
+        Returns the users that have a row in the friendships table with this user, that matches condition.
+        """
+        return User.query.join(friendship, or_(
+            and_(friendship.c.user1_id == self.id, friendship.c.user2_id == User.id),
+            and_(friendship.c.user2_id == self.id, friendship.c.user1_id == User.id)
+        )).filter(condition).order_by(User.id).all()
+
+    def get_public_data(self) -> Dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+        }
+
+
+class PublicUser:
+    """
+    The public data of a user, without the rest of the user.
+    Used in place of User objects when many users are listed.
+    """
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PublicUser) and (self.id, self.name) == (other.id, other.name)
+
+    def __repr__(self) -> str:
+        return f"PublicUser({self.id!r}, {self.name!r})"
+
     def get_public_data(self) -> Dict:
         return {
             "id": self.id,
@@ -67,12 +156,20 @@ class User(db.Model):
 
 class Recipe(db.Model):
     __tablename__ = 'recipes'
+    __table_args__ = (
+        # Used for listing the latest recipes of some users
+        db.Index('ix_recipes_user_id_id', 'user_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
-    ingredients = db.Column(db.String)
-    instructions = db.Column(db.String)
-    image = db.Column(db.String)
+    ingredients = db.Column(JSON)
+    instructions = db.Column(JSON)
+    image = db.Column(db.String(64))  # Key in the image store
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Increased on every change
+    updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc),
+                           server_default=db.func.now())
 
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     user = db.relationship("User", back_populates="recipes")
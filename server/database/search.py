@@ -0,0 +1,136 @@
+"""
+Full-text search for recipes and name search for users.
+
+On PostgreSQL recipes are searched with a GIN index over a tsvector of the name,
+ingredients and instructions. On SQLite (local mode) an FTS5 table that is kept up
+to date with triggers is used instead.
+
+Users are searched by a normalized copy of their name. On PostgreSQL it has a
+trigram index that serves both prefix and substring matches. On SQLite prefix
+matches are a range scan over the b-tree index of the column.
+"""
+import re
+import unicodedata
+from typing import List, Optional
+
+from sqlalchemy import DDL, Float, Integer, and_, event, text
+from sqlalchemy.engine import Connectable
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.sql.selectable import Alias
+
+from server.database.models import Recipe, User
+
+_PG_DOCUMENT = ("to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(ingredients::text, '') || ' ' || "
+                "coalesce(instructions::text, ''))")
+
+_SQLITE_DDL = [
+    "DROP TABLE IF EXISTS recipes_fts",
+    "CREATE VIRTUAL TABLE recipes_fts USING fts5(name, ingredients, instructions, content='recipes', "
+    "content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS recipes_fts_insert AFTER INSERT ON recipes BEGIN "
+    "INSERT INTO recipes_fts(rowid, name, ingredients, instructions) "
+    "VALUES (new.id, new.name, new.ingredients, new.instructions); END",
+    "CREATE TRIGGER IF NOT EXISTS recipes_fts_delete AFTER DELETE ON recipes BEGIN "
+    "INSERT INTO recipes_fts(recipes_fts, rowid, name, ingredients, instructions) "
+    "VALUES ('delete', old.id, old.name, old.ingredients, old.instructions); END",
+    "CREATE TRIGGER IF NOT EXISTS recipes_fts_update AFTER UPDATE OF name, ingredients, instructions ON recipes BEGIN "
+    "INSERT INTO recipes_fts(recipes_fts, rowid, name, ingredients, instructions) "
+    "VALUES ('delete', old.id, old.name, old.ingredients, old.instructions); "
+    "INSERT INTO recipes_fts(rowid, name, ingredients, instructions) "
+    "VALUES (new.id, new.name, new.ingredients, new.instructions); END",
+]
+
+_PG_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_recipes_search ON recipes USING GIN ({_PG_DOCUMENT})",
+]
+
+_PG_USER_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_search_name_trgm ON users USING GIN (search_name gin_trgm_ops)",
+]
+
+# Largest code point. Every string that starts with a prefix sorts below prefix + _MAX_CHAR.
+_MAX_CHAR = '\U0010ffff'
+
+# Create the search indexes together with the tables
+for _statement in _SQLITE_DDL:
+    event.listen(Recipe.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+for _statement in _PG_DDL:
+    event.listen(Recipe.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+for _statement in _PG_USER_DDL:
+    event.listen(User.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+
+
+def create_index(connection: Connectable) -> None:
+    """
+    Creates the search index and fills it with all existing recipes.
+    Only needed for databases created before search was added.
+    """
+    if connection.dialect.name == 'sqlite':
+        for statement in _SQLITE_DDL:
+            connection.execute(text(statement))
+        connection.execute(text("INSERT INTO recipes_fts(recipes_fts) VALUES ('rebuild')"))
+    elif connection.dialect.name == 'postgresql':
+        for statement in _PG_DDL:
+            connection.execute(text(statement))
+
+
+def create_user_index(connection: Connectable) -> None:
+    """
+    Creates the indexes for searching users by name.
+    Only needed for databases created before users had search names.
+    """
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_users_search_name ON users (search_name)"))
+
+    if connection.dialect.name == 'postgresql':
+        for statement in _PG_USER_DDL:
+            connection.execute(text(statement))
+
+
+def search_terms(match: str) -> List[str]:
+    """
+    Returns the words in a search string.
+    """
+    return re.findall(r"\w+", match.lower())
+
+
+def matching_recipes(dialect: str, match: str) -> Optional[Alias]:
+    """
+    Returns a subquery with the id and rank of all recipes that contain all words in match.
+    Each word also matches words that it is a prefix of. Higher rank means a better match.
+    :return: Subquery with id and rank columns, or None if match has no words.
+    """
+    terms = search_terms(match)
+
+    if not terms:
+        return None
+
+    if dialect == 'postgresql':
+        query = text(
+            f"SELECT id, ts_rank({_PG_DOCUMENT}, to_tsquery('simple', :query)) AS rank FROM recipes "
+            f"WHERE {_PG_DOCUMENT} @@ to_tsquery('simple', :query)"
+        ).bindparams(query=' & '.join(f"{term}:*" for term in terms))
+    else:
+        query = text(
+            "SELECT rowid AS id, -bm25(recipes_fts) AS rank FROM recipes_fts WHERE recipes_fts MATCH :query"
+        ).bindparams(query=' '.join(f'"{term}"*' for term in terms))
+
+    return query.columns(id=Integer, rank=Float).alias('matching_recipes')
+
+
+def normalize_name(name: str) -> str:
+    """
+    Returns a user name in the form that it is searched in.
+    """
+    return unicodedata.normalize('NFKC', name).casefold()
+
+
+def prefix_filter(dialect: str, column: ColumnElement, prefix: str) -> ColumnElement:
+    """
+    Returns a filter for values of a normalized column that start with prefix.
+    """
+    if dialect == 'sqlite':
+        # SQLite can only use an index for LIKE on case insensitive columns, but a range works on any index.
+        return and_(column >= prefix, column < prefix + _MAX_CHAR)
+
+    return column.startswith(prefix, autoescape=True)
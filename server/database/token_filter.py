@@ -0,0 +1,159 @@
+"""
+Bloom filter front end for revoked token lookups.
+
+Almost every token that is checked is not revoked. The filter answers those
+checks without a database query, and only possibly revoked tokens have to be
+looked up in the token blocklist.
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+
+from server.bloom_filter import BloomFilter
+from server.database.handler import db, run_in_background
+from server.database.models import TokenBlocklist
+
+MIN_CAPACITY = 10000
+FALSE_POSITIVE_RATE = 0.001
+
+
+class RevokedTokenFilter:
+    """
+    Bloom filter with the ids (jti) of all revoked tokens.
+    The filter is built from the token blocklist when it is first used, and rebuilt when it is older than max_age
+    seconds, so that tokens revoked by other workers are found even if no invalidation reaches this worker.
+    Only one thread builds the filter at a time. Rebuilds run in a background thread, and lookups use the old
+    filter until the new one is ready.
+    """
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+
+        self.lookups = 0
+        self.negatives = 0
+        self.false_positives = 0
+        self.rebuilds = 0
+
+        self._filter: Optional[BloomFilter] = None
+        self._built_at = 0.0
+        self._added_while_building: Optional[List[str]] = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()  # Held by the thread that builds the filter
+
+    def might_contain(self, jti: str) -> bool:
+        """
+        Returns False if a token is definitely not revoked.
+        """
+        bloom_filter = self._filter
+
+        if bloom_filter is None:
+            bloom_filter = self._build_first()
+        elif time.monotonic() - self._built_at > self.max_age:
+            self._rebuild_in_background()
+
+        self.lookups += 1
+        result = jti in bloom_filter
+
+        if not result:
+            self.negatives += 1
+
+        return result
+
+    def add(self, jti: str) -> None:
+        """
+        Adds a revoked token to the filter.
+        """
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+            if self._added_while_building is not None:
+                self._added_while_building.append(jti)
+
+    def record_false_positive(self) -> None:
+        """
+        Counts a token that the filter reported as possibly revoked, but was not revoked.
+        """
+        self.false_positives += 1
+
+    def rebuild(self) -> None:
+        """
+        Builds a new filter from the token blocklist. Waits for a build in another thread to finish first.
+        """
+        with self._build_lock:
+            self._build()
+
+    def _build_first(self) -> BloomFilter:
+        """
+        Builds the filter in this thread, unless another thread built it while waiting.
+        """
+        with self._build_lock:
+            if self._filter is None:
+                self._build()
+
+            return self._filter
+
+    def _rebuild_in_background(self) -> None:
+        """
+        Starts a rebuild in a background thread, unless the filter already is being built.
+        """
+        if not self._build_lock.acquire(blocking=False):
+            return
+
+        def rebuild():
+            try:
+                self._build()
+            finally:
+                self._build_lock.release()
+
+        try:
+            run_in_background(rebuild)
+        except Exception:
+            self._build_lock.release()
+            raise
+
+    def _build(self) -> None:
+        """
+        Builds a new filter from the token blocklist. The caller must hold the build lock.
+        """
+        with self._lock:
+            self._added_while_building = []
+
+        try:
+            count = db.session.query(TokenBlocklist.id).count()
+            new_filter = BloomFilter(max(count * 2, MIN_CAPACITY), FALSE_POSITIVE_RATE)
+
+            for jti, in db.session.query(TokenBlocklist.jti).yield_per(1000):
+                new_filter.add(jti)
+
+            with self._lock:
+                # Tokens revoked while the filter was built might not have been in the query result
+                for jti in self._added_while_building:
+                    new_filter.add(jti)
+
+                self._filter = new_filter
+                self._built_at = time.monotonic()
+                self.rebuilds += 1
+        finally:
+            with self._lock:
+                self._added_while_building = None
+
+    def clear(self) -> None:
+        """
+        Removes the filter, so it is rebuilt on the next lookup.
+        """
+        with self._lock:
+            self._filter = None
+
+    def stats(self) -> Dict:
+        """
+        Returns the size of the filter and how well it is working.
+        """
+        stats = self._filter.stats() if self._filter else {}
+        stats.update({
+            'lookups': self.lookups,
+            'negatives': self.negatives,
+            'false_positives': self.false_positives,
+            'rebuilds': self.rebuilds,
+        })
+
+        return stats
@@ -0,0 +1,165 @@
+"""
+Resized versions (derivatives) of recipe images.
+
+Derivatives are created in a process pool when an image is uploaded, so the
+request threads are not blocked by image processing. A derivative that is
+missing when it is requested is created on demand.
+"""
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+
+from flask import Flask, current_app
+from PIL import Image, UnidentifiedImageError
+from sqlalchemy.exc import IntegrityError
+
+from server.database import image_store
+from server.database.handler import db
+
+FULL = 'full'
+
+# Largest width or height in pixels of each derivative size.
+SIZES = {
+    'thumb': 160,
+    'card': 640,
+}
+
+# Number of worker processes. With 0 workers, derivatives are created in the request thread.
+WORKERS = int(os.environ.get('IMAGE_WORKERS', 1))
+
+# Errors from Pillow for data that is not a valid image, or that is too large to decode safely.
+IMAGE_ERRORS = (UnidentifiedImageError, OSError, SyntaxError, Image.DecompressionBombError)
+
+_executor = None
+
+
+def is_valid_size(size: str) -> bool:
+    """
+    Returns True if a string is a supported image size.
+    """
+    return size == FULL or size in SIZES
+
+
+def derivative_key(image_key: str, size: str) -> str:
+    """
+    Returns the store key for an image in a given size.
+    """
+    if size == FULL:
+        return image_key
+
+    return f"{image_key}_{size}"
+
+
+def is_valid_image(data: bytes) -> bool:
+    """
+    Returns True if data is a jpeg image that Pillow can open.
+    """
+    try:
+        with Image.open(BytesIO(data)) as image:
+            if image.format != 'JPEG':
+                return False
+
+            image.verify()
+    except IMAGE_ERRORS:
+        return False
+
+    return True
+
+
+def resize(data: bytes, max_side: int) -> bytes:
+    """
+    Resizes a jpeg image so that neither side is larger than max_side pixels.
+    :return: The resized jpeg image.
+    """
+    with Image.open(BytesIO(data)) as image:
+        # Let the jpeg decoder scale down the image while decoding it.
+        image.draft('RGB', (max_side, max_side))
+        image = image.convert('RGB')
+        image.thumbnail((max_side, max_side))
+
+        output = BytesIO()
+        image.save(output, 'JPEG', quality=85, optimize=True)
+
+    return output.getvalue()
+
+
+def schedule(image_key: str, data: bytes) -> None:
+    """
+    Creates all missing derivatives of an image in the background.
+    """
+    app = current_app._get_current_object()
+
+    for size, max_side in SIZES.items():
+        key = derivative_key(image_key, size)
+
+        if image_store.store.exists(key):
+            continue
+
+        if WORKERS == 0:
+            try:
+                _save(key, resize(data, max_side))
+            except IMAGE_ERRORS as e:
+                app.logger.error("Failed to create image %s: %s", key, e)
+        else:
+            future = _get_executor().submit(resize, data, max_side)
+            future.add_done_callback(partial(_save_result, app, key))
+
+
+def create(image_key: str, size: str) -> bool:
+    """
+    Creates a derivative of an image in the request thread, if it does not exist.
+    :return: False if the original image does not exist or can't be resized.
+    """
+    key = derivative_key(image_key, size)
+
+    if image_store.store.exists(key):
+        return True
+
+    if size == FULL:
+        return False
+
+    data = image_store.store.load(image_key)
+    if data is None:
+        return False
+
+    try:
+        resized = resize(data, SIZES[size])
+    except IMAGE_ERRORS as e:
+        current_app.logger.error("Failed to create image %s: %s", key, e)
+        return False
+
+    _save(key, resized)
+
+    return True
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=WORKERS)
+
+    return _executor
+
+
+def _save_result(app: Flask, key: str, future: Future) -> None:
+    """
+    Saves a derivative created by a worker process.
+    """
+    with app.app_context():
+        if future.exception():
+            app.logger.error("Failed to create image %s: %s", key, future.exception())
+            return
+
+        _save(key, future.result())
+        db.session.remove()
+
+
+def _save(key: str, data: bytes) -> None:
+    try:
+        image_store.store.put(key, data)
+        db.session.commit()
+    except IntegrityError:
+        # The same derivative was saved by another request.
+        db.session.rollback()
@@ -0,0 +1,89 @@
+"""
+JSON encoding and decoding for requests and responses.
+
+Uses orjson when it is installed, which is several times faster than the json
+module for the list heavy responses of the API. Falls back to the json module
+with the same output otherwise.
+"""
+import json
+from typing import Any, Optional, Union
+
+from flask import Flask, Response, current_app, request
+from flask.json import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Used for values that JSON does not support, e.g. dates. Gives the same output as jsonify.
+_default = JSONEncoder().default
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """
+    Encodes a value as compact JSON.
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+
+        return orjson.dumps(obj, default=_default, option=option)
+
+    return json.dumps(obj, default=_default, sort_keys=sort_keys, ensure_ascii=False,
+                      separators=(',', ':')).encode()
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    Decodes JSON. Raises ValueError if the data is not valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+def request_json() -> Any:
+    """
+    Decodes the body of the current request.
+    """
+    return loads(request.get_data())
+
+
+def get_limit(data: dict, default: int, max_limit: int) -> Optional[int]:
+    """
+    Returns the limit field of a decoded request, for the number of items to return.
+    :param default: Limit used if the request has no limit.
+    :param max_limit: Larger limits are lowered to this.
+    :return: The limit, or None if it is not a positive integer.
+    """
+    limit = data.get('limit', default)
+
+    # bool is a subclass of int, but true is not a valid limit
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        return None
+
+    return min(limit, max_limit)
+
+
+def json_response(obj: Any) -> Response:
+    """
+    Returns a response with a value encoded as JSON.
+    """
+    return current_app.response_class(dumps(obj, current_app.config['JSON_SORT_KEYS']), mimetype='application/json')
+
+
+class JSONFlask(Flask):
+    """
+    Flask app that encodes dicts returned by views with dumps instead of jsonify.
+    """
+
+    def make_response(self, rv) -> Response:
+        if isinstance(rv, dict):
+            rv = json_response(rv)
+        elif isinstance(rv, tuple) and rv and isinstance(rv[0], dict):
+            rv = (json_response(rv[0]),) + rv[1:]
+
+        return super().make_response(rv)
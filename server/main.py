@@ -1,39 +1,265 @@
 import datetime
 import os
 
-from flask import Flask
 from flask_cors import CORS
+from sqlalchemy import inspect
 
-from server.database import handler
+from server import compression
+from server.database import handler, interface, search
+from server.json_codec import JSONFlask
 from server.routes.auth import auth_api, bcrypt, jwt
 from server.routes.friends import friend_api
 from server.routes.recipes import recipe_api
 from server.routes.users import user_api
 
-app = Flask(__name__)
+app = JSONFlask(__name__)
 
 app.config['SQLALCHEMY_DATABASE_URI'] = handler.get_db_uri()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.environ['SERVER_SECRET']
 app.config['JWT_TOKEN_LOCATION'] = ['headers']
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = datetime.timedelta(weeks=52)
+# 'pull' reads the feed from the recipes of all friends, 'push' from precomputed timelines.
+app.config['FEED_MODE'] = os.environ.get('FEED_MODE', 'pull')
+# Key for the statistics endpoints, which are turned off without a key.
+app.config['STATS_KEY'] = os.environ.get('STATS_KEY')
 
 app.register_blueprint(auth_api, url_prefix='/auth')
 app.register_blueprint(recipe_api, url_prefix='/recipes')
 app.register_blueprint(friend_api, url_prefix='/friends')
 app.register_blueprint(user_api, url_prefix='/users')
 
+app.after_request(compression.compress_response)
+
 handler.db.init_app(app)
 bcrypt.init_app(app)
 jwt.init_app(app)
 
-CORS(app)
+CORS(app, expose_headers=['ETag', 'Last-Modified'])
 
 
 def init():
     handler.init_db(app)
 
 
+def migrate_images():
+    """
+    Moves recipe images stored as data uris in the recipes table to the image store.
+    """
+    handler.db.create_all(app=app)
+
+    with app.app_context():
+        count = interface.migrate_recipe_images()
+
+    print(f"Migrated {count} recipe images.")
+
+
+def index_ingredients():
+    """
+    Fills the recipe ingredients table from the ingredients of all recipes.
+    """
+    handler.db.create_all(app=app)
+
+    with app.app_context():
+        count = interface.index_recipe_ingredients()
+
+    print(f"Indexed the ingredients of {count} recipes.")
+
+
+def migrate_user_search_names():
+    """
+    Adds the search name column to the users table and fills it in.
+    Only needed for databases created before users had search names.
+    """
+    with app.app_context():
+        with handler.db.engine.begin() as connection:
+            _add_column(connection, 'users', 'search_name', "VARCHAR NOT NULL DEFAULT ''")
+
+        count = interface.index_user_search_names()
+
+        with handler.db.engine.begin() as connection:
+            search.create_user_index(connection)
+
+    print(f"Indexed the names of {count} users.")
+
+
+def migrate_recipe_json():
+    """
+    Converts the ingredients and instructions columns of the recipes table from text to jsonb.
+    Only needed on PostgreSQL databases created before the columns were JSON. On SQLite JSON is stored as text.
+    """
+    with app.app_context():
+        with handler.db.engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                for column in ('ingredients', 'instructions'):
+                    connection.execute(f"ALTER TABLE recipes ALTER COLUMN {column} TYPE jsonb USING {column}::jsonb")
+
+
+def migrate_recipe_versions():
+    """
+    Adds the version and updated_at columns to the recipes table.
+    Only needed for databases created before recipes had versions.
+    """
+    with app.app_context():
+        with handler.db.engine.begin() as connection:
+            _add_column(connection, 'recipes', 'version', "INTEGER NOT NULL DEFAULT 1")
+
+            # SQLite can only add columns with constant defaults, so old recipes get the current time afterwards
+            if _add_column(connection, 'recipes', 'updated_at', "TIMESTAMP NOT NULL DEFAULT '1970-01-01 00:00:00'"):
+                connection.execute("UPDATE recipes SET updated_at = CURRENT_TIMESTAMP")
+                if connection.dialect.name == 'postgresql':
+                    connection.execute("ALTER TABLE recipes ALTER COLUMN updated_at SET DEFAULT now()")
+
+
+def create_search_index():
+    """
+    Creates the recipe search index. Only needed for databases created before search was added.
+    """
+    with app.app_context():
+        with handler.db.engine.begin() as connection:
+            search.create_index(connection)
+
+
+def create_recipe_user_index():
+    """
+    Creates the index used for listing the latest recipes of some users.
+    Only needed for databases created before the index was added.
+    """
+    with app.app_context():
+        with handler.db.engine.begin() as connection:
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_recipes_user_id_id ON recipes (user_id, id)")
+
+
+def prune_blocklist():
+    """
+    Removes expired tokens from the token blocklist. Should be run regularly, e.g. daily.
+    """
+    with app.app_context():
+        count = interface.prune_blocklist(app.config['JWT_ACCESS_TOKEN_EXPIRES'])
+
+    print(f"Removed {count} expired tokens from the blocklist.")
+
+
+def migrate_token_expiry():
+    """
+    Adds the expiry time column to the token blocklist, so that prune_blocklist can remove expired tokens,
+    and indexes the blocklist by token id. Only needed for databases created before the expiry time was stored.
+    Tokens revoked before that are removed max_token_age after they were revoked.
+    """
+    with app.app_context():
+        with handler.db.engine.begin() as connection:
+            _add_column(connection, 'token_blocklist', 'expires_at', "TIMESTAMP")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_token_blocklist_expires_at "
+                               "ON token_blocklist (expires_at)")
+            connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_token_blocklist_jti "
+                               "ON token_blocklist (jti)")
+
+
+def reconcile_like_counts():
+    """
+    Recomputes the like counts of all recipes.
+    """
+    with app.app_context():
+        interface.reconcile_like_counts()
+
+
+def migrate_friendships():
+    """
+    Stores every friendship as a single row with the lowest user id first.
+    Only needed for databases created before friendships were stored once.
+    """
+    with app.app_context():
+        interface.migrate_friendships()
+
+        with handler.db.engine.begin() as connection:
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_friendships_user2_id_user1_id "
+                               "ON friendships (user2_id, user1_id)")
+            # SQLite can't add constraints to an existing table
+            if connection.dialect.name == 'postgresql' and 'ck_friendships_user_order' not in {
+                    constraint['name'] for constraint in inspect(connection).get_check_constraints('friendships')}:
+                connection.execute("ALTER TABLE friendships ADD CONSTRAINT ck_friendships_user_order "
+                                   "CHECK (user1_id < user2_id)")
+
+
+def migrate_friend_requests():
+    """
+    Moves friend requests to the friendships table, which now has the status of every friendship.
+    Only needed for databases created before friend requests were stored there. Run after migrate_friendships.
+    """
+    with app.app_context():
+        with handler.db.engine.begin() as connection:
+            _add_column(connection, 'friendships', 'status', "VARCHAR(8) NOT NULL DEFAULT 'accepted'")
+            _add_column(connection, 'friendships', 'requester_id', "INTEGER REFERENCES users (id)")
+            has_old_requests = 'friendship_requests' in inspect(connection).get_table_names()
+
+        # The old table is dropped after its requests are moved, so there is nothing to move if it is gone
+        count = interface.migrate_friend_requests() if has_old_requests else 0
+
+        with handler.db.engine.begin() as connection:
+            connection.execute("DROP TABLE IF EXISTS friendship_requests")
+
+    print(f"Moved {count} friend requests.")
+
+
+def migrate_like_counts():
+    """
+    Adds the like count column to the recipes table and counts the likes of every recipe.
+    Only needed for databases created before recipes had a like count.
+    """
+    with app.app_context():
+        with handler.db.engine.begin() as connection:
+            _add_column(connection, 'recipes', 'like_count', "INTEGER NOT NULL DEFAULT 0")
+
+        interface.reconcile_like_counts()
+
+
+def migrate_liked_recipes():
+    """
+    Removes duplicate likes, makes likes unique and indexes the liked recipes table by recipe.
+    Only needed for databases created before the liked recipes table had a primary key.
+    """
+    with app.app_context():
+        count = interface.remove_duplicate_likes()
+
+        with handler.db.engine.begin() as connection:
+            if not inspect(connection).get_pk_constraint('liked_recipes_table')['constrained_columns']:
+                if connection.dialect.name == 'postgresql':
+                    connection.execute("ALTER TABLE liked_recipes_table ADD PRIMARY KEY (user_id, recipe_id)")
+                else:
+                    # SQLite can't add a primary key to an existing table, but a unique index has the same effect
+                    connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_liked_recipes_table_user_id_recipe_id "
+                                       "ON liked_recipes_table (user_id, recipe_id)")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_liked_recipes_table_recipe_id "
+                               "ON liked_recipes_table (recipe_id)")
+
+        interface.reconcile_like_counts()
+
+    print(f"Removed {count} duplicate likes.")
+
+
+def rebuild_timelines():
+    """
+    Recreates the precomputed timelines. Run this before switching FEED_MODE to push.
+    """
+    handler.db.create_all(app=app)
+
+    with app.app_context():
+        interface.rebuild_timelines()
+
+
+def _add_column(connection, table: str, column: str, definition: str) -> bool:
+    """
+    Adds a column to an existing table, unless it already has the column.
+    :return: True if the column was added.
+    """
+    if column in {c['name'] for c in inspect(connection).get_columns(table)}:
+        return False
+
+    connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    return True
+
+
 if __name__ == "__main__":
     app.debug = True
     init()
@@ -1,13 +1,19 @@
 """
 API for handling authentication.
 """
-import json
+import hmac
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Optional
 
-from flask import Blueprint, request
+from flask import Blueprint, _request_ctx_stack, current_app, request
 from flask_bcrypt import Bcrypt
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt, JWTManager
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt, get_jwt_identity, JWTManager
+from werkzeug.local import LocalProxy
 
 from server.database import interface
+from server.database.models import PublicUser
+from server.json_codec import request_json
 
 auth_api = Blueprint('auth_api', __name__)
 bcrypt = Bcrypt()
@@ -23,12 +29,55 @@ def check_if_token_revoked(jwt_header, jwt_payload):
     return interface.is_revoked(jti)
 
 
+def stats_key_required(view):
+    """
+    Only lets requests with the STATS_KEY of the app in the X-Stats-Key header through to a view.
+    Used for the statistics endpoints, which are not found if the app has no STATS_KEY.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        stats_key = current_app.config.get('STATS_KEY')
+        if not stats_key:
+            return {'msg': 'Not found'}, 404
+
+        if not hmac.compare_digest(request.headers.get('X-Stats-Key', '').encode(), stats_key.encode()):
+            return {'msg': 'Wrong stats key'}, 403
+
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def get_current_user() -> Optional[PublicUser]:
+    """
+    Returns the id and name of the logged in user. Must be called in a view with @jwt_required().
+    The name is read from the token, so the users table is only queried for tokens created
+    before the name was added to them. The result is kept for the rest of the request.
+    """
+    # Kept on the request context like the decoded token, since g is shared by all requests in an app context
+    ctx = _request_ctx_stack.top
+
+    if not hasattr(ctx, 'current_user'):
+        name = get_jwt().get('name')
+
+        if name is not None:
+            ctx.current_user = PublicUser(get_jwt_identity(), name)
+        else:
+            ctx.current_user = interface.get_public_user(get_jwt_identity())
+
+    return ctx.current_user
+
+
+# The logged in user, resolved on first use
+current_user = LocalProxy(get_current_user)
+
+
 @auth_api.route('/login', methods=['POST'])
 def login():
     """
     Logs in a user.
     """
-    data = json.loads(request.data)
+    data = request_json()
 
     user_email = data['email']
     password = data['password']
@@ -37,7 +86,8 @@ def login():
 
     # If user exists and correct password
     if user and bcrypt.check_password_hash(user.pw_hash, password):
-        token = create_access_token(identity=user.id)
+        # Only public data can be put in the token, since anyone with the token can read it
+        token = create_access_token(identity=user.id, additional_claims={'name': user.name})
         return {'token': token}, 200
 
     return {'msg': 'Wrong email or password'}, 401
@@ -49,8 +99,9 @@ def logout():
     """
     Logs out the user.
     """
-    jti = get_jwt()['jti']
-    interface.revoke_token(jti)
+    jwt_data = get_jwt()
+    expires_at = datetime.fromtimestamp(jwt_data['exp'], timezone.utc)
+    interface.revoke_token(jwt_data['jti'], expires_at)
 
     return {'msg': 'Access token revoked'}, 200
 
@@ -62,3 +113,12 @@ def check():
     Checks if the user is authenticated.
     """
     return {'msg': 'Access'}, 200
+
+
+@auth_api.route('/stats', methods=['POST'])
+@stats_key_required
+def stats():
+    """
+    Returns statistics for the revoked token checks in this worker.
+    """
+    return interface.revoked_tokens_stats(), 200
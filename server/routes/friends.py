@@ -1,38 +1,60 @@
 """
 API for handling friendships.
 """
-import json
+from typing import Callable, List
 
-from flask import Blueprint, request
+from flask import Blueprint
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from server.database import interface
 from server.database.models import User
+from server.json_codec import get_limit, request_json
+from server.routes.auth import current_user, stats_key_required
 
 friend_api = Blueprint('friend_api', __name__)
 
+SUGGESTIONS_DEFAULT_LIMIT = 10
+SUGGESTIONS_MAX_LIMIT = 50
+BULK_MAX_IDS = 100
+
 
 @friend_api.route('/list-friends', methods=['POST'])
 @jwt_required()
 def list_firends():
     """
-    Returns the current friends of this user.
+    Returns the current friends of this user, and the users it has outgoing and incoming friend requests with.
+    """
+    connections = interface.list_connections(get_jwt_identity())
+
+    return {kind: [user.get_public_data() for user in users] for kind, users in connections.items()}, 200
+
+
+@friend_api.route('/suggestions', methods=['POST'])
+@jwt_required()
+def suggestions():
+    """
+    Returns users that this user may know: friends of its friends, with the most mutual friends first.
     """
-    user = interface.get_user_by_id(get_jwt_identity())
+    data = request_json()
+
+    limit = get_limit(data, SUGGESTIONS_DEFAULT_LIMIT, SUGGESTIONS_MAX_LIMIT)
+    if limit is None:
+        return {'msg': 'Invalid limit.'}, 400
 
-    accepted_friends = [friend.get_public_data() for friend in user.friends]
-    outgoing_friend_requests = [
-        friend.get_public_data() for friend in user.outgoing_friend_requests
-    ]
-    incoming_friend_requests = [
-        friend.get_public_data() for friend in user.incoming_friend_requests
-    ]
+    users = interface.friend_suggestions(get_jwt_identity(), limit)
 
-    return {
-        "friends": accepted_friends,
-        "outgoing_requests": outgoing_friend_requests,
-        "incoming_requests": incoming_friend_requests
-    }, 200
+    result = [dict(user.get_public_data(), mutual_friends=count) for user, count in users]
+
+    return {"result": result}, 200
+
+
+@friend_api.route('/stats', methods=['POST'])
+@stats_key_required
+def stats():
+    """
+    Returns statistics for the friend graph in this worker.
+    """
+    return interface.friend_graph_stats(), 200
 
 
 @friend_api.route('/create-friend-request', methods=['POST'])
@@ -41,13 +63,17 @@ def create_friend_request():
     """
     Creates a new friend request.
     """
-    data = json.loads(request.data)
+    data = request_json()
     friend_id = data['id']
 
-    user = interface.get_user_by_id(get_jwt_identity())
-    friend = interface.get_user_by_id(friend_id)
+    if friend_id == current_user.id:
+        return {'msg': 'Can\'t be friends with yourself.'}, 400
 
-    interface.create_friend_request(user, friend)
+    friend = interface.get_public_user(friend_id)
+    if friend is None:
+        return {'msg': 'Can\'t find user.'}, 400
+
+    interface.create_friend_request(current_user, friend)
 
     return '', 200
 
@@ -58,13 +84,17 @@ def cancel_friend_request():
     """
     Cancels an existing friend request.
     """
-    data = json.loads(request.data)
+    data = request_json()
     friend_id = data['id']
 
-    user = interface.get_user_by_id(get_jwt_identity())
-    friend = interface.get_user_by_id(friend_id)
+    if friend_id == current_user.id:
+        return {'msg': 'Can\'t be friends with yourself.'}, 400
+
+    friend = interface.get_public_user(friend_id)
+    if friend is None:
+        return {'msg': 'Can\'t find user.'}, 400
 
-    interface.cancel_friend_request(user, friend)
+    interface.cancel_friend_request(current_user, friend)
 
     return '', 200
 
@@ -75,13 +105,17 @@ def accept_friend_request():
     """
     Accepts an existing friend request.
     """
-    data = json.loads(request.data)
+    data = request_json()
     friend_id = data['id']
 
-    user = interface.get_user_by_id(get_jwt_identity())
-    friend = interface.get_user_by_id(friend_id)
+    if friend_id == current_user.id:
+        return {'msg': 'Can\'t be friends with yourself.'}, 400
 
-    interface.accept_friend_request(user, friend)
+    friend = interface.get_public_user(friend_id)
+    if friend is None:
+        return {'msg': 'Can\'t find user.'}, 400
+
+    interface.accept_friend_request(current_user, friend)
 
     return '', 200
 
@@ -92,12 +126,57 @@ def remove_friend():
     """
     Accepts an existing friend request.
     """
-    data = json.loads(request.data)
+    data = request_json()
     friend_id = data['id']
 
-    user = interface.get_user_by_id(get_jwt_identity())
-    friend = interface.get_user_by_id(friend_id)
+    if friend_id == current_user.id:
+        return {'msg': 'Can\'t be friends with yourself.'}, 400
+
+    friend = interface.get_public_user(friend_id)
+    if friend is None:
+        return {'msg': 'Can\'t find user.'}, 400
 
-    interface.remove_friendship(user, friend)
+    interface.remove_friendship(current_user, friend)
 
     return '', 200
+
+
+@friend_api.route('/accept-friend-requests', methods=['POST'])
+@jwt_required()
+def accept_friend_requests():
+    """
+    Accepts the friend requests from a list of users. Returns the ids of the users whose requests were accepted.
+    """
+    return _bulk_update(interface.accept_friend_requests)
+
+
+@friend_api.route('/decline-friend-requests', methods=['POST'])
+@jwt_required()
+def decline_friend_requests():
+    """
+    Declines the friend requests from a list of users. Returns the ids of the users whose requests were declined.
+    """
+    return _bulk_update(interface.decline_friend_requests)
+
+
+@friend_api.route('/cancel-friend-requests', methods=['POST'])
+@jwt_required()
+def cancel_friend_requests():
+    """
+    Cancels the friend requests to a list of users. Returns the ids of the users whose requests were cancelled.
+    """
+    return _bulk_update(interface.cancel_friend_requests)
+
+
+def _bulk_update(update: Callable[[int, List[int]], List[int]]):
+    """
+    Calls update with the logged in user and the list of user ids in the request, and returns the ids it changed.
+    """
+    data = request_json()
+    ids = data['ids']
+
+    if not isinstance(ids, list) or len(ids) > BULK_MAX_IDS or \
+            not all(isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in ids):
+        return {'msg': 'Invalid ids.'}, 400
+
+    return {"result": update(get_jwt_identity(), ids)}, 200
@@ -1,19 +1,36 @@
 """
 API for handling recipes.
 """
-import json
+import base64
+from datetime import datetime
+import hashlib
 
-from flask import Blueprint, request, send_file
+from flask import Blueprint, Response, current_app, g, request, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from io import BytesIO
-from urllib.request import urlopen
+from werkzeug.http import is_resource_modified
+import os
 import re
+from typing import Any, Optional, Tuple
 
+from server import image_derivatives
 from server.database import interface
+from server.database.image_store import decode_data_uri, image_key
 from server.database.models import Recipe
+from server.json_codec import dumps, get_limit, loads, request_json
+from server.routes.auth import current_user, stats_key_required
 
 recipe_api = Blueprint('recipe_api', __name__)
 
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60  # One year
+
+LATEST_DEFAULT_LIMIT = 20
+LATEST_MAX_LIMIT = 100
+
+BATCH_MAX_SIZE = 100
+
+PANTRY_MAX_SIZE = 200
+
 
 @recipe_api.route('/create', methods=['POST'])
 @jwt_required()
@@ -21,18 +38,20 @@ def create():
     """
     Lets the logged in user create a recipe.
     """
-    data = json.loads(request.data)
+    data = request_json()
     name = data['name']
-    ingredients = json.dumps(data['ingredients'])
-    instructions = json.dumps(data['instructions'])
-    image = data['image']
+    ingredients = data['ingredients']
+    instructions = data['instructions']
+    image_uri = data['image']
 
-    if not _is_valid_img_uri(image):
+    image = decode_data_uri(image_uri) if image_uri else None
+    if image_uri and not (_is_valid_img_uri(image_uri) and image and image_derivatives.is_valid_image(image)):
         return '', 415
 
-    user = interface.get_user_by_id(get_jwt_identity())
+    recipe = interface.create_recipe(current_user, name, ingredients, instructions, image)
 
-    interface.create_recipe(user, name, ingredients, instructions, image)
+    if image:
+        image_derivatives.schedule(recipe.image, image)
 
     return '', 200
 
@@ -43,25 +62,26 @@ def change():
     """
     Lets the logged in user change the contents of a recipe.
     """
-    data = json.loads(request.data)
+    data = request_json()
     recipe_id = data['id']
     name = data['name']
-    ingredients = json.dumps(data['ingredients'])
-    instructions = json.dumps(data['instructions'])
-    image = data['image']
+    ingredients = data['ingredients']
+    instructions = data['instructions']
+    image_uri = data['image']
 
-    if not _is_valid_img_uri(image):
+    image = decode_data_uri(image_uri) if image_uri else None
+    if image_uri and not (_is_valid_img_uri(image_uri) and image and image_derivatives.is_valid_image(image)):
         return '', 415
 
-    user = interface.get_user_by_id(get_jwt_identity())
+    if not interface.is_recipe_owner(current_user.id, recipe_id):
+        return "Wrong recipe id", 400
+
+    interface.change_recipe(recipe_id, name, ingredients, instructions, image)
 
-    for recipe in user.recipes:
-        if recipe_id == recipe.id:
-            interface.change_recipe(
-                recipe_id, name, ingredients, instructions, image)
-            return '', 200
+    if image:
+        image_derivatives.schedule(image_key(image), image)
 
-    return "Wrong recipe id", 400
+    return '', 200
 
 
 @recipe_api.route('/delete', methods=['POST'])
@@ -70,16 +90,15 @@ def delete():
     """
     Lets the logged in user delete a recipe.
     """
-    data = json.loads(request.data)
+    data = request_json()
     recipe_id = data['id']
-    user = interface.get_user_by_id(get_jwt_identity())
+    recipe = interface.get_recipe_by_id(recipe_id)
+    if recipe is None or recipe.user_id != current_user.id:
+        return "Wrong recipe id", 400
 
-    for recipe in user.recipes:
-        if recipe_id == recipe.id:
-            interface.delete_recipe(recipe)
-            return '', 200
+    interface.delete_recipe(recipe)
 
-    return "Wrong recipe id", 400
+    return '', 200
 
 
 @recipe_api.route('/get', methods=['POST'])
@@ -88,21 +107,74 @@ def get():
     """
     Returns the recipe with a specified id.
     """
-    data = json.loads(request.data)
+    data = request_json()
     id = data['id']
 
     # TODO: Check if this is allowed for this user.
-    recipe = interface.get_recipe_by_id(id)
+    payload = interface.get_cached_recipe_payload(id)
+
+    if payload is None and _is_conditional_request():
+        # Answer revalidations of recipes that are not cached without loading and serializing them
+        version = interface.get_recipe_version(id)
+
+        if version is not None:
+            etag, updated_at = _recipe_etag(id, version[0]), version[1]
 
-    result = {'id': recipe.id,
-              'name': recipe.name,
-              'ingredients': json.loads(recipe.ingredients),
-              'instructions': json.loads(recipe.instructions),
-              'user': recipe.user.name,
-              'likes': len(recipe.liked_by),
-              'img_url': _recipe_img_url(recipe)}
+            if not is_resource_modified(request.environ, etag=etag, last_modified=updated_at):
+                return _not_modified(etag, updated_at)
 
-    return result, 200
+    if payload is None:
+        payload = interface.load_recipe_payload(id, _recipe_payload)
+
+    if payload is None:
+        return {'msg': 'Recipe not found.'}, 404
+
+    info, body = _split_recipe_payload(payload)
+
+    etag = _recipe_etag(id, info['version'])
+    updated_at = datetime.fromisoformat(info['updated_at'])
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=updated_at):
+        return _not_modified(etag, updated_at)
+
+    # The response only changes with the recipe version, so its compressed body can be cached.
+    # The update time is part of the key since the id and version of a deleted recipe can be reused.
+    g.compression_key = ('recipe', id, info['version'], info['updated_at'], request.url_root)
+
+    response = current_app.response_class(_add_img_url(info, body), mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.last_modified = updated_at
+
+    return response
+
+
+@recipe_api.route('/stats', methods=['POST'])
+@stats_key_required
+def stats():
+    """
+    Returns statistics for the recipe payload cache in this worker.
+    """
+    return interface.recipe_payloads_stats(), 200
+
+
+@recipe_api.route('/get_batch', methods=['POST'])
+@jwt_required()
+def get_batch():
+    """
+    Returns the recipes with the specified ids, as a map from id to recipe.
+    Ids of recipes that don't exist, or that are not by the logged in user or its friends, are left out.
+    """
+    data = request_json()
+    ids = data.get('ids')
+
+    if not _is_id_list(ids):
+        return {'msg': 'Invalid ids.'}, 400
+    if len(ids) > BATCH_MAX_SIZE:
+        return {'msg': f'Max {BATCH_MAX_SIZE} ids.'}, 400
+
+    recipes = interface.get_recipes_by_ids(ids, user_id=current_user.id)
+
+    return {'result': {str(recipe.id): _recipe_data(recipe) for recipe in recipes}}, 200
 
 
 @recipe_api.route('/like', methods=['POST'])
@@ -111,16 +183,14 @@ def like():
     """
     Makes the logged in user like a recipe.
     """
-    data = json.loads(request.data)
+    data = request_json()
     recipe_id = data['id']
 
     recipe = interface.get_recipe_by_id(recipe_id)
     if recipe is None:
         return {'msg': 'Can\'t find recipe.'}, 400
 
-    user = interface.get_user_by_id(get_jwt_identity())
-
-    interface.like_recipe(user, recipe)
+    interface.like_recipe(current_user, recipe)
 
     return '', 200
 
@@ -131,16 +201,14 @@ def unlike():
     """
     Makes the logged in user unlike a recipe.
     """
-    data = json.loads(request.data)
+    data = request_json()
     recipe_id = data['id']
 
     recipe = interface.get_recipe_by_id(recipe_id)
     if recipe is None:
         return {'msg': 'Can\'t find recipe.'}, 400
 
-    user = interface.get_user_by_id(get_jwt_identity())
-
-    interface.stop_like_recipe(user, recipe)
+    interface.stop_like_recipe(current_user, recipe)
 
     return '', 200
 
@@ -151,67 +219,342 @@ def is_liked():
     """
     Returns whether the logged in user has liked a given recipe.
     """
-    data = json.loads(request.data)
+    data = request_json()
     recipe_id = data['id']
 
-    recipe = interface.get_recipe_by_id(recipe_id)
-    if recipe is None:
+    if not interface.recipe_exists(recipe_id):
         return {'msg': 'Can\'t find recipe.'}, 400
 
-    user = interface.get_user_by_id(get_jwt_identity())
-
-    liked = recipe in user.liked_recipes
+    liked = interface.is_liked(get_jwt_identity(), recipe_id)
 
     return {'liked': liked}, 200
 
 
+@recipe_api.route('/is_liked_batch', methods=['POST'])
+@jwt_required()
+def is_liked_batch():
+    """
+    Returns whether the logged in user has liked the given recipes, as a map from id to liked.
+    """
+    data = request_json()
+    ids = data.get('ids')
+
+    if not _is_id_list(ids):
+        return {'msg': 'Invalid ids.'}, 400
+    if len(ids) > BATCH_MAX_SIZE:
+        return {'msg': f'Max {BATCH_MAX_SIZE} ids.'}, 400
+
+    liked_ids = interface.liked_recipe_ids(get_jwt_identity(), ids)
+
+    return {'liked': {str(recipe_id): recipe_id in liked_ids for recipe_id in ids}}, 200
+
+
 @recipe_api.route('/latest', methods=['POST'])
 @jwt_required()
 def latest():
     """
     Returns a list with the latest recipes created by the logged in user and its friends.
-    If a match is given, it will only return recipes with match as a substring.
+    If a match is given, it will only return recipes that contain all words in match.
+    The list is paginated. Pass the returned next_cursor as cursor to get the next page.
     """
-    data = json.loads(request.data)
+    data = request_json()
 
     if 'match' in data:
         match = data['match']
     else:
         match = ''
 
-    user = interface.get_user_by_id(get_jwt_identity())
+    limit = get_limit(data, LATEST_DEFAULT_LIMIT, LATEST_MAX_LIMIT)
+    if limit is None:
+        return {'msg': 'Invalid limit.'}, 400
+
+    before_id = None
+    if data.get('cursor'):
+        before_id = _decode_cursor(data['cursor'])
+        if before_id is None:
+            return {'msg': 'Invalid cursor.'}, 400
+
+    # Get one extra recipe to know if there is a next page. Only the versions are loaded,
+    # so that polling clients can be answered before the recipes are loaded.
+    versions = interface.feed_versions(get_jwt_identity(), match, before_id, limit + 1)
+
+    etag = "feed-" + hashlib.blake2b(repr((match, limit, versions)).encode(), digest_size=16).hexdigest()
+    if not is_resource_modified(request.environ, etag=etag):
+        return _not_modified(etag)
+
+    recipes = interface.get_recipe_summaries([recipe_id for recipe_id, _ in versions[:limit]])
+
+    next_cursor = None
+    if len(versions) > limit:
+        next_cursor = _encode_cursor(versions[limit - 1][0])
+
+    result = [_recipe_summary(recipe) for recipe in recipes]
+
+    response = current_app.make_response({'result': result, 'next_cursor': next_cursor})
+    response.set_etag(etag, weak=True)
+
+    return response
+
+
+@recipe_api.route('/cook', methods=['POST'])
+@jwt_required()
+def cook():
+    """
+    Returns the recipes created by the logged in user and its friends that can best be cooked with the
+    ingredients in a pantry. Recipes that use a larger share of their ingredients from the pantry come first.
+    """
+    data = request_json()
+    pantry = data['pantry']
+
+    if not isinstance(pantry, list) or len(pantry) > PANTRY_MAX_SIZE \
+            or not all(isinstance(name, str) for name in pantry):
+        return {'msg': 'Invalid pantry.'}, 400
 
-    recipe_creators = [user] + user.friends
-    recipes = interface.latest_recipes(recipe_creators, match)
+    limit = get_limit(data, LATEST_DEFAULT_LIMIT, LATEST_MAX_LIMIT)
+    if limit is None:
+        return {'msg': 'Invalid limit.'}, 400
 
-    result = [{'id': recipe.id, 'name': recipe.name, 'user': recipe.user.name, 'img_url': _recipe_img_url(recipe)}
-              for recipe in recipes]
+    recipes = interface.cookable_recipes(get_jwt_identity(), pantry, limit)
+
+    result = [dict(_recipe_summary(recipe), matched=matched, total=total) for recipe, matched, total in recipes]
 
     return {'result': result}, 200
 
 
+@recipe_api.route('/search', methods=['POST'])
+@jwt_required()
+def search():
+    """
+    Searches the recipes created by the logged in user and its friends for all words in match.
+    The result is sorted by relevance. Pass the returned next_offset as offset to get the next page.
+    """
+    data = request_json()
+    match = data['match']
+    offset = data.get('offset', 0)
+
+    limit = get_limit(data, LATEST_DEFAULT_LIMIT, LATEST_MAX_LIMIT)
+    if limit is None or not isinstance(offset, int) or offset < 0:
+        return {'msg': 'Invalid limit or offset.'}, 400
+
+    # Get one extra recipe to know if there is a next page
+    recipes = interface.search_recipes(match, limit + 1, offset, user_id=get_jwt_identity())
+
+    next_offset = None
+    if len(recipes) > limit:
+        recipes = recipes[:limit]
+        next_offset = offset + limit
+
+    result = [_recipe_summary(recipe) for recipe in recipes]
+
+    return {'result': result, 'next_offset': next_offset}, 200
+
+
 @recipe_api.route('/images/<int:recipe_id>')
 def get_image(recipe_id):
     """
-    Returns the image for a recipe.
+    Returns the image for a recipe in the size given by the size parameter.
+    Supports conditional requests with the image key as ETag, and range requests.
     """
-    recipe = interface.get_recipe_by_id(recipe_id)
+    size = request.args.get('size', image_derivatives.FULL)
+
+    if not image_derivatives.is_valid_size(size):
+        return {'msg': 'Invalid image size.'}, 400
+
+    recipe_image_key = interface.get_recipe_image_key(recipe_id)
 
-    if not (recipe and recipe.image):
+    if not recipe_image_key:
         return '', 404
 
-    with urlopen(recipe.image) as response:
-        data = response.read()
+    key = image_derivatives.derivative_key(recipe_image_key, size)
+
+    if request.if_none_match.contains_weak(key):
+        # The client already has the image, so there is no need to load it.
+        response = current_app.response_class(status=304)
+    else:
+        if not image_derivatives.create(recipe_image_key, size):
+            return '', 404
+
+        path = interface.get_image_path(key)
+
+        if path:
+            # Send the file directly, without copying it into memory.
+            response = send_file(path, mimetype='image/jpeg', add_etags=False)
+            length = os.path.getsize(path)
+        else:
+            data = interface.get_image(key)
+            if data is None:
+                return '', 404
 
-    return send_file(BytesIO(data), attachment_filename=f'{recipe_id}.jpg')
+            response = send_file(BytesIO(data), mimetype='image/jpeg')
+            length = len(data)
 
+    response.set_etag(key)
+    response.headers.remove('Expires')
 
-def _recipe_img_url(recipe: Recipe) -> str:
+    # Versioned urls always point to the same image and can be cached forever.
+    if request.args.get('v') == _image_version(recipe_image_key):
+        response.headers['Cache-Control'] = f'public, max-age={IMAGE_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+
+    if response.status_code == 304:
+        return response
+
+    return response.make_conditional(request, accept_ranges=True, complete_length=length)
+
+
+def _recipe_data(recipe: Recipe) -> dict:
+    """
+    Returns the data of a recipe that is sent to the client.
+    """
+    data = _recipe_info(recipe)
+    data.update(img_url=_recipe_img_url(recipe), ingredients=recipe.ingredients, instructions=recipe.instructions)
+
+    return data
+
+
+def _recipe_payload(recipe: Recipe, ingredients: Optional[str], instructions: Optional[str]) -> bytes:
+    """
+    Returns the cached form of a recipe: a JSON object with the version, update time and image path
+    on the first line, then the JSON data of the recipe without its image url.
+    The image url depends on the host of a request, so _add_img_url adds it when the payload is sent.
+    """
+    header = {'version': recipe.version, 'updated_at': recipe.updated_at.isoformat(),
+              'img_path': _recipe_img_path(recipe)}
+
+    return dumps(header) + b'\n' + _recipe_json(dumps(_recipe_info(recipe)), ingredients, instructions)
+
+
+def _split_recipe_payload(payload: bytes) -> Tuple[dict, bytes]:
+    """
+    Returns the header and JSON data in a payload from _recipe_payload.
+    """
+    header, body = payload.split(b'\n', 1)
+
+    return loads(header), body
+
+
+def _add_img_url(header: dict, body: bytes) -> bytes:
+    """
+    Adds the image url for the host of the current request to the JSON data from a payload.
+    """
+    img_path = header['img_path']
+    img_url = request.url_root + img_path if img_path else ""
+
+    # The JSON data is an object, so the field can be added before its closing brace
+    return b''.join((body[:-1], b',"img_url":', dumps(img_url), b'}'))
+
+
+def _recipe_json(info: bytes, ingredients: Optional[str], instructions: Optional[str]) -> bytes:
+    """
+    Returns the data of a recipe as JSON, from the JSON of its _recipe_info with the ingredients
+    and instructions inserted as the JSON text they are stored as.
+    """
+    return b''.join((info[:-1],
+                     b',"ingredients":', (ingredients or 'null').encode(),
+                     b',"instructions":', (instructions or 'null').encode(),
+                     b'}'))
+
+
+def _recipe_info(recipe: Recipe) -> dict:
+    """
+    Returns the data of a recipe that is sent to the client, except the image url, ingredients and instructions.
+    """
+    return {'id': recipe.id,
+            'name': recipe.name,
+            'user': recipe.user.name,
+            'likes': recipe.like_count}
+
+
+def _recipe_summary(recipe: Recipe) -> dict:
+    """
+    Returns the data of a recipe that is shown in lists of recipes.
+    """
+    return {'id': recipe.id,
+            'name': recipe.name,
+            'user': recipe.user.name,
+            'img_url': _recipe_img_url(recipe, 'card')}
+
+
+def _recipe_img_url(recipe: Recipe, size: str = image_derivatives.FULL) -> str:
     # Return empty string if image does not exist
+    img_path = _recipe_img_path(recipe, size)
+
+    return request.url_root + img_path if img_path else ""
+
+
+def _recipe_img_path(recipe: Recipe, size: str = image_derivatives.FULL) -> str:
+    """
+    Returns the url of the image of a recipe relative to the url root, or an empty string if it has no image.
+    """
     if not recipe.image:
         return ""
 
-    return f"{request.url_root}recipes/images/{recipe.id}"
+    path = f"recipes/images/{recipe.id}?v={_image_version(recipe.image)}"
+
+    if size != image_derivatives.FULL:
+        path += f"&size={size}"
+
+    return path
+
+
+def _image_version(image_key: str) -> str:
+    """
+    Returns a short version string that changes whenever the image changes.
+    """
+    return image_key[:16]
+
+
+def _recipe_etag(recipe_id: int, version: int) -> str:
+    """
+    Returns the weak etag of a recipe version.
+    """
+    return f"recipe-{recipe_id}-{version}"
+
+
+def _is_conditional_request() -> bool:
+    """
+    Returns True if the current request has a precondition for a weak etag or a modification time.
+    """
+    return 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers
+
+
+def _not_modified(etag: str, last_modified: Optional[datetime] = None) -> Response:
+    """
+    Returns a 304 Not Modified response for a weak etag.
+    """
+    response = current_app.response_class(status=304)
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+
+    return response
+
+
+def _is_id_list(ids: Any) -> bool:
+    """
+    Returns True if ids is a list of ints.
+    """
+    return isinstance(ids, list) and all(isinstance(i, int) and not isinstance(i, bool) for i in ids)
+
+
+def _encode_cursor(recipe_id: int) -> str:
+    """
+    Returns an opaque cursor that points to the recipes after a given recipe.
+    """
+    return base64.urlsafe_b64encode(str(recipe_id).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Optional[int]:
+    """
+    Returns the recipe id in a cursor, or None if the cursor is invalid.
+    """
+    if not isinstance(cursor, str):
+        return None
+
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
 
 
 def _is_valid_img_uri(uri: str) -> bool:
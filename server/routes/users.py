@@ -1,23 +1,25 @@
 """
 API for handling users.
 """
-import json
-
-from flask import Blueprint, request
+from flask import Blueprint
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from server.database import interface
+from server.json_codec import get_limit, request_json
 from server.routes.auth import bcrypt
 
 user_api = Blueprint('user_api', __name__)
 
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+
 
 @user_api.route('/create', methods=['POST'])
 def create():
     """
     Creates a new user.
     """
-    data = json.loads(request.data)
+    data = request_json()
 
     user_name = data['user_name']
     email = data['email']
@@ -37,14 +39,18 @@ def create():
 def search():
     """
     Searches for users with their name. Excludes the logged in user.
+    Exact matches come first, then names that start with the search term, then other names that contain it.
     """
-    data = json.loads(request.data)
+    data = request_json()
 
     search_term = data['search_term']
-    this_user = interface.get_user_by_id(get_jwt_identity())
 
-    users = interface.search_users(search_term)
+    limit = get_limit(data, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT)
+    if limit is None:
+        return {'msg': 'Invalid limit.'}, 400
+
+    users = interface.search_users(search_term, limit, exclude_user_id=get_jwt_identity())
 
-    result = [user.get_public_data() for user in users if not user.id == this_user.id]
+    result = [user.get_public_data() for user in users]
 
     return {"result": result}, 200
@@ -0,0 +1,113 @@
+"""
+Friendship graph kept in memory, for questions about friends of friends.
+
+Every user has a sorted array with the ids of their friends. Arrays of ints take
+a fraction of the memory of lists or sets of ints, and are replaced instead of
+changed in place, so that readers never see an array that is being changed.
+"""
+import bisect
+import heapq
+from array import array
+from collections import Counter
+from typing import Collection, Dict, Iterable, List, Tuple
+
+EMPTY = array('i')
+
+
+class SocialGraph:
+    """
+    Undirected graph of friendships between users.
+    :param pairs: The friendships, as pairs of user ids. Each friendship only needs to be included once.
+    """
+
+    def __init__(self, pairs: Iterable[Tuple[int, int]] = ()):
+        friends: Dict[int, List[int]] = {}
+        for user1_id, user2_id in pairs:
+            friends.setdefault(user1_id, []).append(user2_id)
+            friends.setdefault(user2_id, []).append(user1_id)
+
+        self._friends: Dict[int, array] = {user_id: array('i', sorted(set(ids))) for user_id, ids in friends.items()}
+
+    def add(self, user1_id: int, user2_id: int) -> None:
+        """
+        Adds a friendship.
+        """
+        self._insert(user1_id, user2_id)
+        self._insert(user2_id, user1_id)
+
+    def remove(self, user1_id: int, user2_id: int) -> None:
+        """
+        Removes a friendship.
+        """
+        self._delete(user1_id, user2_id)
+        self._delete(user2_id, user1_id)
+
+    def friends(self, user_id: int) -> array:
+        """
+        Returns the ids of the friends of a user, sorted.
+        """
+        return self._friends.get(user_id, EMPTY)
+
+    def are_friends(self, user1_id: int, user2_id: int) -> bool:
+        return _contains(self.friends(user1_id), user2_id)
+
+    def mutual_friend_count(self, user1_id: int, user2_id: int) -> int:
+        """
+        Returns the number of friends that two users have in common.
+        """
+        friends1, friends2 = self.friends(user1_id), self.friends(user2_id)
+        if len(friends1) > len(friends2):
+            friends1, friends2 = friends2, friends1
+
+        return sum(1 for friend_id in friends1 if _contains(friends2, friend_id))
+
+    def suggestions(self, user_id: int, limit: int, exclude: Collection[int] = ()) -> List[Tuple[int, int]]:
+        """
+        Returns the friends of friends of a user that are not already friends with the user.
+        Users with the most mutual friends come first, ties are broken by the lowest id.
+        :param exclude: Ids of users that should not be suggested.
+        :return: List with (user id, number of mutual friends).
+        """
+        friends = self.friends(user_id)
+
+        counts = Counter()
+        for friend_id in friends:
+            counts.update(self.friends(friend_id))
+
+        candidates = ((-count, other_id) for other_id, count in counts.items()
+                      if other_id != user_id and other_id not in exclude and not _contains(friends, other_id))
+
+        return [(other_id, -count) for count, other_id in heapq.nsmallest(limit, candidates)]
+
+    def stats(self) -> Dict:
+        """
+        Returns the size of the graph.
+        """
+        return {
+            'users': len(self._friends),
+            'friendships': sum(len(ids) for ids in self._friends.values()) // 2,
+            'memory_bytes': sum(ids.itemsize * len(ids) for ids in self._friends.values()),
+        }
+
+    def _insert(self, user_id: int, friend_id: int) -> None:
+        ids = self.friends(user_id)
+        index = bisect.bisect_left(ids, friend_id)
+
+        if index == len(ids) or ids[index] != friend_id:
+            self._friends[user_id] = ids[:index] + array('i', [friend_id]) + ids[index:]
+
+    def _delete(self, user_id: int, friend_id: int) -> None:
+        ids = self.friends(user_id)
+        index = bisect.bisect_left(ids, friend_id)
+
+        if index < len(ids) and ids[index] == friend_id:
+            if len(ids) == 1:
+                del self._friends[user_id]
+            else:
+                self._friends[user_id] = ids[:index] + ids[index + 1:]
+
+
+def _contains(ids: array, user_id: int) -> bool:
+    index = bisect.bisect_left(ids, user_id)
+
+    return index < len(ids) and ids[index] == user_id
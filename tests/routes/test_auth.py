@@ -1,6 +1,13 @@
 import unittest
 
+from flask_jwt_extended import create_access_token, decode_token
+
+from server.database import interface
+from server.database.models import TokenBlocklist
+from server.main import app
+from tests.routes.test_helpers.query_counter import count_queries
 from tests.routes.test_helpers.route_test_case import RouteTestCase
+from tests.routes.test_helpers.users_helper import create_user, login_user
 
 
 class AuthTests(RouteTestCase):
@@ -40,12 +47,82 @@ class AuthTests(RouteTestCase):
         res = self.client.post('auth/logout', headers={'Authorization': f'Bearer {token}'})
         self.assertEqual(res.status_code, 200)
         self.assertEqual(res.json, {'msg': 'Access token revoked'})
+        self.assertIsNotNone(TokenBlocklist.query.one().expires_at)
 
         # Check not logged in
         res = self.client.post('auth/check', headers={'Authorization': f'Bearer {token}'})
         self.assertEqual(res.status_code, 401)
         self.assertEqual(res.json, {'msg': 'Token has been revoked'})
 
+    def test_stats(self):
+        name, email, pwd = 'user1', 'test@test.test', '1234'
+        self.client.post('users/create', json={'user_name': name, 'email': email, 'password': pwd})
+        token = self.client.post('auth/login', json={'email': email, 'password': pwd}).json['token']
+
+        res = self.client.post('auth/stats', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(res.status_code, 404)
+
+        app.config['STATS_KEY'] = 'key'
+        try:
+            res = self.client.post('auth/stats', headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(res.status_code, 403)
+
+            res = self.client.post('auth/stats', headers={'X-Stats-Key': 'key'})
+            self.assertEqual(res.status_code, 200)
+            self.assertIn('hits', res.json['cache'])
+            self.assertIn('false_positives', res.json['filter'])
+        finally:
+            app.config['STATS_KEY'] = None
+
+    def test_token_claims(self):
+        user = create_user(self, 'user1')
+        token = login_user(self, 'user1')
+
+        claims = decode_token(token)
+        self.assertEqual(claims['sub'], user.id)
+        self.assertEqual(claims['name'], 'user1')
+        self.assertNotIn('email', claims)
+
+    def test_current_user_from_token(self):
+        user = create_user(self, 'user1')
+        token = login_user(self, 'user1')
+        recipe = self.data.create_recipe(user, "recipe", [], [], None)
+
+        interface._revoked_tokens.clear()
+        with count_queries() as statements:
+            res = self.client.post('recipes/like', json={'id': recipe.id},
+                                   headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse([statement for statement in statements if 'FROM users' in statement])
+        self.assertTrue(self.data.is_liked(user.id, recipe.id))
+
+    def test_current_user_per_request(self):
+        user1 = create_user(self, 'user1')
+        user2 = create_user(self, 'user2')
+        recipe = self.data.create_recipe(user1, "recipe", [], [], None)
+
+        for name in ['user1', 'user2']:
+            token = login_user(self, name)
+            self.client.post('recipes/like', json={'id': recipe.id}, headers={'Authorization': f'Bearer {token}'})
+
+        self.assertTrue(self.data.is_liked(user1.id, recipe.id))
+        self.assertTrue(self.data.is_liked(user2.id, recipe.id))
+
+    def test_current_user_without_name_claim(self):
+        user = create_user(self, 'user1')
+        recipe = self.data.create_recipe(user, "recipe", [], [], None)
+        # Tokens created before the name was added to them
+        token = create_access_token(identity=user.id)
+        headers = {'Authorization': f'Bearer {token}'}
+
+        with count_queries() as statements:
+            self.client.post('recipes/like', json={'id': recipe.id}, headers=headers)
+            self.client.post('recipes/unlike', json={'id': recipe.id}, headers=headers)
+
+        self.assertEqual(len([statement for statement in statements if 'FROM users' in statement]), 1)
+        self.assertFalse(self.data.is_liked(user.id, recipe.id))
+
     def test_check(self):
         res = self.client.post('auth/check')
         self.assertEqual(res.status_code, 401)
@@ -1,5 +1,8 @@
 import unittest
 
+from server.database import interface
+from server.main import app
+from tests.routes.test_helpers.query_counter import count_queries
 from tests.routes.test_helpers.route_test_case import RouteTestCase
 from tests.routes.test_helpers.users_helper import create_user, login_user
 
@@ -23,7 +26,7 @@ class FriendsTests(RouteTestCase):
         })
 
         self.data.create_friend_request(user1, user2)
-        self.data.accept_friend_request(user1, user2)
+        self.data.accept_friend_request(user2, user1)
         self.data.create_friend_request(user1, user3)
         self.data.create_friend_request(user4, user1)
 
@@ -37,6 +40,79 @@ class FriendsTests(RouteTestCase):
             "incoming_requests": [user4.get_public_data()]
         })
 
+    def test_list_friends_query_count(self):
+        user = create_user(self, 'user')
+        token = login_user(self, 'user')
+
+        for i in range(30):
+            other = self.data.create_user(f"user{i}", f"user{i}@example.com", "pw")
+            if i % 3 == 0:
+                self.data.create_friend_request(user, other)
+                self.data.accept_friend_request(other, user)
+            elif i % 3 == 1:
+                self.data.create_friend_request(user, other)
+            else:
+                self.data.create_friend_request(other, user)
+
+        interface._revoked_tokens.clear()
+        with count_queries() as statements:
+            res = self.client.post('friends/list-friends', headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([len(res.json[kind]) for kind in ["friends", "outgoing_requests", "incoming_requests"]],
+                         [10, 10, 10])
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn('pw_hash', statements[0])
+
+    def test_suggestions(self):
+        user1 = create_user(self, 'user1')
+        user2 = create_user(self, 'user2')
+        user3 = create_user(self, 'user3')
+        user4 = create_user(self, 'user4')
+        for a, b in [(user1, user2), (user1, user3), (user2, user4), (user3, user4)]:
+            self.data.create_friend_request(a, b)
+            self.data.accept_friend_request(b, a)
+        token = login_user(self, 'user1')
+
+        res = self.client.post('friends/suggestions', json={},
+                               headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json, {'result': [dict(user4.get_public_data(), mutual_friends=2)]})
+
+        res = self.client.post('friends/suggestions', json={'limit': 0},
+                               headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client.post('friends/suggestions', json={'limit': True},
+                               headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_stats(self):
+        user1 = create_user(self, 'user1')
+        user2 = create_user(self, 'user2')
+        self.data.create_friend_request(user1, user2)
+        self.data.accept_friend_request(user2, user1)
+        token = login_user(self, 'user1')
+
+        res = self.client.post('friends/stats', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(res.status_code, 404)
+
+        app.config['STATS_KEY'] = 'key'
+        try:
+            res = self.client.post('friends/stats', headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(res.status_code, 403)
+
+            self.client.post('friends/suggestions', json={}, headers={'Authorization': f'Bearer {token}'})
+            res = self.client.post('friends/stats', headers={'X-Stats-Key': 'key'})
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json['friendships'], 1)
+            self.assertIn('loads', res.json)
+        finally:
+            app.config['STATS_KEY'] = None
+
     def test_create_friend_request(self):
         user1 = create_user(self, 'user1')
         user2 = create_user(self, 'user2')
@@ -52,6 +128,19 @@ class FriendsTests(RouteTestCase):
         self.assertEqual(user2.outgoing_friend_requests, [])
         self.assertEqual(user2.incoming_friend_requests, [user1])
 
+    def test_create_friend_request_self(self):
+        user = create_user(self, 'user')
+        token = login_user(self, 'user')
+
+        for route in ['create-friend-request', 'cancel-friend-request', 'accept-friend-request', 'remove-friend']:
+            res = self.client.post(f'friends/{route}', json={'id': user.id},
+                                   headers={'Authorization': f'Bearer {token}'})
+
+            self.assertEqual(res.status_code, 400)
+
+        self.assertEqual(user.outgoing_friend_requests, [])
+        self.assertEqual(user.friends, [])
+
     def test_cancel_friend_request(self):
         user1 = create_user(self, 'user1')
         user2 = create_user(self, 'user2')
@@ -72,12 +161,21 @@ class FriendsTests(RouteTestCase):
         user1 = create_user(self, 'user1')
         user2 = create_user(self, 'user2')
         self.data.create_friend_request(user1, user2)
-        token = login_user(self, 'user1')
 
+        # The sender can't accept their own request
+        token = login_user(self, 'user1')
         res = self.client.post('friends/accept-friend-request',
                                json={'id': user2.id},
                                headers={'Authorization': f'Bearer {token}'})
 
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(user1.friends, [])
+
+        token = login_user(self, 'user2')
+        res = self.client.post('friends/accept-friend-request',
+                               json={'id': user1.id},
+                               headers={'Authorization': f'Bearer {token}'})
+
         self.assertEqual(res.status_code, 200)
         self.assertEqual(user1.friends, [user2])
         self.assertEqual(user2.friends, [user1])
@@ -86,7 +184,7 @@ class FriendsTests(RouteTestCase):
         user1 = create_user(self, 'user1')
         user2 = create_user(self, 'user2')
         self.data.create_friend_request(user1, user2)
-        self.data.accept_friend_request(user1, user2)
+        self.data.accept_friend_request(user2, user1)
         token = login_user(self, 'user1')
 
         res = self.client.post('friends/remove-friend',
@@ -98,5 +196,45 @@ class FriendsTests(RouteTestCase):
         self.assertEqual(user2.friends, [])
 
 
+    def test_bulk_friend_requests(self):
+        user1 = create_user(self, 'user1')
+        user2 = create_user(self, 'user2')
+        user3 = create_user(self, 'user3')
+        user4 = create_user(self, 'user4')
+        self.data.create_friend_request(user2, user1)
+        self.data.create_friend_request(user3, user1)
+        self.data.create_friend_request(user1, user4)
+        token = login_user(self, 'user1')
+
+        res = self.client.post('friends/accept-friend-requests',
+                               json={'ids': [user2.id, user4.id]},
+                               headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json, {'result': [user2.id]})
+
+        res = self.client.post('friends/decline-friend-requests',
+                               json={'ids': [user3.id]},
+                               headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json, {'result': [user3.id]})
+
+        res = self.client.post('friends/cancel-friend-requests',
+                               json={'ids': [user4.id]},
+                               headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json, {'result': [user4.id]})
+        self.assertEqual(user1.friends, [user2])
+        self.assertEqual(user1.incoming_friend_requests, [])
+        self.assertEqual(user1.outgoing_friend_requests, [])
+
+        res = self.client.post('friends/accept-friend-requests',
+                               json={'ids': [str(user2.id)]},
+                               headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(res.status_code, 400)
+
 if __name__ == '__main__':
     unittest.main()
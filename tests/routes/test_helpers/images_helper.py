@@ -0,0 +1,14 @@
+from io import BytesIO
+
+from PIL import Image
+
+
+def create_jpeg(width: int, height: int) -> bytes:
+    output = BytesIO()
+    Image.new('RGB', (width, height), (200, 100, 50)).save(output, 'JPEG')
+    return output.getvalue()
+
+
+def image_size(data: bytes):
+    with Image.open(BytesIO(data)) as image:
+        return image.size
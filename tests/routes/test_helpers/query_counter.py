@@ -0,0 +1,27 @@
+"""
+Helper for counting database queries.
+"""
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from server.database.handler import db
+
+
+@contextmanager
+def count_queries():
+    """
+    Counts the queries that are executed inside the with block.
+    The yielded list gets one statement for each query.
+    """
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
@@ -1,4 +1,4 @@
-import json
+import base64
 from tests.routes.test_helpers.route_test_case import RouteTestCase
 from server.database.models import Recipe, User
 
@@ -10,15 +10,20 @@ def create_recipe_ingredients():
         "quantity": 4
     }] * 100
 
-    return json.dumps(ingredients)
+    return ingredients
 
 
 def create_recipe_instructions():
     instructions = ["instruction"] * 100
 
-    return json.dumps(instructions)
+    return instructions
 
 
 def create_recipe_image():
     # Data URI to a 2x2 pixels jpg image
     return "data:image/jpeg;base64,/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDAP//////////////////////////////////////////////////////////////////////////////////////2wBDAf//////////////////////////////////////////////////////////////////////////////////////wAARCAACAAIDASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYkNOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwAoooplH//Z"
+
+
+def create_recipe_image_data():
+    # Raw data of the image from create_recipe_image
+    return base64.b64decode(create_recipe_image().split(',')[1])
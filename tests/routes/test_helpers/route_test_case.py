@@ -1,5 +1,6 @@
 import unittest
 
+from server import compression, image_derivatives
 from server.database import handler
 from server.main import app
 from server.database.handler import db
@@ -11,7 +12,12 @@ class RouteTestCase(unittest.TestCase):
 
     def setUp(self):
         app.config['TESTING'] = True
+        image_derivatives.WORKERS = 0  # Create image derivatives in the request thread
         app.app_context().push()
         handler.init_db(app)
         self.client = app.test_client()
         db.session.close()
+        compression._compressed_bodies.clear()
+        interface._recipe_payloads.clear()
+        interface._friend_graph.clear()
+        interface._identities.clear()
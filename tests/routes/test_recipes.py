@@ -1,7 +1,19 @@
+import base64
 from datetime import date
+import gzip
 import json
+import tempfile
 import unittest
-from tests.routes.test_helpers.recipes_helper import create_recipe_image, create_recipe_ingredients, create_recipe_instructions
+
+from server import compression
+from server.database import image_store, interface
+from server.database.handler import db
+from server.main import app
+from tests.routes.test_helpers.query_counter import count_queries
+from server.database.image_store import FileSystemImageStore
+from tests.routes.test_helpers.images_helper import create_jpeg, image_size
+from tests.routes.test_helpers.recipes_helper import create_recipe_image, create_recipe_image_data, \
+    create_recipe_ingredients, create_recipe_instructions
 
 from tests.routes.test_helpers.route_test_case import RouteTestCase
 from tests.routes.test_helpers.users_helper import create_and_login_user, create_user, login_user
@@ -24,7 +36,7 @@ class RecipesTests(RouteTestCase):
         self.assertEqual(res.status_code, 200)
         recipe = self.data.search_recipes('the')[0]
         self.assertEqual(recipe.name, name)
-        self.assertEqual(recipe.image, image)
+        self.assertEqual(self.data.get_image(recipe.image), create_recipe_image_data())
 
     def test_change(self):
         user = create_user(self, "user")
@@ -33,7 +45,7 @@ class RecipesTests(RouteTestCase):
         old_name = "old name"
         old_ingredients = "old"
         old_instructions = "old instructions"
-        old_image = create_recipe_image()
+        old_image = create_recipe_image_data()
         old_recipe = self.data.create_recipe(
             user, old_name, old_ingredients, old_instructions, old_image)
 
@@ -50,14 +62,14 @@ class RecipesTests(RouteTestCase):
         self.assertEqual(res.status_code, 200)
         new_recipe = self.data.get_recipe_by_id(old_recipe.id)
         self.assertEqual(new_recipe.name, new_name)
-        self.assertEqual(new_recipe.ingredients, json.dumps(new_ingredients))
-        self.assertEqual(new_recipe.instructions, json.dumps(new_instructions))
-        self.assertEqual(new_recipe.image, new_image)
+        self.assertEqual(new_recipe.ingredients, new_ingredients)
+        self.assertEqual(new_recipe.instructions, new_instructions)
+        self.assertEqual(self.data.get_image(new_recipe.image), create_recipe_image_data() + b"\xb5\xeb-")
 
     def test_delete(self):
         user = create_user(self, "user")
         token = login_user(self, "user")
-        recipe = self.data.create_recipe(user, "", "", "", "")
+        recipe = self.data.create_recipe(user, "", "", "", None)
 
         res = self.client.post('recipes/delete',
                                json={'id': recipe.id},
@@ -67,6 +79,26 @@ class RecipesTests(RouteTestCase):
         user = self.data.get_user_by_id(user.id)
         self.assertEqual(user.recipes, [])
 
+    def test_change_and_delete_other_users_recipe(self):
+        user1 = create_user(self, "user1")
+        create_user(self, "user2")
+        token = login_user(self, "user2")
+        recipe = self.data.create_recipe(user1, "recipe", [], [], None)
+        headers = {'Authorization': f'Bearer {token}'}
+
+        res = self.client.post('recipes/change',
+                               json={'id': recipe.id, 'name': "new name", 'ingredients': [], 'instructions': [],
+                                     'image': None},
+                               headers=headers)
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client.post('recipes/delete', json={'id': recipe.id}, headers=headers)
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client.post('recipes/delete', json={'id': recipe.id + 1}, headers=headers)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(self.data.get_recipe_by_id(recipe.id).name, "recipe")
+
     def test_get(self):
         user = create_user(self, "user")
         token = login_user(self, "user")
@@ -74,7 +106,7 @@ class RecipesTests(RouteTestCase):
         name = "recipe name"
         ingredients = create_recipe_ingredients()
         instructions = create_recipe_instructions()
-        image = create_recipe_image()
+        image = create_recipe_image_data()
 
         self.data.create_recipe(user, name, ingredients, instructions, image)
 
@@ -82,18 +114,468 @@ class RecipesTests(RouteTestCase):
                                headers={'Authorization': f'Bearer {token}'})
 
         self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json['name'], name)
+        self.assertEqual(res.json['ingredients'], ingredients)
+        self.assertEqual(res.json['instructions'], instructions)
+        self.assertEqual(res.json['likes'], 0)
+
+        res = self.client.post('recipes/get', json={"id": 2},
+                               headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_get_cached(self):
+        user = create_user(self, "user")
+        token = login_user(self, "user")
+        recipe = self.data.create_recipe(user, "recipe", ["ingredient"], ["instruction"], create_recipe_image_data())
+        headers = {'Authorization': f'Bearer {token}'}
+
+        hits = interface._recipe_payloads.hits
+        expected = self.client.post('recipes/get', json={"id": recipe.id}, headers=headers).json
+
+        interface._revoked_tokens.clear()
+        with count_queries() as statements:
+            res = self.client.post('recipes/get', json={"id": recipe.id}, headers=headers)
+        self.assertEqual(res.json, expected)
+        self.assertFalse(any('recipes' in statement for statement in statements))
+
+        # The cached payload does not depend on the host
+        res = self.client.post('recipes/get', json={"id": recipe.id}, headers=headers,
+                               base_url='http://other.example.com')
+        self.assertTrue(res.json['img_url'].startswith('http://other.example.com/recipes/images/'))
+        res = self.client.post('recipes/get', json={"id": recipe.id}, headers=headers)
+        self.assertEqual(res.json, expected)
+
+        res = self.client.post('recipes/stats', headers=headers)
+        self.assertEqual(res.status_code, 404)
+
+        app.config['STATS_KEY'] = 'key'
+        try:
+            res = self.client.post('recipes/stats', headers=headers)
+            self.assertEqual(res.status_code, 403)
+
+            res = self.client.post('recipes/stats', headers={'X-Stats-Key': 'key'})
+            self.assertEqual(res.json['hits'], hits + 3)
+            self.assertEqual(res.json['size'], 1)
+        finally:
+            app.config['STATS_KEY'] = None
+
+    def test_get_cached_img_url(self):
+        user = create_user(self, "user")
+        token = login_user(self, "user")
+        name = 'recipe "img_url":"'
+        recipe = self.data.create_recipe(user, name, ["ingredient"], ["instruction"], create_recipe_image_data())
+        headers = {'Authorization': f'Bearer {token}'}
+
+        for base_url in ['http://one.example.com', 'http://two.example.com']:
+            res = self.client.post('recipes/get', json={"id": recipe.id}, headers=headers, base_url=base_url)
+            self.assertEqual(res.json['name'], name)
+            self.assertEqual(res.json['img_url'], f'{base_url}/recipes/images/{recipe.id}?v={recipe.image[:16]}')
+            self.assertEqual(res.json['ingredients'], ["ingredient"])
+
+    def test_get_compressed(self):
+        user = create_user(self, "user")
+        token = login_user(self, "user")
+        recipe = self.data.create_recipe(user, "recipe", create_recipe_ingredients(), create_recipe_instructions(),
+                                         None)
+        headers = {'Authorization': f'Bearer {token}', 'Accept-Encoding': 'gzip'}
+
+        res = self.client.post('recipes/get', json={"id": recipe.id}, headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(res.data))['ingredients'], create_recipe_ingredients())
+
+        self.assertEqual(len(compression._compressed_bodies), 1)
+        hits = compression._compressed_bodies.hits
+        res = self.client.post('recipes/get', json={"id": recipe.id}, headers=headers)
+        self.assertEqual(compression._compressed_bodies.hits, hits + 1)
+        self.assertEqual(json.loads(gzip.decompress(res.data))['likes'], 0)
+
+        # A like changes the response, so it must not be served from the cache
+        self.client.post('recipes/like', json={'id': recipe.id}, headers=headers)
+        res = self.client.post('recipes/get', json={"id": recipe.id}, headers=headers)
+        self.assertEqual(json.loads(gzip.decompress(res.data))['likes'], 1)
+
+        res = self.client.post('recipes/get', json={"id": recipe.id},
+                               headers={'Authorization': f'Bearer {token}'})
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertEqual(res.json['likes'], 1)
+
+    def test_get_compressed_reused_id(self):
+        user = create_user(self, "user")
+        token = login_user(self, "user")
+        headers = {'Authorization': f'Bearer {token}', 'Accept-Encoding': 'gzip'}
+        recipe = self.data.create_recipe(user, "old", create_recipe_ingredients(), create_recipe_instructions(), None)
+        recipe_id = recipe.id
+
+        res = self.client.post('recipes/get', json={"id": recipe_id}, headers=headers)
+        self.assertEqual(json.loads(gzip.decompress(res.data))['name'], "old")
+
+        # SQLite reuses the id of the last recipe when it is deleted
+        self.data.delete_recipe(recipe)
+        recipe = self.data.create_recipe(user, "new", create_recipe_ingredients(), create_recipe_instructions(), None)
+        self.assertEqual(recipe.id, recipe_id)
+
+        res = self.client.post('recipes/get', json={"id": recipe_id}, headers=headers)
+        self.assertEqual(json.loads(gzip.decompress(res.data))['name'], "new")
+
+    def test_get_conditional(self):
+        user = create_user(self, "user")
+        token = login_user(self, "user")
+        recipe = self.data.create_recipe(user, "recipe", ["ingredient"], ["instruction"], None)
+        headers = {'Authorization': f'Bearer {token}'}
+
+        res = self.client.post('recipes/get', json={"id": recipe.id}, headers=headers)
+        etag, last_modified = res.headers['ETag'], res.headers['Last-Modified']
+
+        with count_queries() as statements:
+            res = self.client.post('recipes/get', json={"id": recipe.id},
+                                   headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+        self.assertFalse(any('ingredients' in statement for statement in statements))
+
+        res = self.client.post('recipes/get', json={"id": recipe.id},
+                               headers=dict(headers, **{'If-Modified-Since': last_modified}))
+        self.assertEqual(res.status_code, 304)
+
+        # A recipe that is not cached is revalidated without loading it
+        interface._recipe_payloads.clear()
+        with count_queries() as statements:
+            res = self.client.post('recipes/get', json={"id": recipe.id},
+                                   headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(res.status_code, 304)
+        self.assertFalse(any('ingredients' in statement for statement in statements))
+        self.assertIsNone(interface.get_cached_recipe_payload(recipe.id))
+
+        self.client.post('recipes/like', json={'id': recipe.id}, headers=headers)
+
+        res = self.client.post('recipes/get', json={"id": recipe.id},
+                               headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertEqual(res.json['likes'], 1)
+
+    def test_like(self):
+        user = create_user(self, "user")
+        token = login_user(self, "user")
+        recipe = self.data.create_recipe(user, "recipe", "", "", None)
+        headers = {'Authorization': f'Bearer {token}'}
+
+        res = self.client.post('recipes/is_liked', json={'id': recipe.id}, headers=headers)
+        self.assertEqual(res.json, {'liked': False})
+
+        for _ in range(2):
+            res = self.client.post('recipes/like', json={'id': recipe.id}, headers=headers)
+            self.assertEqual(res.status_code, 200)
+
+        res = self.client.post('recipes/is_liked', json={'id': recipe.id}, headers=headers)
+        self.assertEqual(res.json, {'liked': True})
+        self.assertEqual(self.data.get_recipe_by_id(recipe.id).like_count, 1)
+
+        res = self.client.post('recipes/unlike', json={'id': recipe.id}, headers=headers)
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client.post('recipes/is_liked', json={'id': recipe.id}, headers=headers)
+        self.assertEqual(res.json, {'liked': False})
+
+        res = self.client.post('recipes/is_liked', json={'id': 999}, headers=headers)
+        self.assertEqual(res.status_code, 400)
+
+    def test_batch(self):
+        user = create_user(self, "user")
+        token = login_user(self, "user")
+        headers = {'Authorization': f'Bearer {token}'}
+        recipes = [self.data.create_recipe(user, f"recipe{i}", [], [], None) for i in range(3)]
+        self.data.like_recipe(user, recipes[1])
+        ids = [recipe.id for recipe in recipes] + [999]
+
+        res = self.client.post('recipes/is_liked_batch', json={'ids': ids}, headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json, {'liked': {str(recipes[0].id): False, str(recipes[1].id): True,
+                                              str(recipes[2].id): False, '999': False}})
+
+        res = self.client.post('recipes/get_batch', json={'ids': ids}, headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(res.json['result'].keys()), sorted(str(recipe.id) for recipe in recipes))
+        self.assertEqual(res.json['result'][str(recipes[1].id)]['likes'], 1)
+        self.assertEqual(res.json['result'][str(recipes[1].id)]['user'], 'user')
+
+        # Recipes by users that are not friends are left out
+        stranger = create_user(self, "stranger")
+        stranger_recipe = self.data.create_recipe(stranger, "secret", ["ingredient"], [], None)
+        res = self.client.post('recipes/get_batch', json={'ids': [recipes[0].id, stranger_recipe.id]},
+                               headers=headers)
+        self.assertEqual(list(res.json['result'].keys()), [str(recipes[0].id)])
+
+        res = self.client.post('recipes/get_batch', json={'ids': list(range(101))}, headers=headers)
+        self.assertEqual(res.status_code, 400)
+
+        for data in ({}, {'ids': 5}, {'ids': "1,2"}, {'ids': [1, "2"]}, {'ids': [True]}):
+            for endpoint in ('recipes/get_batch', 'recipes/is_liked_batch'):
+                res = self.client.post(endpoint, json=data, headers=headers)
+                self.assertEqual(res.status_code, 400)
+
+    def test_latest(self):
+        user1 = create_user(self, "user1")
+        user2 = create_user(self, "user2")
+        user3 = create_user(self, "user3")
+        self.data.create_friend_request(user1, user2)
+        self.data.accept_friend_request(user2, user1)
+        token = login_user(self, "user1")
+
+        recipes = [self.data.create_recipe(user, f"recipe{i}", "", "", None)
+                   for i, user in enumerate([user1, user2, user3, user1, user2])]
+        expected = [recipes[4].id, recipes[3].id, recipes[1].id, recipes[0].id]
+
+        res = self.client.post('recipes/latest', json={},
+                               headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([recipe['id'] for recipe in res.json['result']], expected)
+        self.assertIsNone(res.json['next_cursor'])
+
+        ids, cursor = [], None
+        while True:
+            res = self.client.post('recipes/latest', json={'limit': 3, 'cursor': cursor},
+                                   headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(res.status_code, 200)
+            ids += [recipe['id'] for recipe in res.json['result']]
+            cursor = res.json['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(ids, expected)
+
+        for data in ({'cursor': 'invalid'}, {'cursor': 5}, {'cursor': ['a']}, {'limit': True}):
+            res = self.client.post('recipes/latest', json=data,
+                                   headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(res.status_code, 400)
+
+    def test_latest_conditional(self):
+        user1 = create_user(self, "user1")
+        user2 = create_user(self, "user2")
+        self.data.create_friend_request(user1, user2)
+        self.data.accept_friend_request(user2, user1)
+        token = login_user(self, "user1")
+        headers = {'Authorization': f'Bearer {token}'}
+        recipe = self.data.create_recipe(user2, "recipe", [], [], None)
+
+        res = self.client.post('recipes/latest', json={}, headers=headers)
+        etag = res.headers['ETag']
+
+        res = self.client.post('recipes/latest', json={}, headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(res.status_code, 304)
+
+        res = self.client.post('recipes/latest', json={'match': 'other'},
+                               headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(res.status_code, 200)
+
+        # Changed, new and deleted recipes change the etag
+        for change in [lambda: self.data.change_recipe(recipe.id, "new name", None, None, None),
+                       lambda: self.data.create_recipe(user2, "recipe2", [], [], None),
+                       lambda: self.data.delete_recipe(self.data.get_recipe_by_id(recipe.id))]:
+            change()
+            res = self.client.post('recipes/latest', json={}, headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(res.status_code, 200)
+            self.assertNotEqual(res.headers['ETag'], etag)
+            etag = res.headers['ETag']
+
+    def test_latest_query_count(self):
+        user = create_user(self, "user")
+        token = login_user(self, "user")
+
+        def count_latest_queries():
+            db.session.expire_all()
+            with count_queries() as statements:
+                res = self.client.post('recipes/latest', json={},
+                                       headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(res.status_code, 200)
+            return len(statements), len(res.json['result'])
+
+        for i in range(10):
+            friend = self.data.create_user(f"friend{i}", f"friend{i}@example.com", "pw")
+            self.data.create_friend_request(user, friend)
+            self.data.accept_friend_request(friend, user)
+            self.data.create_recipe(friend, f"recipe{i}", "", "", None)
+
+        interface._revoked_tokens.clear()
+        few_queries, few_recipes = count_latest_queries()
+
+        for i in range(10, 30):
+            friend = self.data.create_user(f"friend{i}", f"friend{i}@example.com", "pw")
+            self.data.create_friend_request(user, friend)
+            self.data.accept_friend_request(friend, user)
+            self.data.create_recipe(friend, f"recipe{i}", "", "", None)
+            self.data.create_recipe(friend, f"recipe{i}", "", "", None)
+
+        interface._revoked_tokens.clear()
+        many_queries, many_recipes = count_latest_queries()
+
+        self.assertEqual((few_recipes, many_recipes), (10, 20))
+        self.assertEqual(few_queries, many_queries)
+        self.assertLessEqual(many_queries, 2)  # Feed versions and recipes
+
+    def test_cook(self):
+        user1 = create_user(self, "user1")
+        user2 = create_user(self, "user2")
+        self.data.create_friend_request(user1, user2)
+        self.data.accept_friend_request(user2, user1)
+        token = login_user(self, "user1")
+
+        self.client.post('recipes/create',
+                         json={'name': 'Pancakes', 'ingredients': [{'name': 'flour', 'unit': 'dl', 'quantity': 2},
+                                                                   {'name': 'milk', 'unit': 'dl', 'quantity': 4}],
+                               'instructions': [], 'image': ''},
+                         headers={'Authorization': f'Bearer {token}'})
+        self.data.create_recipe(user2, "Omelette", [{"name": "eggs"}, {"name": "milk"}], "", None)
+
+        res = self.client.post('recipes/cook', json={'pantry': ['Milk', 'Flour']},
+                               headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([(recipe['name'], recipe['matched'], recipe['total']) for recipe in res.json['result']],
+                         [("Pancakes", 2, 2), ("Omelette", 1, 2)])
+
+        res = self.client.post('recipes/cook', json={'pantry': 'milk'},
+                               headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(res.status_code, 400)
+
+    def test_search(self):
+        user1 = create_user(self, "user1")
+        user2 = create_user(self, "user2")
+        user3 = create_user(self, "user3")
+        self.data.create_friend_request(user1, user2)
+        self.data.accept_friend_request(user2, user1)
+        token = login_user(self, "user1")
+
+        self.data.create_recipe(user1, "Tomato soup", ["tomatoes"], ["Boil"], None)
+        self.data.create_recipe(user2, "Pancakes", ["eggs", "milk"], ["Fry"], None)
+        self.data.create_recipe(user2, "Tomato pasta", ["pasta", "tomatoes"], ["Boil"], None)
+        self.data.create_recipe(user3, "Tomato salad", ["tomatoes"], [], None)
+
+        res = self.client.post('recipes/search', json={'match': 'tomato'},
+                               headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(recipe['name'] for recipe in res.json['result']), ["Tomato pasta", "Tomato soup"])
+        self.assertIsNone(res.json['next_offset'])
+
+        names, offset = [], 0
+        while offset is not None:
+            res = self.client.post('recipes/search', json={'match': 'tomato', 'limit': 1, 'offset': offset},
+                                   headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(res.status_code, 200)
+            names += [recipe['name'] for recipe in res.json['result']]
+            offset = res.json['next_offset']
+        self.assertEqual(sorted(names), ["Tomato pasta", "Tomato soup"])
+
+        res = self.client.post('recipes/search', json={'match': 'MILK'},
+                               headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual([recipe['name'] for recipe in res.json['result']], ["Pancakes"])
+
+        res = self.client.post('recipes/search', json={'match': 'tomato', 'offset': -1},
+                               headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(res.status_code, 400)
 
     def test_get_image(self):
         user = create_user(self, "user")
         token = login_user(self, "user")
 
         recipe = self.data.create_recipe(
-            user, "", "", "", create_recipe_image())
+            user, "", "", "", create_recipe_image_data())
 
         res = self.client.get(f'recipes/images/{recipe.id}',
                               headers={'Authorization': f'Bearer {token}'})
 
         self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, create_recipe_image_data())
+        self.assertEqual(res.headers['ETag'], f'"{recipe.image}"')
+        self.assertEqual(res.headers['Cache-Control'], 'no-cache')
+
+    def test_get_image_cached(self):
+        user = create_user(self, "user")
+        recipe = self.data.create_recipe(user, "", "", "", create_recipe_image_data())
+
+        res = self.client.get(f'recipes/images/{recipe.id}', query_string={'v': recipe.image[:16]})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('immutable', res.headers['Cache-Control'])
+
+        res = self.client.get(f'recipes/images/{recipe.id}', headers={'If-None-Match': f'"{recipe.image}"'})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(res.headers['ETag'], f'"{recipe.image}"')
+
+        res = self.client.get(f'recipes/images/{recipe.id}', headers={'If-None-Match': '"other"'})
+        self.assertEqual(res.status_code, 200)
+
+    def test_get_image_range(self):
+        user = create_user(self, "user")
+        image = create_recipe_image_data()
+        recipe = self.data.create_recipe(user, "", "", "", image)
+
+        res = self.client.get(f'recipes/images/{recipe.id}', headers={'Range': 'bytes=10-19'})
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res.data, image[10:20])
+        self.assertEqual(res.headers['Content-Range'], f'bytes 10-19/{len(image)}')
+
+    def test_get_image_size(self):
+        user = create_user(self, "user")
+        recipe = self.data.create_recipe(user, "", "", "", create_jpeg(1000, 500))
+
+        res = self.client.get(f'recipes/images/{recipe.id}', query_string={'size': 'thumb'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(image_size(res.data), (160, 80))
+        self.assertEqual(res.headers['ETag'], f'"{recipe.image}_thumb"')
+
+        res = self.client.get(f'recipes/images/{recipe.id}', query_string={'size': 'huge'})
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_image_from_file(self):
+        old_store = image_store.store
+        with tempfile.TemporaryDirectory() as directory:
+            image_store.store = FileSystemImageStore(directory)
+            try:
+                user = create_user(self, "user")
+                image = create_recipe_image_data()
+                recipe = self.data.create_recipe(user, "", "", "", image)
+
+                res = self.client.get(f'recipes/images/{recipe.id}')
+                self.assertEqual(res.status_code, 200)
+                self.assertEqual(res.data, image)
+                res.close()
+
+                res = self.client.get(f'recipes/images/{recipe.id}', headers={'Range': 'bytes=-5'})
+                self.assertEqual(res.status_code, 206)
+                self.assertEqual(res.data, image[-5:])
+                res.close()
+            finally:
+                image_store.store = old_store
+
+    def test_invalid_image(self):
+        token = create_and_login_user(self, "user")
+
+        res = self.client.post('recipes/create',
+                               json={'name': 'name', 'ingredients': [], 'instructions': [],
+                                     'image': 'data:image/jpeg;base64,not valid base64'},
+                               headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(res.status_code, 415)
+        self.assertEqual(self.data.search_recipes(''), [])
+
+        not_jpeg = 'data:image/jpeg;base64,' + base64.b64encode(b'not a jpeg image').decode()
+        res = self.client.post('recipes/create',
+                               json={'name': 'name', 'ingredients': [], 'instructions': [], 'image': not_jpeg},
+                               headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(res.status_code, 415)
+        self.assertEqual(self.data.search_recipes(''), [])
+
+    def test_get_image_size_invalid_image(self):
+        user = create_user(self, "user")
+        # Stored before uploads were checked
+        recipe = self.data.create_recipe(user, "", "", "", b'not a jpeg image')
+
+        res = self.client.get(f'recipes/images/{recipe.id}', query_string={'size': 'card'})
+        self.assertEqual(res.status_code, 404)
 
 
 if __name__ == '__main__':
@@ -40,6 +40,28 @@ class UsersTests(RouteTestCase):
             user4.get_public_data()
         ]})
 
+        res = self.client.post(
+            "users/search", json={"search_term": "user", "limit": 2}, headers={"Authorization": f"Bearer {token}"}
+        )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json, {"result": [
+            user2.get_public_data(),
+            user3.get_public_data()
+        ]})
+
+        res = self.client.post(
+            "users/search", json={"search_term": "user", "limit": 0}, headers={"Authorization": f"Bearer {token}"}
+        )
+
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client.post(
+            "users/search", json={"search_term": "user", "limit": True}, headers={"Authorization": f"Bearer {token}"}
+        )
+
+        self.assertEqual(res.status_code, 400)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from server.bloom_filter import BloomFilter
+
+
+class BloomFilterTests(unittest.TestCase):
+    def test_contains(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom_filter.add(f"item{i}")
+
+        for i in range(1000):
+            self.assertIn(f"item{i}", bloom_filter)
+
+        false_positives = sum(f"other{i}" in bloom_filter for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_stats(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        self.assertEqual(bloom_filter.false_positive_rate(), 0)
+
+        for i in range(1000):
+            bloom_filter.add(f"item{i}")
+
+        stats = bloom_filter.stats()
+        self.assertEqual(stats['count'], 1000)
+        self.assertEqual(stats['memory_bytes'], 1199)
+        self.assertAlmostEqual(stats['false_positive_rate'], 0.01, places=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+import fnmatch
+import unittest
+from unittest import mock
+
+from server import cache as cache_module
+from server.cache import MISSING, LRUCache, LocalInvalidationBackend, RedisCache, RedisInvalidationBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+class FakeRedis:
+    """
+    Stand-in for a redis.Redis client that stores values in a dict and delivers published messages directly.
+    """
+
+    def __init__(self):
+        self.pubsubs = []
+        self.values = {}
+        self.expiry = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, px=None):
+        self.values[key] = value
+        self.expiry[key] = px
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def scan_iter(self, match):
+        return [key for key in self.values if fnmatch.fnmatch(key, match)]
+
+    def publish(self, channel, message):
+        for pubsub in self.pubsubs:
+            pubsub.deliver(channel, message)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        pubsub = FakePubSub()
+        self.pubsubs.append(pubsub)
+        return pubsub
+
+
+class FakePubSub:
+    def __init__(self):
+        self.handlers = {}
+
+    def subscribe(self, **handlers):
+        self.handlers.update(handlers)
+
+    def run_in_thread(self, sleep_time=0, daemon=False):
+        return object()
+
+    def deliver(self, channel, message):
+        if channel in self.handlers:
+            self.handlers[channel]({'channel': channel.encode(), 'data': message.encode()})
+
+
+class LRUCacheTests(unittest.TestCase):
+    def test_get_and_set(self):
+        cache = LRUCache(max_size=10)
+
+        self.assertIs(cache.get("a"), MISSING)
+        self.assertIsNone(cache.get("a", None))
+
+        cache.set("a", False)
+        self.assertFalse(cache.get("a"))
+
+        cache.delete("a")
+        self.assertIs(cache.get("a"), MISSING)
+
+    def test_set_generation(self):
+        cache = LRUCache(max_size=10)
+        generation = cache.generation
+
+        cache.set("a", 1, generation=generation)
+        self.assertEqual(cache.get("a"), 1)
+
+        cache.delete("b")
+        cache.set("b", 2, generation=generation)
+        self.assertIs(cache.get("b"), MISSING)
+
+    def test_eviction(self):
+        cache = LRUCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats(), {'size': 2, 'hits': 3, 'misses': 1, 'evictions': 1})
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = LRUCache(max_size=10, ttl=10, clock=clock)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=None)
+        cache.set("c", 3, ttl=20)
+
+        clock.time = 15
+        self.assertIs(cache.get("a"), MISSING)
+        self.assertEqual(cache.get("b"), 2)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+
+
+    def test_size_of(self):
+        cache = LRUCache(max_size=10, size_of=len)
+        cache.set("a", b"1234")
+        cache.set("b", b"1234")
+        cache.set("a", b"12")
+        cache.set("c", b"12345")
+
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual(cache.get("a"), b"12")
+        self.assertEqual(cache.get("c"), b"12345")
+        self.assertEqual(cache.stats()['total_size'], 7)
+
+        cache.delete("c")
+        self.assertEqual(cache.stats()['total_size'], 2)
+
+
+class RedisCacheTests(unittest.TestCase):
+    def test_get_and_set(self):
+        client = FakeRedis()
+        cache1, cache2 = RedisCache(client, "cache:", ttl=10), RedisCache(client, "cache:")
+        other = RedisCache(client, "other:")
+
+        self.assertIsNone(cache1.get("a", None))
+        cache1.set("a", b"1")
+        other.set("a", b"2", ttl=None)
+        self.assertEqual(cache2.get("a"), b"1")
+        self.assertEqual(client.expiry, {"cache:a": 10000, "other:a": None})
+
+        cache2.delete("a")
+        self.assertIs(cache1.get("a"), MISSING)
+
+        cache1.set("b", b"1")
+        cache1.clear()
+        self.assertIs(cache1.get("b"), MISSING)
+        self.assertEqual(other.get("a"), b"2")
+        self.assertEqual(cache1.stats(), {'hits': 0, 'misses': 3})
+
+    def test_create_cache(self):
+        self.assertIsInstance(cache_module.create_cache("test", 10), LRUCache)
+
+        with mock.patch.dict('os.environ', {'CACHE_REDIS_URL': 'redis://localhost'}), \
+                mock.patch.object(cache_module, '_redis', FakeRedis()):
+            cache = cache_module.create_cache("test", 10)
+        self.assertIsInstance(cache, RedisCache)
+        self.assertTrue(cache.shared)
+
+
+class InvalidationBackendTests(unittest.TestCase):
+    def test_local(self):
+        backend = LocalInvalidationBackend()
+        received = []
+        backend.subscribe("channel", received.append)
+
+        backend.publish("channel", "key")
+        backend.publish("other", "key")
+
+        self.assertEqual(received, ["key"])
+
+    def test_redis(self):
+        client = FakeRedis()
+        worker1, worker2 = RedisInvalidationBackend(client), RedisInvalidationBackend(client)
+        cache1, cache2 = LRUCache(max_size=10), LRUCache(max_size=10)
+        worker1.subscribe("channel", cache1.delete)
+        worker2.subscribe("channel", cache2.delete)
+        cache1.set("key", 1)
+        cache2.set("key", 2)
+
+        worker1.publish("channel", "key")
+
+        self.assertIs(cache1.get("key"), MISSING)
+        self.assertIs(cache2.get("key"), MISSING)
+
+
+if __name__ == '__main__':
+    unittest.main()
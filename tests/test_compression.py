@@ -0,0 +1,68 @@
+import gzip
+import unittest
+
+import brotli
+from flask import g
+
+from server import compression
+from server.main import app
+
+
+class CompressionTests(unittest.TestCase):
+    def setUp(self):
+        compression._compressed_bodies.clear()
+
+    def compress(self, body, accept_encoding, mimetype='application/json', key=None):
+        with app.test_request_context('/', headers={'Accept-Encoding': accept_encoding}):
+            if key is not None:
+                g.compression_key = key
+            return compression.compress_response(app.response_class(body, mimetype=mimetype))
+
+    def test_choose_encoding(self):
+        for accept_encoding, expected in [('gzip, deflate, br', 'br'), ('gzip', 'gzip'), ('br;q=0.5, gzip', 'gzip'),
+                                          ('deflate', None), ('', None)]:
+            with app.test_request_context('/', headers={'Accept-Encoding': accept_encoding}):
+                self.assertEqual(compression.choose_encoding(), expected)
+
+    def test_compress_response(self):
+        body = b'{"a": "' + b'x' * 2000 + b'"}'
+
+        response = self.compress(body, 'gzip')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.get_data()), body)
+
+        response = self.compress(body, 'br, gzip')
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.get_data()), body)
+
+    def test_not_compressed(self):
+        large = b'x' * 2000
+
+        for response in [self.compress(b'{}', 'gzip'),
+                         self.compress(large, 'identity'),
+                         self.compress(large, 'gzip', mimetype='image/jpeg')]:
+            self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_cache(self):
+        body = b'{"a": "' + b'x' * 2000 + b'"}'
+
+        self.compress(body, 'gzip', key=('recipe', 1, 1))
+        response = self.compress(b'not compressed again' * 100, 'gzip', key=('recipe', 1, 1))
+        self.assertEqual(gzip.decompress(response.get_data()), body)
+
+        response = self.compress(b'new version' * 100, 'gzip', key=('recipe', 1, 2))
+        self.assertEqual(gzip.decompress(response.get_data()), b'new version' * 100)
+
+    def test_key_only_used_once(self):
+        body = b'{"a": "' + b'x' * 2000 + b'"}'
+
+        with app.app_context():
+            self.compress(body, 'gzip', key=('recipe', 1, 1))
+            response = self.compress(b'other response' * 100, 'gzip')
+
+        self.assertEqual(gzip.decompress(response.get_data()), b'other response' * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
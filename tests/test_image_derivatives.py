@@ -0,0 +1,74 @@
+import time
+import unittest
+
+from server import image_derivatives
+from server.database import handler, image_store
+from server.database.handler import db
+from server.main import app
+from tests.routes.test_helpers.images_helper import create_jpeg, image_size
+
+
+class ImageDerivativesTests(unittest.TestCase):
+    def setUp(self):
+        app.app_context().push()
+        handler.init_db(app)
+        db.session.close()
+
+    def test_resize(self):
+        data = create_jpeg(1000, 500)
+
+        self.assertEqual(image_size(image_derivatives.resize(data, 160)), (160, 80))
+        self.assertEqual(image_size(image_derivatives.resize(data, 2000)), (1000, 500))
+
+    def test_is_valid_image(self):
+        self.assertTrue(image_derivatives.is_valid_image(create_jpeg(10, 10)))
+        self.assertFalse(image_derivatives.is_valid_image(b'not a jpeg image'))
+        self.assertFalse(image_derivatives.is_valid_image(create_jpeg(10, 10)[:100]))
+
+    def test_create_invalid_image(self):
+        image_key = image_store.store.save(b'not a jpeg image')
+        db.session.commit()
+
+        self.assertFalse(image_derivatives.create(image_key, 'thumb'))
+
+        workers, image_derivatives.WORKERS = image_derivatives.WORKERS, 0
+        try:
+            image_derivatives.schedule(image_key, b'not a jpeg image')
+        finally:
+            image_derivatives.WORKERS = workers
+        self.assertFalse(image_store.store.exists(image_derivatives.derivative_key(image_key, 'card')))
+
+    def test_create(self):
+        image_key = image_store.store.save(create_jpeg(1000, 500))
+        db.session.commit()
+
+        self.assertTrue(image_derivatives.create(image_key, 'thumb'))
+        self.assertTrue(image_derivatives.create(image_key, 'full'))
+        self.assertFalse(image_derivatives.create("0" * 64, 'thumb'))
+
+        thumb = image_store.store.load(image_derivatives.derivative_key(image_key, 'thumb'))
+        self.assertEqual(image_size(thumb), (160, 80))
+
+    def test_schedule(self):
+        data = create_jpeg(1000, 500)
+        image_key = image_store.store.save(data)
+        db.session.commit()
+
+        workers, image_derivatives.WORKERS = image_derivatives.WORKERS, 1
+        try:
+            image_derivatives.schedule(image_key, data)
+        finally:
+            image_derivatives.WORKERS = workers
+
+        key = image_derivatives.derivative_key(image_key, 'card')
+        for _ in range(100):
+            if image_store.store.exists(key):
+                break
+            time.sleep(0.1)
+            db.session.remove()
+
+        self.assertEqual(image_size(image_store.store.load(key)), (640, 320))
+
+
+if __name__ == '__main__':
+    unittest.main()
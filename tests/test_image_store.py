@@ -0,0 +1,44 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from server.database.image_store import FileSystemImageStore, decode_data_uri
+
+
+class FileSystemImageStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = FileSystemImageStore(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_save(self):
+        key1 = self.store.save(b"image")
+        key2 = self.store.save(b"image")
+        key3 = self.store.save(b"other image")
+
+        self.assertEqual(key1, hashlib.sha256(b"image").hexdigest())
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, key3)
+        self.assertTrue(os.path.isfile(self.store.path(key1)))
+
+    def test_load(self):
+        key = self.store.save(b"image")
+
+        self.assertEqual(self.store.load(key), b"image")
+        self.assertIsNone(self.store.load("0" * 64))
+        self.assertRaises(ValueError, self.store.load, "../../etc/passwd")
+
+
+class DecodeDataUriTests(unittest.TestCase):
+    def test_decode_data_uri(self):
+        self.assertEqual(decode_data_uri("data:image/jpeg;base64,aW1hZ2U="), b"image")
+        self.assertIsNone(decode_data_uri("data:image/jpeg;base64,not valid"))
+        self.assertIsNone(decode_data_uri("image"))
+        self.assertIsNone(decode_data_uri(""))
+
+
+if __name__ == '__main__':
+    unittest.main()
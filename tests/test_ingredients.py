@@ -0,0 +1,28 @@
+import unittest
+
+from server.database.ingredients import normalize_ingredient, parse_ingredients
+
+
+class IngredientsTests(unittest.TestCase):
+    def test_normalize_ingredient(self):
+        self.assertEqual(normalize_ingredient("  Brown   SUGAR "), "brown sugar")
+        self.assertEqual(normalize_ingredient("Crème fraîche"), "crème fraîche")
+
+    def test_parse_ingredients(self):
+        rows = parse_ingredients([{"name": "Flour", "unit": "dl", "quantity": 3}, "Milk",
+                                  {"name": "Salt", "quantity": "a pinch"}, {"unit": "kg"}, 4, " "])
+        self.assertEqual(rows, [
+            {'name': "flour", 'unit': "dl", 'quantity': 3.0},
+            {'name': "milk", 'unit': None, 'quantity': None},
+            {'name': "salt", 'unit': None, 'quantity': None},
+        ])
+
+    def test_parse_invalid_ingredients(self):
+        self.assertEqual(parse_ingredients(""), [])
+        self.assertEqual(parse_ingredients(None), [])
+        self.assertEqual(parse_ingredients("ingredients"), [])
+        self.assertEqual(parse_ingredients({"name": "flour"}), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
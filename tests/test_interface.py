@@ -1,9 +1,15 @@
+from datetime import datetime, timedelta, timezone
 from select import select
+import hashlib
+import threading
 import unittest
+from server import cache
 from server.database import handler, interface
 from server.database.handler import db
-from server.database.models import User
+from server.database.models import FRIENDSHIP_ACCEPTED, Image, PublicUser, RecipeIngredient, TokenBlocklist, User, \
+    friendship, liked_recipes_table
 from server.main import app
+from tests.routes.test_helpers.query_counter import count_queries
 
 
 class InterfaceTests(unittest.TestCase):
@@ -11,6 +17,146 @@ class InterfaceTests(unittest.TestCase):
         app.app_context().push()
         handler.init_db(app)
         db.session.close()
+        interface._revoked_tokens.clear()
+        interface._revoked_filter.clear()
+        interface._recipe_payloads.clear()
+        interface._friend_graph.clear()
+        interface._identities.clear()
+
+    # ============================================================================
+    # TOKENS
+    # ============================================================================
+
+    def test_revoke_token(self):
+        self.assertFalse(interface.is_revoked("jti1"))
+
+        interface.revoke_token("jti1")
+
+        self.assertTrue(interface.is_revoked("jti1"))
+        self.assertFalse(interface.is_revoked("jti2"))
+
+    def test_prune_blocklist(self):
+        now = datetime.now(timezone.utc)
+        interface.revoke_token("expired1", now - timedelta(days=1))
+        interface.revoke_token("expired2", now - timedelta(seconds=1))
+        interface.revoke_token("active", now + timedelta(days=1))
+        interface.revoke_token("no expiry")
+        db.session.add(TokenBlocklist(jti="old", revoked_at=now - timedelta(days=10)))
+        db.session.commit()
+
+        removed = interface.prune_blocklist(timedelta(days=5), batch_size=1)
+
+        self.assertEqual(removed, 3)
+        self.assertEqual(sorted(jti for jti, in db.session.query(TokenBlocklist.jti)), ["active", "no expiry"])
+
+    def test_is_revoked_cached(self):
+        interface.revoke_token("jti1")
+
+        self.assertFalse(interface.is_revoked("jti3"))
+
+        with count_queries() as statements:
+            for _ in range(3):
+                self.assertTrue(interface.is_revoked("jti1"))
+                self.assertFalse(interface.is_revoked("jti3"))
+        self.assertEqual(len(statements), 0)
+
+        # Revoked in another worker
+        db.session.add(TokenBlocklist(jti="jti3", revoked_at=datetime.now()))
+        db.session.commit()
+        self.assertFalse(interface.is_revoked("jti3"))
+
+        cache.invalidation.publish(interface.REVOKED_TOKENS_CHANNEL, "jti3")
+        self.assertTrue(interface.is_revoked("jti3"))
+
+    def test_is_revoked_filter(self):
+        for i in range(100):
+            interface.revoke_token(f"revoked{i}")
+        interface._revoked_tokens.clear()
+        interface._revoked_filter.clear()
+        lookups = interface.revoked_tokens_stats()['filter']['lookups']
+        false_positives = interface.revoked_tokens_stats()['filter']['false_positives']
+
+        with count_queries() as statements:
+            for i in range(100):
+                self.assertFalse(interface.is_revoked(f"not revoked{i}"))
+        # Building the filter needs two queries, and false positives one query each
+        false_positives = interface.revoked_tokens_stats()['filter']['false_positives'] - false_positives
+        self.assertEqual(len(statements), 2 + false_positives)
+        self.assertLess(false_positives, 5)
+
+        for i in range(100):
+            self.assertTrue(interface.is_revoked(f"revoked{i}"))
+
+        stats = interface.revoked_tokens_stats()['filter']
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['lookups'] - lookups, 200)
+        self.assertGreater(stats['memory_bytes'], 0)
+
+    def test_is_revoked_while_revoking(self):
+        revoked_filter = interface._revoked_filter
+        might_contain = revoked_filter.might_contain
+
+        def revoke_during_lookup(jti):
+            # The token is revoked after the filter was checked, but before the result is cached
+            result = might_contain(jti)
+            interface.revoke_token(jti)
+            return result
+
+        revoked_filter.might_contain = revoke_during_lookup
+        try:
+            self.assertFalse(interface.is_revoked("token"))
+        finally:
+            revoked_filter.might_contain = might_contain
+
+        self.assertTrue(interface.is_revoked("token"))
+
+    def test_is_revoked_filter_rebuild(self):
+        interface.revoke_token("revoked1")
+        self.assertFalse(interface.is_revoked("not revoked"))
+        revoked_filter = interface._revoked_filter
+        rebuilds = revoked_filter.stats()['rebuilds']
+
+        # Revoked in another worker, and the filter is too old
+        db.session.add(TokenBlocklist(jti="revoked2", revoked_at=datetime.now()))
+        db.session.commit()
+        revoked_filter._built_at -= interface.REVOKED_TOKENS_TTL + 1
+
+        # While another thread builds the filter, the old filter is used without queries
+        with revoked_filter._build_lock:
+            with count_queries() as statements:
+                self.assertFalse(revoked_filter.might_contain("revoked2"))
+            self.assertEqual(statements, [])
+
+        # The filter is rebuilt in the background
+        self.assertFalse(revoked_filter.might_contain("revoked2"))
+        with revoked_filter._build_lock:
+            self.assertTrue(revoked_filter.might_contain("revoked2"))
+        self.assertEqual(revoked_filter.stats()['rebuilds'], rebuilds + 1)
+
+    def test_is_revoked_filter_concurrent_builds(self):
+        for i in range(100):
+            interface.revoke_token(f"revoked{i}")
+        interface._revoked_filter.clear()
+        errors = []
+
+        def lookup():
+            with app.app_context():
+                try:
+                    interface._revoked_filter.rebuild()
+                    interface._revoked_filter.might_contain("revoked1")
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    db.session.remove()
+
+        threads = [threading.Thread(target=lookup) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertTrue(interface._revoked_filter.might_contain("revoked1"))
 
     # ============================================================================
     # USERS
@@ -42,6 +188,29 @@ class InterfaceTests(unittest.TestCase):
         self.assertEqual(user1, user2, "Returned wrong user")
         self.assertIsNone(interface.get_user_by_id(999999), "Should return None")
 
+    def test_get_public_user(self):
+        user_id = interface.create_user("filip", "email@test.test", "1234").id
+
+        with count_queries() as statements:
+            self.assertEqual(interface.get_public_user(user_id), PublicUser(user_id, "filip"))
+            self.assertEqual(interface.get_public_user(user_id), PublicUser(user_id, "filip"))
+            self.assertIsNone(interface.get_public_user(999999))
+
+        self.assertEqual(len(statements), 2)
+        self.assertNotIn('pw_hash', statements[0])
+
+    def test_index_user_search_names(self):
+        user_ids = [interface.create_user(name, f"{i}@test.test", "password").id
+                    for i, name in enumerate(["Émile", "ANNA", "bob"])]
+        User.query.update({User.search_name: ''})
+        db.session.commit()
+
+        self.assertEqual(interface.index_user_search_names(batch_size=2), 3)
+
+        search_names = [name for name, in db.session.query(User.search_name).order_by(User.id)]
+        self.assertEqual(search_names, ["émile", "anna", "bob"])
+        self.assertEqual([user.id for user in interface.search_users("ann")], [user_ids[1]])
+
     def test_search_users(self):
         names = ["user1", "user2", "user3", "£$€¥¡@]", "test1", "test2"]
         for name in names:
@@ -60,7 +229,35 @@ class InterfaceTests(unittest.TestCase):
         self.assertEqual([user.name for user in users], ["£$€¥¡@]"])
 
         users = interface.search_users("")
-        self.assertEqual([user.name for user in users], ["user1", "user2", "user3", "£$€¥¡@]", "test1", "test2"])
+        self.assertEqual([user.name for user in users], ["test1", "test2", "user1", "user2", "user3", "£$€¥¡@]"])
+
+        users = interface.search_users("", limit=2)
+        self.assertEqual([user.name for user in users], ["test1", "test2"])
+
+    def test_search_users_ranked(self):
+        names = ["Anna Berg", "Berg", "bergström", "Berg", "Isberg", "Ölberg", "Bo", "100%"]
+        users = [interface.create_user(name, f"user{i}@test.test", "password") for i, name in enumerate(names)]
+
+        users = interface.search_users("BERG")
+        self.assertEqual([user.name for user in users], ["Berg", "Berg", "bergström", "Anna Berg", "Isberg", "Ölberg"])
+
+        users = interface.search_users("berg", limit=4)
+        self.assertEqual([user.name for user in users], ["Berg", "Berg", "bergström", "Anna Berg"])
+
+        users = interface.search_users("berg", limit=2)
+        self.assertEqual([user.name for user in users], ["Berg", "Berg"])
+
+        users = interface.search_users("berg", exclude_user_id=users[0].id)
+        self.assertEqual([user.name for user in users], ["Berg", "bergström", "Anna Berg", "Isberg", "Ölberg"])
+
+        users = interface.search_users("ölb")
+        self.assertEqual([user.name for user in users], ["Ölberg"])
+
+        users = interface.search_users("0%")
+        self.assertEqual([user.name for user in users], ["100%"])
+
+        users = interface.search_users("%")
+        self.assertEqual([user.name for user in users], ["100%"])
 
     # ============================================================================
     # FRIENDS
@@ -104,7 +301,7 @@ class InterfaceTests(unittest.TestCase):
         interface.create_friend_request(user1, user2)
         interface.create_friend_request(user1, user3)
 
-        interface.accept_friend_request(user1, user2)
+        interface.accept_friend_request(user2, user1)
         interface.accept_friend_request(user3, user1)
 
         self.assertEqual(user1.outgoing_friend_requests, [])
@@ -123,8 +320,8 @@ class InterfaceTests(unittest.TestCase):
         user3 = interface.create_user("user3", "user3@test.test", "password")
         interface.create_friend_request(user1, user2)
         interface.create_friend_request(user1, user3)
-        interface.accept_friend_request(user1, user2)
-        interface.accept_friend_request(user1, user3)
+        interface.accept_friend_request(user2, user1)
+        interface.accept_friend_request(user3, user1)
 
         interface.remove_friendship(user1, user2)
         interface.remove_friendship(user3, user1)
@@ -133,6 +330,211 @@ class InterfaceTests(unittest.TestCase):
         self.assertEqual(user2.friends, [])
         self.assertEqual(user3.friends, [])
 
+    def test_accept_friend_request_requires_request(self):
+        user1 = interface.create_user("user1", "user1@test.test", "password")
+        user2 = interface.create_user("user2", "user2@test.test", "password")
+
+        self.assertFalse(interface.accept_friend_request(user1, user2))
+        self.assertFalse(interface.create_friend_request(user1, user1))
+        self.assertEqual(user1.friends, [])
+
+        interface.create_friend_request(user1, user2)
+        self.assertFalse(interface.accept_friend_request(user1, user2))  # Only the receiver can accept
+        self.assertEqual(user1.friends, [])
+        self.assertTrue(interface.accept_friend_request(user2, user1))
+        self.assertFalse(interface.create_friend_request(user2, user1))
+        self.assertFalse(interface.cancel_friend_request(user2, user1))
+        self.assertEqual(user1.friends, [user2])
+        self.assertEqual(user1.outgoing_friend_requests, [])
+        self.assertEqual(user2.incoming_friend_requests, [])
+
+    def test_bulk_friend_requests(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "password") for i in range(6)]
+        for i in range(1, 5):
+            interface.create_friend_request(users[i], users[0])
+        interface.create_friend_request(users[0], users[5])
+
+        # Only requests received from the users are accepted and declined
+        accepted = interface.accept_friend_requests(users[0].id, [users[1].id, users[2].id, users[1].id, users[5].id])
+        self.assertEqual(accepted, [users[1].id, users[2].id])
+        self.assertEqual(interface.decline_friend_requests(users[0].id, [users[2].id, users[3].id, users[5].id]),
+                         [users[3].id])
+        self.assertEqual(interface.cancel_friend_requests(users[0].id, [users[4].id, users[5].id]), [users[5].id])
+
+        self.assertEqual(users[0].friends, [users[1], users[2]])
+        self.assertEqual(users[0].incoming_friend_requests, [users[4]])
+        self.assertEqual(users[0].outgoing_friend_requests, [])
+        self.assertEqual(interface.mutual_friend_count(users[1].id, users[2].id), 1)
+
+    def test_migrate_friend_requests(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "password") for i in range(4)]
+        interface.create_friend_request(users[0], users[1])
+        interface.accept_friend_request(users[1], users[0])
+        db.session.execute("DROP TABLE IF EXISTS friendship_requests")
+        db.session.execute("CREATE TABLE friendship_requests (requesting_user_id INTEGER, receiving_user_id INTEGER)")
+        db.session.execute("INSERT INTO friendship_requests VALUES "
+                           f"({users[2].id}, {users[0].id}), ({users[0].id}, {users[3].id}), "
+                           f"({users[1].id}, {users[0].id})")
+        db.session.commit()
+
+        self.assertEqual(interface.migrate_friend_requests(), 2)
+        db.session.execute("DROP TABLE friendship_requests")
+
+        self.assertEqual(users[0].friends, [users[1]])
+        self.assertEqual(users[0].incoming_friend_requests, [users[2]])
+        self.assertEqual(users[0].outgoing_friend_requests, [users[3]])
+
+    def test_friendship_stored_once(self):
+        user1 = interface.create_user("user1", "user1@test.test", "password")
+        user2 = interface.create_user("user2", "user2@test.test", "password")
+        interface.create_friend_request(user2, user1)
+        self.assertFalse(interface.create_friend_request(user1, user2))
+        self.assertTrue(interface.accept_friend_request(user1, user2))
+        self.assertFalse(interface.accept_friend_request(user2, user1))
+
+        rows = db.session.query(friendship).all()
+        self.assertEqual(rows, [(user1.id, user2.id, 'accepted', user2.id)])
+
+    def test_are_friends(self):
+        user1 = interface.create_user("user1", "user1@test.test", "password")
+        user2 = interface.create_user("user2", "user2@test.test", "password")
+        user3 = interface.create_user("user3", "user3@test.test", "password")
+        interface.create_friend_request(user2, user1)
+        interface.accept_friend_request(user1, user2)
+
+        self.assertTrue(interface.are_friends(user1.id, user2.id))
+        self.assertTrue(interface.are_friends(user2.id, user1.id))
+        self.assertFalse(interface.are_friends(user1.id, user3.id))
+        self.assertFalse(interface.are_friends(user3.id, user2.id))
+
+        interface.remove_friendship(user2, user1)
+        self.assertFalse(interface.are_friends(user1.id, user2.id))
+
+    def test_migrate_friendships(self):
+        # Friendships used to be stored in both directions, without the constraint on the order
+        db.session.execute("DROP TABLE friendships")
+        db.session.execute("CREATE TABLE friendships (user1_id INTEGER, user2_id INTEGER, "
+                           "PRIMARY KEY (user1_id, user2_id))")
+        db.session.execute(friendship.insert(), [
+            {'user1_id': 1, 'user2_id': 2}, {'user1_id': 2, 'user2_id': 1},
+            {'user1_id': 5, 'user2_id': 3}, {'user1_id': 4, 'user2_id': 6},
+        ])
+        db.session.commit()
+
+        self.assertEqual(interface.migrate_friendships(), 2)
+
+        rows = db.session.query(friendship.c.user1_id, friendship.c.user2_id).order_by(friendship.c.user1_id).all()
+        self.assertEqual(rows, [(1, 2), (3, 5), (4, 6)])
+
+    def test_friend_suggestions(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "password") for i in range(6)]
+        for a, b in [(0, 1), (0, 2), (1, 3), (2, 3), (2, 4), (1, 5)]:
+            interface.create_friend_request(users[a], users[b])
+            interface.accept_friend_request(users[b], users[a])
+        interface.create_friend_request(users[5], users[0])
+
+        self.assertEqual(interface.friend_suggestions(users[0].id, 10), [
+            (PublicUser(users[3].id, "user3"), 2),
+            (PublicUser(users[4].id, "user4"), 1),
+        ])
+        self.assertEqual(interface.mutual_friend_count(users[0].id, users[3].id), 2)
+        loads = interface.friend_graph_stats()['loads']
+
+        # The loaded graph is updated when friendships change
+        interface.remove_friendship(users[2], users[0])
+        interface.create_friend_request(users[0], users[4])
+        self.assertEqual(interface.friend_suggestions(users[0].id, 10), [(PublicUser(users[3].id, "user3"), 1)])
+        self.assertEqual(interface.friend_graph_stats()['loads'], loads)
+
+    def test_friend_graph_updated_by_other_workers(self):
+        user1 = interface.create_user("user1", "user1@test.test", "password")
+        user2 = interface.create_user("user2", "user2@test.test", "password")
+        self.assertEqual(interface.mutual_friend_count(user1.id, user2.id), 0)
+
+        cache.invalidation.publish(interface.FRIENDSHIPS_CHANNEL, f"+{user1.id}:3")
+        cache.invalidation.publish(interface.FRIENDSHIPS_CHANNEL, f"+3:{user2.id}")
+        self.assertEqual(interface.mutual_friend_count(user1.id, user2.id), 1)
+
+        cache.invalidation.publish(interface.FRIENDSHIPS_CHANNEL, f"-3:{user2.id}")
+        self.assertEqual(interface.mutual_friend_count(user1.id, user2.id), 0)
+
+    def test_friend_graph_reload(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "password") for i in range(3)]
+        user_ids = [user.id for user in users]
+        self.assertEqual(interface.mutual_friend_count(user_ids[0], user_ids[1]), 0)
+        friend_graph = interface._friend_graph
+        loads = friend_graph.stats()['loads']
+
+        # Friends in another worker, and the graph is too old
+        for user_id in user_ids[:2]:
+            db.session.execute(friendship.insert().values(user1_id=user_id, user2_id=user_ids[2],
+                                                          status=FRIENDSHIP_ACCEPTED))
+        db.session.commit()
+        friend_graph._loaded_at -= interface.FRIEND_GRAPH_TTL + 1
+
+        # While another thread loads the graph, the old graph is used without queries
+        with friend_graph._load_lock:
+            with count_queries() as statements:
+                self.assertEqual(interface.mutual_friend_count(user_ids[0], user_ids[1]), 0)
+            self.assertEqual(statements, [])
+
+        # The graph is reloaded in the background
+        self.assertEqual(interface.mutual_friend_count(user_ids[0], user_ids[1]), 0)
+        with friend_graph._load_lock:
+            self.assertEqual(interface.mutual_friend_count(user_ids[0], user_ids[1]), 1)
+        self.assertEqual(friend_graph.stats()['loads'], loads + 1)
+
+    def test_friend_graph_concurrent_loads(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "password") for i in range(3)]
+        for user in users[:2]:
+            interface.create_friend_request(user, users[2])
+            interface.accept_friend_request(users[2], user)
+        user_ids = [user.id for user in users]
+        interface._friend_graph.clear()
+        errors = []
+
+        def load():
+            with app.app_context():
+                try:
+                    interface._friend_graph.load()
+                    interface.mutual_friend_count(user_ids[0], user_ids[1])
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    db.session.remove()
+
+        threads = [threading.Thread(target=load) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(interface.mutual_friend_count(user_ids[0], user_ids[1]), 1)
+
+    def test_list_connections(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "password") for i in range(5)]
+        interface.create_friend_request(users[0], users[1])
+        interface.accept_friend_request(users[1], users[0])
+        interface.create_friend_request(users[0], users[3])
+        interface.create_friend_request(users[0], users[2])
+        interface.create_friend_request(users[4], users[0])
+
+        connections = interface.list_connections(users[0].id)
+        self.assertEqual(connections, {
+            'friends': [PublicUser(users[1].id, "user1")],
+            'outgoing_requests': [PublicUser(users[2].id, "user2"), PublicUser(users[3].id, "user3")],
+            'incoming_requests': [PublicUser(users[4].id, "user4")],
+        })
+        self.assertEqual(connections['friends'][0].get_public_data(), users[1].get_public_data())
+
+        connections = interface.list_connections(users[3].id)
+        self.assertEqual(connections, {
+            'friends': [],
+            'outgoing_requests': [],
+            'incoming_requests': [PublicUser(users[0].id, "user0")],
+        })
+
     # ============================================================================
     # RECIPES
     # ============================================================================
@@ -142,7 +544,7 @@ class InterfaceTests(unittest.TestCase):
         name = "Recipe" * 100
         ingredients = "Ingredient\n" * 10000
         instructions = "Instruction\n" * 10000
-        image = "image in string format" * 10000
+        image = b"image in bytes format" * 10000
 
         recipe = interface.create_recipe(user, name, ingredients, instructions, image)
         self.assertIsNotNone(recipe)
@@ -150,7 +552,8 @@ class InterfaceTests(unittest.TestCase):
         self.assertEqual(recipe.name, name)
         self.assertEqual(recipe.ingredients, ingredients)
         self.assertEqual(recipe.instructions, instructions)
-        self.assertEqual(recipe.image, image)
+        self.assertEqual(recipe.image, hashlib.sha256(image).hexdigest())
+        self.assertEqual(interface.get_image(recipe.image), image)
         self.assertEqual(user.recipes, [recipe])
 
     def test_change_recipe(self):
@@ -158,13 +561,13 @@ class InterfaceTests(unittest.TestCase):
         name = "old name"
         ingredients = "old ingredients"
         instructions = "old instructions"
-        image = "old image"
+        image = b"old image"
         recipe = interface.create_recipe(user, name, ingredients, instructions, image)
 
         new_name = "new name"
         new_ingredients = "new ingredients"
-        new_instructions = "" # Should not be updated because it is empty
-        new_image = "new image"
+        new_instructions = None # Should not be updated because it is None
+        new_image = b"new image"
         interface.change_recipe(recipe.id, new_name, new_ingredients, new_instructions, new_image)
 
         new_recipe = interface.get_recipe_by_id(recipe.id)
@@ -173,13 +576,26 @@ class InterfaceTests(unittest.TestCase):
         self.assertEqual(new_recipe.name, new_name)
         self.assertEqual(new_recipe.ingredients, new_ingredients)
         self.assertEqual(new_recipe.instructions, instructions)
-        self.assertEqual(new_recipe.image, new_image)
+        self.assertEqual(interface.get_image(new_recipe.image), new_image)
+        self.assertEqual(new_recipe.version, 2)
+
+    def test_change_recipe_clear(self):
+        user = interface.create_user("user", "user@example.com", "pw")
+        recipe = interface.create_recipe(user, "name", ["2 eggs"], ["Boil the eggs"], None)
+
+        interface.change_recipe(recipe.id, "", [], [], None)
+
+        new_recipe = interface.get_recipe_by_id(recipe.id)
+        self.assertEqual(new_recipe.name, "name")
+        self.assertEqual(new_recipe.ingredients, [])
+        self.assertEqual(new_recipe.instructions, [])
+        self.assertEqual(RecipeIngredient.query.filter_by(recipe_id=recipe.id).count(), 0)
 
     def test_delete_recipe(self):
         user1 = interface.create_user("user1", "user1@example.com", "pw")
         user2 = interface.create_user("user2", "user2@example.com", "pw")
-        recipe1 = interface.create_recipe(user1, "1", "", "", "")
-        recipe2 = interface.create_recipe(user1, "2", "", "", "")
+        recipe1 = interface.create_recipe(user1, "1", "", "", None)
+        recipe2 = interface.create_recipe(user1, "2", "", "", None)
         interface.like_recipe(user2, recipe1)
 
         self.assertEqual(user1.recipes, [recipe1, recipe2])
@@ -191,16 +607,35 @@ class InterfaceTests(unittest.TestCase):
         self.assertEqual(user1.recipes, [recipe2])
         self.assertEqual(user2.liked_recipes, [])
 
+    def test_get_recipes_by_ids(self):
+        user = interface.create_user("user", "user@test.test", "1234")
+        recipes = [interface.create_recipe(user, f"recipe{i}", "", "", None) for i in range(3)]
+
+        result = interface.get_recipes_by_ids([recipes[2].id, recipes[0].id, 999])
+
+        self.assertEqual(sorted(result, key=lambda recipe: recipe.id), [recipes[0], recipes[2]])
+        self.assertEqual(interface.get_recipes_by_ids([]), [])
+
+    def test_get_recipes_by_ids_of_friends(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "1234") for i in range(3)]
+        interface.create_friend_request(users[0], users[1])
+        interface.accept_friend_request(users[1], users[0])
+        recipes = [interface.create_recipe(user, "recipe", "", "", None) for user in users]
+
+        result = interface.get_recipes_by_ids([recipe.id for recipe in recipes], user_id=users[0].id)
+
+        self.assertEqual(sorted(result, key=lambda recipe: recipe.id), recipes[:2])
+
     def test_search_recipes(self):
         user = interface.create_user("user", "email@test.test", "pw")
         recipe_names = ["recipe1", "recipe2", "recipe3", "£@$£@$€", "test1", "test2"]
         for name in recipe_names:
-            interface.create_recipe(user, name, "ingredients", "instructions", "image")
+            interface.create_recipe(user, name, "ingredients", "instructions", b"image")
 
         recipes = interface.search_recipes("no")
         self.assertEqual(recipes, [])
 
-        recipes = interface.search_recipes("ciP")
+        recipes = interface.search_recipes("rEc")
         self.assertEqual([recipe.name for recipe in recipes], ["recipe1", "recipe2", "recipe3"])
 
         recipes = interface.search_recipes("rEcIpE3")
@@ -213,6 +648,38 @@ class InterfaceTests(unittest.TestCase):
         self.assertEqual([recipe.name for recipe in recipes],
                          ["recipe1", "recipe2", "recipe3", "£@$£@$€", "test1", "test2"])
 
+        recipes = interface.search_recipes("", limit=2, offset=3)
+        self.assertEqual([recipe.name for recipe in recipes], ["£@$£@$€", "test1"])
+
+    def test_search_recipes_ranked(self):
+        user1 = interface.create_user("user1", "user1@test.test", "pw")
+        user2 = interface.create_user("user2", "user2@test.test", "pw")
+        interface.create_recipe(user1, "Pancakes", ["flour", "milk", "eggs"], ["Mix", "Fry"], None)
+        interface.create_recipe(user1, "Tomato soup", ["tomatoes", "onion"], ["Boil tomatoes"], None)
+        interface.create_recipe(user1, "Tomato pasta", ["pasta", "tomatoes", "tomato paste"],
+                                ["Boil pasta", "Add tomatoes"], None)
+        interface.create_recipe(user2, "Omelette", ["eggs", "milk"], ["Whisk", "Fry"], None)
+        recipe = interface.create_recipe(user1, "Soup", "", "", None)
+
+        recipes = interface.search_recipes("TOMAT")
+        self.assertEqual(sorted(recipe.name for recipe in recipes), ["Tomato pasta", "Tomato soup"])
+
+        recipes = interface.search_recipes("tomato pasta")
+        self.assertEqual([recipe.name for recipe in recipes], ["Tomato pasta"])
+
+        recipes = interface.search_recipes("eggs milk")
+        self.assertEqual(sorted(recipe.name for recipe in recipes), ["Omelette", "Pancakes"])
+
+        recipes = interface.search_recipes("eggs", user_id=user1.id)
+        self.assertEqual([recipe.name for recipe in recipes], ["Pancakes"])
+
+        interface.change_recipe(recipe.id, "Bean stew", None, None, None)
+        recipes = interface.search_recipes("soup")
+        self.assertEqual([recipe.name for recipe in recipes], ["Tomato soup"])
+
+        interface.delete_recipe(interface.get_recipe_by_id(recipe.id))
+        self.assertEqual(interface.search_recipes("bean"), [])
+
     def test_latest_recipes(self):
         user_names = ["user1", "user2", "user3"]
         users = [interface.create_user(user_name, user_name + "@test.test", "1234") for user_name in user_names]
@@ -221,7 +688,7 @@ class InterfaceTests(unittest.TestCase):
 
         for index, recipe_name in enumerate(recipe_names):
             recipes.append(
-                interface.create_recipe(users[index % len(users)], recipe_name, "ingredients", "instructions", "image"))
+                interface.create_recipe(users[index % len(users)], recipe_name, "ingredients", "instructions", b"image"))
 
         latest = interface.latest_recipes(users, '')
         self.assertEqual(latest, recipes[::-1])
@@ -229,10 +696,10 @@ class InterfaceTests(unittest.TestCase):
         latest = interface.latest_recipes([users[1]], '')
         self.assertEqual(latest, [recipes[4], recipes[1]])
 
-        latest = interface.latest_recipes(users, 'iPE')
+        latest = interface.latest_recipes(users, 'rEC')
         self.assertEqual(latest, recipes[::-1])
 
-        latest = interface.latest_recipes(users, 'iPe3')
+        latest = interface.latest_recipes(users, 'RecIPe3')
         self.assertEqual(latest, [recipes[2]])
 
         latest = interface.latest_recipes([users[1]], 'kaldjhjhjhgytfvgguyga')
@@ -241,6 +708,242 @@ class InterfaceTests(unittest.TestCase):
         latest = interface.latest_recipes([], '')
         self.assertEqual(latest, [])
 
+        latest = interface.latest_recipes(users, '', limit=2)
+        self.assertEqual(latest, [recipes[4], recipes[3]])
+
+        latest = interface.latest_recipes(users, '', before_id=recipes[3].id, limit=2)
+        self.assertEqual(latest, [recipes[2], recipes[1]])
+
+        latest = interface.latest_recipes(users, '', before_id=recipes[0].id)
+        self.assertEqual(latest, [])
+
+    def test_remove_duplicate_likes(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "1234") for i in range(2)]
+        recipe = interface.create_recipe(users[0], "recipe", "", "", None)
+        # Likes used to be stored without a primary key
+        db.session.execute("DROP TABLE liked_recipes_table")
+        db.session.execute("CREATE TABLE liked_recipes_table (user_id INTEGER, recipe_id INTEGER)")
+        db.session.execute(liked_recipes_table.insert(), [
+            {'user_id': users[0].id, 'recipe_id': recipe.id}, {'user_id': users[0].id, 'recipe_id': recipe.id},
+            {'user_id': users[0].id, 'recipe_id': recipe.id}, {'user_id': users[1].id, 'recipe_id': recipe.id},
+        ])
+        db.session.commit()
+
+        self.assertEqual(interface.remove_duplicate_likes(), 2)
+        self.assertEqual(interface.remove_duplicate_likes(), 0)
+
+        interface.reconcile_like_counts()
+        self.assertEqual(interface.get_recipe_by_id(recipe.id).like_count, 2)
+
+    def test_migrate_recipe_images(self):
+        user = interface.create_user("user", "user@example.com", "pw")
+        recipe1 = interface.create_recipe(user, "1", "", "", None)
+        recipe2 = interface.create_recipe(user, "2", "", "", None)
+        recipe3 = interface.create_recipe(user, "3", "", "", b"image")
+        recipe1.image = "data:image/jpeg;base64,aW1hZ2U="
+        recipe2.image = "data:image/jpeg;base64,not valid base64"
+        db.session.commit()
+
+        self.assertEqual(interface.migrate_recipe_images(), 2)
+        self.assertEqual(interface.migrate_recipe_images(), 0)
+
+        self.assertEqual(recipe1.image, recipe3.image)
+        self.assertEqual(interface.get_image(recipe1.image), b"image")
+        self.assertIsNone(recipe2.image)
+
+    def test_feed_versions(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "1234") for i in range(2)]
+        interface.create_friend_request(users[0], users[1])
+        interface.accept_friend_request(users[1], users[0])
+        recipes = [interface.create_recipe(users[i % 2], f"recipe{i}", "", "", None) for i in range(3)]
+        interface.like_recipe(users[0], recipes[1])
+
+        versions = interface.feed_versions(users[0].id, '')
+        self.assertEqual(versions, [(recipes[2].id, 1), (recipes[1].id, 2), (recipes[0].id, 1)])
+
+        versions = interface.feed_versions(users[0].id, '', before_id=recipes[2].id, limit=1)
+        self.assertEqual(versions, [(recipes[1].id, 2)])
+
+        ids = [recipe_id for recipe_id, _ in versions] + [recipes[0].id, 999]
+        self.assertEqual(interface.get_recipe_summaries(ids), [recipes[1], recipes[0]])
+
+    def test_get_recipe_payload(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "1234") for i in range(2)]
+        recipe = interface.create_recipe(users[0], "recipe", ["ingredient"], ["instruction"], None)
+        builds = []
+
+        def build(recipe, ingredients, instructions):
+            builds.append(recipe.id)
+            return f"{recipe.name} {recipe.like_count} {ingredients} {instructions}".encode()
+
+        self.assertEqual(interface.get_recipe_payload(recipe.id, build), b'recipe 0 ["ingredient"] ["instruction"]')
+        self.assertEqual(interface.get_recipe_payload(recipe.id, build), b'recipe 0 ["ingredient"] ["instruction"]')
+        self.assertEqual(len(builds), 1)
+
+        interface.like_recipe(users[1], recipe)
+        self.assertEqual(interface.get_recipe_payload(recipe.id, build), b'recipe 1 ["ingredient"] ["instruction"]')
+
+        interface.like_recipe(users[1], recipe)  # Already liked, so nothing changes
+        interface.get_recipe_payload(recipe.id, build)
+        self.assertEqual(len(builds), 2)
+
+        interface.stop_like_recipe(users[1], recipe)
+        interface.change_recipe(recipe.id, "new name", None, None, None)
+        self.assertEqual(interface.get_recipe_payload(recipe.id, build), b'new name 0 ["ingredient"] ["instruction"]')
+
+        interface.load_recipe_payload(recipe.id, build)
+        self.assertEqual(len(builds), 4)
+
+        interface.delete_recipe(interface.get_recipe_by_id(recipe.id))
+        self.assertIsNone(interface.get_recipe_payload(recipe.id, build))
+        self.assertEqual(interface.recipe_payloads_stats()['size'], 0)
+
+    def test_load_recipe_payload_changed(self):
+        user = interface.create_user("user", "user@example.com", "pw")
+        recipe = interface.create_recipe(user, "recipe", ["ingredient"], ["instruction"], None)
+
+        def build(recipe, ingredients, instructions):
+            payload = f"{recipe.name} {recipe.version}".encode()
+            # Changed by another request after the recipe was loaded
+            interface.change_recipe(recipe.id, "new name", None, None, None)
+            return payload
+
+        self.assertEqual(interface.load_recipe_payload(recipe.id, build), b'recipe 1')
+        self.assertIsNone(interface.get_cached_recipe_payload(recipe.id))
+        self.assertEqual(interface.get_recipe_version(recipe.id)[0], 2)
+        self.assertIsNone(interface.get_recipe_version(999))
+
+    def test_recipe_ingredients(self):
+        user = interface.create_user("user", "user@example.com", "pw")
+        recipe = interface.create_recipe(
+            user, "recipe", [{"name": "Flour", "unit": "dl", "quantity": 3}, "Milk"], "", None)
+
+        def ingredient_rows():
+            return [(row.name, row.unit, row.quantity) for row in
+                    RecipeIngredient.query.filter_by(recipe_id=recipe.id).order_by(RecipeIngredient.position)]
+
+        self.assertEqual(ingredient_rows(), [("flour", "dl", 3.0), ("milk", None, None)])
+
+        interface.change_recipe(recipe.id, "", [{"name": "Eggs", "unit": "", "quantity": 2}], "", None)
+        self.assertEqual(ingredient_rows(), [("eggs", "", 2.0)])
+
+        interface.delete_recipe(recipe)
+        self.assertEqual(RecipeIngredient.query.count(), 0)
+
+    def test_index_recipe_ingredients(self):
+        user = interface.create_user("user", "user@example.com", "pw")
+        recipe1 = interface.create_recipe(user, "1", ["flour", "milk"], "", None)
+        recipe2 = interface.create_recipe(user, "2", 'not json', "", None)
+        db.session.execute(RecipeIngredient.__table__.delete())
+        db.session.commit()
+
+        self.assertEqual(interface.index_recipe_ingredients(batch_size=1), 2)
+
+        names = [name for name, in db.session.query(RecipeIngredient.name).filter_by(recipe_id=recipe1.id)]
+        self.assertEqual(sorted(names), ["flour", "milk"])
+        self.assertEqual(RecipeIngredient.query.filter_by(recipe_id=recipe2.id).count(), 0)
+
+    def test_cookable_recipes(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "1234") for i in range(3)]
+        interface.create_friend_request(users[0], users[1])
+        interface.accept_friend_request(users[1], users[0])
+
+        pancakes = interface.create_recipe(users[1], "Pancakes", ["Flour", "milk", "eggs", "butter"], "", None)
+        omelette = interface.create_recipe(users[1], "Omelette", ["eggs", "milk"], "", None)
+        bread = interface.create_recipe(users[0], "Bread", ["flour", "water", "yeast", "salt"], "", None)
+        interface.create_recipe(users[0], "Soup", ["tomatoes"], "", None)
+        interface.create_recipe(users[2], "Scrambled eggs", ["eggs"], "", None)
+
+        result = interface.cookable_recipes(users[0].id, ["EGGS", "milk", "flour", "butter "])
+        self.assertEqual(result, [(pancakes, 4, 4), (omelette, 2, 2), (bread, 1, 4)])
+
+        result = interface.cookable_recipes(users[0].id, ["eggs", "flour"], limit=2)
+        self.assertEqual(result, [(pancakes, 2, 4), (omelette, 1, 2)])
+
+        self.assertEqual(interface.cookable_recipes(users[0].id, ["sugar"]), [])
+        self.assertEqual(interface.cookable_recipes(users[0].id, []), [])
+
+    def test_feed_recipes(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "1234") for i in range(3)]
+        interface.create_friend_request(users[0], users[1])
+        interface.accept_friend_request(users[1], users[0])
+        recipes = [interface.create_recipe(users[i % 3], f"recipe{i}", "", "", None) for i in range(6)]
+
+        feed = interface.feed_recipes(users[0].id, '')
+        self.assertEqual(feed, [recipes[4], recipes[3], recipes[1], recipes[0]])
+
+        feed = interface.feed_recipes(users[1].id, 'recipe4')
+        self.assertEqual(feed, [recipes[4]])
+
+        feed = interface.feed_recipes(users[2].id, '', before_id=recipes[5].id, limit=1)
+        self.assertEqual(feed, [recipes[2]])
+
+    # ============================================================================
+    # TIMELINES
+    # ============================================================================
+
+    def test_push_feed(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "1234") for i in range(3)]
+
+        app.config['FEED_MODE'] = 'push'
+        try:
+            # Created before the friendship, so it is added to the timeline when the request is accepted
+            recipe0 = interface.create_recipe(users[1], "recipe0", "", "", None)
+            interface.create_friend_request(users[0], users[1])
+            interface.accept_friend_request(users[1], users[0])
+            recipes = [recipe0] + [interface.create_recipe(users[i % 3], f"recipe{i}", "", "", None)
+                                   for i in range(1, 6)]
+
+            feed = interface.feed_recipes(users[0].id, '')
+            self.assertEqual(feed, [recipes[4], recipes[3], recipes[1], recipes[0]])
+
+            feed = interface.feed_recipes(users[0].id, '', before_id=recipes[4].id, limit=2)
+            self.assertEqual(feed, [recipes[3], recipes[1]])
+
+            interface.delete_recipe(recipes[3])
+            feed = interface.feed_recipes(users[0].id, '')
+            self.assertEqual(feed, [recipes[4], recipes[1], recipes[0]])
+
+            interface.remove_friendship(users[0], users[1])
+            feed = interface.feed_recipes(users[0].id, '')
+            self.assertEqual(feed, [])
+            feed = interface.feed_recipes(users[1].id, '')
+            self.assertEqual(feed, [recipes[4], recipes[1], recipes[0]])
+        finally:
+            app.config['FEED_MODE'] = 'pull'
+
+    def test_rebuild_timelines(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "1234") for i in range(3)]
+        interface.create_friend_request(users[0], users[1])
+        interface.accept_friend_request(users[1], users[0])
+        for i in range(6):
+            interface.create_recipe(users[i % 3], f"recipe{i}", "", "", None)
+        pull_feeds = [interface.feed_recipes(user.id, '') for user in users]
+
+        interface.rebuild_timelines()
+
+        app.config['FEED_MODE'] = 'push'
+        try:
+            push_feeds = [interface.feed_recipes(user.id, '') for user in users]
+        finally:
+            app.config['FEED_MODE'] = 'pull'
+
+        self.assertEqual(push_feeds, pull_feeds)
+
+    # ============================================================================
+    # IMAGES
+    # ============================================================================
+
+    def test_get_image(self):
+        user = interface.create_user("user", "user@example.com", "pw")
+        recipe1 = interface.create_recipe(user, "1", "", "", b"image")
+        recipe2 = interface.create_recipe(user, "2", "", "", b"image")
+
+        self.assertEqual(recipe1.image, recipe2.image)
+        self.assertEqual(interface.get_image(recipe1.image), b"image")
+        self.assertEqual(Image.query.count(), 1)
+        self.assertIsNone(interface.get_image("0" * 64))
+
     # ============================================================================
     # LIKES
     # ============================================================================
@@ -253,7 +956,7 @@ class InterfaceTests(unittest.TestCase):
 
         for index, recipe_name in enumerate(recipe_names):
             recipes.append(
-                interface.create_recipe(users[index % len(users)], recipe_name, "ingredients", "instructions", "image"))
+                interface.create_recipe(users[index % len(users)], recipe_name, "ingredients", "instructions", b"image"))
 
         self.assertEqual(users[0].liked_recipes, [])
         self.assertEqual(recipes[0].liked_by, [])
@@ -268,6 +971,7 @@ class InterfaceTests(unittest.TestCase):
         interface.like_recipe(users[2], recipes[0])
         interface.like_recipe(users[2], recipes[0])
         self.assertEqual(recipes[0].liked_by, [users[0], users[2]])
+        self.assertEqual(interface.get_recipe_by_id(recipes[0].id).version, 3)  # Only changed by new likes
         self.assertEqual(users[0].liked_recipes, [recipes[0]])
         self.assertEqual(users[2].liked_recipes, [recipes[0]])
 
@@ -279,7 +983,7 @@ class InterfaceTests(unittest.TestCase):
 
         for index, recipe_name in enumerate(recipe_names):
             recipes.append(
-                interface.create_recipe(users[index % len(users)], recipe_name, "ingredients", "instructions", "image"))
+                interface.create_recipe(users[index % len(users)], recipe_name, "ingredients", "instructions", b"image"))
 
         interface.like_recipe(users[0], recipes[0])
         interface.like_recipe(users[2], recipes[0])
@@ -293,6 +997,65 @@ class InterfaceTests(unittest.TestCase):
         # user2 stop like recipe0 again
         interface.stop_like_recipe(users[2], recipes[0])
         self.assertEqual(recipes[0].liked_by, [users[0]])
+        self.assertEqual(recipes[0].like_count, 1)
+
+    def test_is_liked(self):
+        user1 = interface.create_user("user1", "user1@test.test", "1234")
+        user2 = interface.create_user("user2", "user2@test.test", "1234")
+        recipe = interface.create_recipe(user1, "recipe", "", "", None)
+
+        interface.like_recipe(user1, recipe)
+
+        self.assertTrue(interface.is_liked(user1.id, recipe.id))
+        self.assertFalse(interface.is_liked(user2.id, recipe.id))
+        self.assertFalse(interface.is_liked(user1.id, 999))
+
+        interface.stop_like_recipe(user1, recipe)
+        self.assertFalse(interface.is_liked(user1.id, recipe.id))
+
+    def test_liked_recipe_ids(self):
+        user1 = interface.create_user("user1", "user1@test.test", "1234")
+        user2 = interface.create_user("user2", "user2@test.test", "1234")
+        recipes = [interface.create_recipe(user1, f"recipe{i}", "", "", None) for i in range(3)]
+        interface.like_recipe(user1, recipes[0])
+        interface.like_recipe(user1, recipes[2])
+        interface.like_recipe(user2, recipes[1])
+
+        ids = [recipe.id for recipe in recipes] + [999]
+        self.assertEqual(interface.liked_recipe_ids(user1.id, ids), {recipes[0].id, recipes[2].id})
+        self.assertEqual(interface.liked_recipe_ids(user2.id, ids[:1]), set())
+        self.assertEqual(interface.liked_recipe_ids(user2.id, []), set())
+
+    def test_like_count(self):
+        users = [interface.create_user(f"user{i}", f"user{i}@test.test", "1234") for i in range(3)]
+        recipe1 = interface.create_recipe(users[0], "recipe1", "", "", None)
+        recipe2 = interface.create_recipe(users[0], "recipe2", "", "", None)
+        self.assertEqual(recipe1.like_count, 0)
+
+        for user in users:
+            interface.like_recipe(user, recipe1)
+        interface.like_recipe(users[0], recipe1)
+        interface.like_recipe(users[0], recipe2)
+        self.assertEqual(recipe1.like_count, 3)
+        self.assertEqual(recipe2.like_count, 1)
+
+        interface.stop_like_recipe(users[1], recipe1)
+        interface.stop_like_recipe(users[1], recipe1)
+        self.assertEqual(recipe1.like_count, 2)
+
+    def test_reconcile_like_counts(self):
+        user = interface.create_user("user", "user@test.test", "1234")
+        recipe1 = interface.create_recipe(user, "recipe1", "", "", None)
+        recipe2 = interface.create_recipe(user, "recipe2", "", "", None)
+        interface.like_recipe(user, recipe1)
+        recipe1.like_count = 10
+        recipe2.like_count = 5
+        db.session.commit()
+
+        interface.reconcile_like_counts()
+
+        self.assertEqual(recipe1.like_count, 1)
+        self.assertEqual(recipe2.like_count, 0)
 
 
 if __name__ == '__main__':
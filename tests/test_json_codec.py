@@ -0,0 +1,51 @@
+from datetime import datetime
+import json
+import unittest
+from unittest import mock
+
+from flask import jsonify
+
+from server import json_codec
+from server.main import app
+
+
+class JSONCodecTests(unittest.TestCase):
+    def setUp(self):
+        self.context = app.test_request_context('/', data=b'{"a": [1, 2.5, "\xc3\xa5", null, true]}')
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_dumps(self):
+        value = {'b': [1, 2.5, "å", None, True], 'a': {1: datetime(2021, 3, 4, 5, 6, 7)}}
+        expected = json.loads(jsonify(value).get_data())
+
+        for orjson in [json_codec.orjson, None]:
+            with mock.patch.object(json_codec, 'orjson', orjson):
+                self.assertEqual(json.loads(json_codec.dumps(value)), expected)
+                self.assertEqual(json_codec.dumps(value, sort_keys=True)[:5], b'{"a":')
+
+    def test_loads(self):
+        for orjson in [json_codec.orjson, None]:
+            with mock.patch.object(json_codec, 'orjson', orjson):
+                self.assertEqual(json_codec.loads(b'{"a": [1, "\xc3\xa5"]}'), {'a': [1, "å"]})
+                self.assertEqual(json_codec.request_json(), {'a': [1, 2.5, "å", None, True]})
+                with self.assertRaises(ValueError):
+                    json_codec.loads(b'{"a"')
+
+    def test_make_response(self):
+        response = app.make_response({'a': 1})
+        self.assertEqual((response.status_code, response.mimetype), (200, 'application/json'))
+        self.assertEqual(response.get_json(), {'a': 1})
+
+        response = app.make_response(({'msg': "error"}, 400, {'X-Test': "1"}))
+        self.assertEqual((response.status_code, response.headers['X-Test']), (400, "1"))
+        self.assertEqual(response.get_json(), {'msg': "error"})
+
+        response = app.make_response(('', 200))
+        self.assertEqual(response.get_data(), b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from server.social_graph import SocialGraph
+
+
+class SocialGraphTests(unittest.TestCase):
+    def test_friends(self):
+        graph = SocialGraph([(1, 3), (2, 1), (1, 2)])
+
+        self.assertEqual(list(graph.friends(1)), [2, 3])
+        self.assertEqual(list(graph.friends(2)), [1])
+        self.assertEqual(list(graph.friends(4)), [])
+        self.assertTrue(graph.are_friends(3, 1))
+        self.assertFalse(graph.are_friends(2, 3))
+
+    def test_add_and_remove(self):
+        graph = SocialGraph([(1, 2)])
+
+        graph.add(3, 1)
+        graph.add(1, 3)
+        self.assertEqual(list(graph.friends(1)), [2, 3])
+        self.assertEqual(list(graph.friends(3)), [1])
+
+        friends = graph.friends(1)
+        graph.remove(1, 2)
+        graph.remove(2, 4)
+        self.assertEqual(list(graph.friends(1)), [3])
+        self.assertEqual(list(graph.friends(2)), [])
+        # Arrays returned earlier are not changed
+        self.assertEqual(list(friends), [2, 3])
+
+        self.assertEqual(graph.stats(), {'users': 2, 'friendships': 1, 'memory_bytes': 8})
+
+    def test_mutual_friend_count(self):
+        graph = SocialGraph([(1, 2), (1, 3), (1, 4), (5, 2), (5, 3), (5, 6)])
+
+        self.assertEqual(graph.mutual_friend_count(1, 5), 2)
+        self.assertEqual(graph.mutual_friend_count(5, 1), 2)
+        self.assertEqual(graph.mutual_friend_count(1, 6), 0)
+
+    def test_suggestions(self):
+        graph = SocialGraph([(1, 2), (1, 3), (2, 3), (2, 4), (3, 4), (3, 5), (2, 6), (6, 7)])
+
+        self.assertEqual(graph.suggestions(1, 10), [(4, 2), (5, 1), (6, 1)])
+        self.assertEqual(graph.suggestions(1, 2), [(4, 2), (5, 1)])
+        self.assertEqual(graph.suggestions(1, 10, exclude={4}), [(5, 1), (6, 1)])
+        self.assertEqual(graph.suggestions(8, 10), [])
+
+
+if __name__ == '__main__':
+    unittest.main()